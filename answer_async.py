@@ -0,0 +1,336 @@
+"""
+Asyncio version of the answer pipeline, for serving many chat sessions from
+one process.
+
+Every turn runs on one process-wide event loop (a daemon thread), and every
+HTTP call goes through one pooled aiohttp session, so connections to the API
+are kept alive and reused across turns and sessions. Independent steps of a
+turn overlap: history loading runs alongside query embedding (or the
+keyword lookup for exact-term queries), and blocking work (SQLite, FAISS,
+file I/O) runs in worker threads. History is written by background tasks,
+off the path to the first token. Each turn records per-stage timings.
+
+Streamlit (or any sync caller) uses stream_answer(); async callers iterate
+answer_events() on the loop returned by get_loop().
+"""
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+import aiohttp
+import numpy as np
+
+import metrics
+from answer_cache import get_answer_cache
+from answer_with_rag import COMPLETIONS_MODEL, build_context, build_messages, is_follow_up, record_stream_usage
+from embedding_cache import get_cache
+from semantic_search import (EMBED_DIM, EMBED_MODEL, exact_search, index_version,
+                             is_exact_query, search_hybrid, table_hits)
+
+# Connections kept open to the API, shared by all sessions
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+REQUEST_TIMEOUT = 120
+MAX_RETRIES = 4
+# Threads for blocking steps (SQLite, FAISS, file I/O); asyncio's default
+# pool is sized by CPU count and would queue concurrent sessions
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "32"))
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_client: Optional["AsyncOpenAIClient"] = None
+_background: set = set()
+_write_locks: Dict[str, asyncio.Lock] = {}
+
+# ─────────────────────────────────────────────────────────────
+# Event loop and HTTP client
+# ─────────────────────────────────────────────────────────────
+def get_loop() -> asyncio.AbstractEventLoop:
+    """The process-wide loop, started on first use in a daemon thread."""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                loop.set_default_executor(ThreadPoolExecutor(BLOCKING_WORKERS, thread_name_prefix="answer-io"))
+                threading.Thread(target=loop.run_forever, name="answer-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+def run(coro, timeout: Optional[float] = None):
+    """Run a coroutine on the shared loop from sync code and wait for it."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result(timeout)
+
+
+class AsyncOpenAIClient:
+    """Minimal async client for the two endpoints the pipeline calls."""
+
+    def __init__(self, base_url: Optional[str] = None, api_key: Optional[str] = None,
+                 pool_size: int = HTTP_POOL_SIZE):
+        self.base_url = (base_url or os.getenv("OPENAI_API_BASE") or os.getenv("OPENAI_BASE_URL")
+                         or "https://api.openai.com/v1").rstrip("/")
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY", "")
+        self.pool_size = pool_size
+        self.requests = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Created lazily so it binds to the loop that uses it
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+                headers={"Authorization": f"Bearer {self.api_key}"},
+            )
+        return self._session
+
+    async def _post(self, path: str, payload: dict) -> aiohttp.ClientResponse:
+        endpoint = path.strip("/").split("/")[0]
+        for attempt in range(MAX_RETRIES + 1):
+            self.requests += 1
+            metrics.inc("api_requests_total", endpoint=endpoint)
+            resp = await self._get_session().post(f"{self.base_url}{path}", json=payload)
+            if resp.status == 200:
+                return resp
+            body = await resp.text()
+            resp.release()
+            if resp.status not in (429, 500, 502, 503) or attempt == MAX_RETRIES:
+                metrics.inc("api_failures_total", endpoint=endpoint)
+                raise RuntimeError(f"OpenAI {path} failed ({resp.status}): {body[:200]}")
+            metrics.inc("api_retries_total", endpoint=endpoint,
+                        reason="rate_limit" if resp.status == 429 else "server_error")
+            retry_after = resp.headers.get("Retry-After")
+            await asyncio.sleep(float(retry_after) if retry_after else 0.5 * 2 ** attempt)
+
+    async def embed(self, text: str, model: str = EMBED_MODEL) -> np.ndarray:
+        resp = await self._post("/embeddings", {"model": model, "input": text})
+        data = await resp.json()
+        metrics.record_usage(model, data.get("usage"))
+        return np.array(data["data"][0]["embedding"], dtype=np.float32)
+
+    async def embed_many(self, texts: List[str], model: str = EMBED_MODEL) -> np.ndarray:
+        """All texts in one request; rows in input order."""
+        resp = await self._post("/embeddings", {"model": model, "input": list(texts)})
+        data = await resp.json()
+        metrics.record_usage(model, data.get("usage"))
+        rows = sorted(data["data"], key=lambda d: d["index"])
+        return np.array([r["embedding"] for r in rows], dtype=np.float32).reshape(len(texts), -1)
+
+    async def chat(self, messages: List[Dict], model: str = COMPLETIONS_MODEL,
+                   temperature: float = 0.2) -> str:
+        resp = await self._post("/chat/completions", {
+            "model": model, "messages": messages, "temperature": temperature})
+        data = await resp.json()
+        metrics.record_usage(model, data.get("usage"))
+        return data["choices"][0]["message"]["content"]
+
+    async def chat_stream(self, messages: List[Dict], model: str = COMPLETIONS_MODEL,
+                          temperature: float = 0.2) -> AsyncIterator[str]:
+        resp = await self._post("/chat/completions", {
+            "model": model, "messages": messages, "temperature": temperature, "stream": True})
+        async with resp:
+            async for raw in resp.content:
+                line = raw.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                content = choices[0].get("delta", {}).get("content")
+                if content:
+                    yield content
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+def get_client() -> AsyncOpenAIClient:
+    """The shared client; call from the shared loop."""
+    global _client
+    if _client is None:
+        _client = AsyncOpenAIClient()
+    return _client
+
+def close():
+    """Finish background work and close the pooled connections."""
+    if _loop is not None:
+        flush_background()
+        if _client is not None:
+            run(_client.close())
+
+# ─────────────────────────────────────────────────────────────
+# Background work (history persistence, cache writes)
+# ─────────────────────────────────────────────────────────────
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.ensure_future(coro)
+    _background.add(task)  # keep a reference until done
+    task.add_done_callback(_background.discard)
+    return task
+
+async def _write_in_order(key: str, fn: Callable, args: tuple):
+    lock = _write_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        try:
+            await asyncio.to_thread(fn, *args)
+        except Exception as e:
+            print(f"⚠️ Background write '{key}' failed: {e}")
+
+def submit_background(fn: Callable, *args, key: str = "default"):
+    """
+    Run fn(*args) in a worker thread without waiting for it. Calls sharing a
+    key run one at a time in submission order (e.g. writes to one file).
+    """
+    get_loop().call_soon_threadsafe(lambda: _spawn(_write_in_order(key, fn, args)))
+
+async def _drain():
+    while _background:
+        await asyncio.gather(*list(_background), return_exceptions=True)
+
+def flush_background(timeout: Optional[float] = None):
+    """Wait for pending background work (tests, shutdown)."""
+    run(_drain(), timeout)
+
+# ─────────────────────────────────────────────────────────────
+# Pipeline
+# ─────────────────────────────────────────────────────────────
+class _Timer:
+    def __init__(self, timings: Dict[str, float]):
+        self.timings = timings
+        self.start = time.perf_counter()
+
+    # Stages also go to the process metrics, under the names the sync
+    # pipeline uses
+    async def stage(self, name: str, aw):
+        t0 = time.perf_counter()
+        try:
+            return await aw
+        except Exception:
+            metrics.inc(metrics.STAGE_ERRORS, stage=name)
+            raise
+        finally:
+            self.record(name, time.perf_counter() - t0)
+
+    def mark(self, name: str):
+        self.record(name, time.perf_counter() - self.start)
+
+    def record(self, name: str, seconds: float):
+        self.timings[name] = seconds * 1000
+        metrics.observe_stage(name, seconds)
+
+async def embed_query_async(text: str) -> np.ndarray:
+    cache = get_cache()
+    cached = await asyncio.to_thread(cache.get, EMBED_MODEL, text)
+    if cached is not None and cached.shape == (EMBED_DIM,):
+        return cached
+    vec = await get_client().embed(text)
+    if vec.shape != (EMBED_DIM,):
+        raise ValueError(f"Unexpected embedding shape {vec.shape}")
+    _spawn(asyncio.to_thread(cache.put, EMBED_MODEL, text, vec))
+    return vec
+
+async def _value(value):
+    return value
+
+async def answer_events(query: str, k: int = 5, chat_history: Optional[List[Dict]] = None,
+                        history_loader: Optional[Callable[[], List[Dict]]] = None,
+                        use_cache: bool = True,
+                        timings: Optional[Dict[str, float]] = None,
+                        folders: Optional[List[str]] = None) -> AsyncIterator[str]:
+    """
+    Async counterpart of answer_with_rag.answer_stream. Pass chat_history, or
+    history_loader to have it loaded concurrently with retrieval. Stage
+    timings in ms (history, lexical, embed, search, context, first_token,
+    completion, total) are written into timings as they complete. folders
+    scopes retrieval (and bypasses the answer cache, as do follow-ups: with
+    the cache on, the history is awaited before the lookup).
+    """
+    use_cache = use_cache and folders is None
+    timer = _Timer(timings if timings is not None else {})
+    if history_loader is not None and chat_history is None:
+        history_task = asyncio.ensure_future(timer.stage("history", asyncio.to_thread(history_loader)))
+    else:
+        history_task = asyncio.ensure_future(_value(chat_history or []))
+
+    try:
+        hits, qvec = None, None
+        if is_exact_query(query):
+            hits = await timer.stage("lexical", asyncio.to_thread(exact_search, query, k, folders))
+        if hits is None:
+            qvec = await timer.stage("embed", embed_query_async(query))
+            version = index_version()
+            cache = get_answer_cache()
+            use_cache = use_cache and not is_follow_up(await history_task)
+            if use_cache:
+                cached = cache.lookup(qvec, version)
+                if cached is not None:
+                    timer.mark("first_token")
+                    yield cached
+                    timer.mark("total")
+                    return
+            hits = await timer.stage("search", asyncio.to_thread(search_hybrid, query, qvec, k,
+                                                                 folders=folders))
+        hits = (await asyncio.to_thread(table_hits, query, folders)) + (hits or [])
+        context = await timer.stage("context", asyncio.to_thread(build_context, hits)) if hits else ""
+        history = await history_task
+    except BaseException:
+        history_task.cancel()
+        raise
+
+    parts = []
+    t0 = time.perf_counter()
+    messages = build_messages(query, context, history)
+    async for delta in get_client().chat_stream(messages):
+        if not parts:
+            timer.mark("first_token")
+        parts.append(delta)
+        yield delta
+    timer.record("completion", time.perf_counter() - t0)
+    timer.mark("total")
+    _spawn(asyncio.to_thread(record_stream_usage, messages, len(parts)))
+    if use_cache and qvec is not None:
+        cache.put(qvec, query, "".join(parts), version)
+
+def stream_answer(query: str, k: int = 5, chat_history: Optional[List[Dict]] = None,
+                  use_cache: bool = True, timings: Optional[Dict[str, float]] = None,
+                  folders: Optional[List[str]] = None,
+                  history_loader: Optional[Callable[[], List[Dict]]] = None) -> Iterator[str]:
+    """
+    Sync iterator over answer_events (for st.write_stream). The pipeline
+    starts on the shared loop when this is called, so the caller can render
+    while retrieval and history_loader run.
+    """
+    out: "queue.Queue" = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for delta in answer_events(query, k, chat_history, history_loader, use_cache=use_cache,
+                                             timings=timings, folders=folders):
+                out.put(delta)
+        except Exception as e:
+            out.put(e)
+        finally:
+            out.put(done)
+
+    def deltas():
+        while True:
+            item = out.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    asyncio.run_coroutine_threadsafe(pump(), get_loop())
+    return deltas()
+
+def answer(query: str, k: int = 5, chat_history: Optional[List[Dict]] = None,
+           use_cache: bool = True, timings: Optional[Dict[str, float]] = None,
+           folders: Optional[List[str]] = None) -> str:
+    return "".join(stream_answer(query, k, chat_history, use_cache, timings, folders))
@@ -0,0 +1,261 @@
+"""
+Batch question answering, for reports built from many questions at once
+(e.g. the weekly briefing).
+
+Looping over answer_with_rag.answer() pays, per question, for an embedding
+request, a search and a completion, one after the other. A batch instead:
+
+  - answers each distinct question once (case and spacing ignored)
+  - embeds every question missing from the embedding cache in one request
+  - searches them together: one matrix index.search per shard and one
+    chunk-store lookup for all candidates (search_hybrid_batch)
+  - builds each distinct context once, so questions that retrieve the
+    same chunks share it
+  - runs the completions concurrently on answer_async's pooled client,
+    with a cap on requests in flight and on requests per minute
+
+Exact-term questions and the answer cache behave as in answer(). Results
+come back in input order. The CLI writes them as JSONL, one line per
+question, as soon as the line and every line before it are done.
+
+    python answer_batch.py questions.txt --out answers.jsonl --concurrency 8 --rpm 300
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+import answer_async
+from answer_cache import get_answer_cache
+from answer_with_rag import build_context, build_messages
+from embedding_cache import get_cache
+from semantic_search import (EMBED_DIM, EMBED_MODEL, exact_search, index_version, search_hybrid_batch,
+                             table_hits)
+
+# Completions in flight at once, and started per minute (0 = no limit)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_RPM = int(os.getenv("BATCH_RPM", "300"))
+# Inputs per embeddings request (the API accepts up to 2048)
+EMBED_BATCH_MAX = 2048
+
+
+class RateLimiter:
+    """Spaces acquisitions evenly at per_minute a minute; 0 disables it."""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def _normalise(question: str) -> str:
+    return " ".join(question.lower().split())
+
+def _sources(hits) -> List[str]:
+    return [f"{m.get('filename', 'unknown.txt')}#{m.get('chunk_id', 0)}" for _, _, m in hits or []]
+
+# ─────────────────────────────────────────────────────────────
+# Pipeline
+# ─────────────────────────────────────────────────────────────
+async def embed_questions(questions: List[str]) -> np.ndarray:
+    """Vectors for questions: cached ones from the embedding cache, the rest in one request."""
+    cache = get_cache()
+    vecs = await asyncio.to_thread(cache.get_many, EMBED_MODEL, questions)
+    missing = [i for i, v in enumerate(vecs) if v is None or v.shape != (EMBED_DIM,)]
+    for start in range(0, len(missing), EMBED_BATCH_MAX):
+        part = missing[start:start + EMBED_BATCH_MAX]
+        texts = [questions[i] for i in part]
+        mat = await answer_async.get_client().embed_many(texts)
+        if mat.shape != (len(part), EMBED_DIM):
+            raise ValueError(f"Unexpected embedding shape {mat.shape}")
+        for i, vec in zip(part, mat):
+            vecs[i] = vec
+        await asyncio.to_thread(cache.put_many, EMBED_MODEL, texts, list(mat))
+    return np.vstack(vecs) if vecs else np.zeros((0, EMBED_DIM), dtype=np.float32)
+
+async def answer_all_async(questions: List[str], k: int = 5, folders: Optional[List[str]] = None,
+                           use_cache: bool = True, concurrency: int = BATCH_CONCURRENCY,
+                           rpm: float = BATCH_RPM,
+                           on_result: Optional[Callable[[int, Dict], None]] = None,
+                           timings: Optional[Dict[str, float]] = None) -> List[Dict]:
+    """
+    Answer every question; returns one dict per question, in input order:
+    question, answer, sources ("file#chunk"), cached, error. A failed
+    completion sets error and leaves the other answers unaffected.
+    on_result(i, result) is called in input order as results become ready.
+    Stage timings in ms (exact, embed, search, context, completions, total)
+    are written into timings.
+    """
+    t0 = time.perf_counter()
+    timings = timings if timings is not None else {}
+    use_cache = use_cache and folders is None
+
+    def mark(stage: str, since: float) -> float:
+        now = time.perf_counter()
+        timings[stage] = (now - since) * 1000
+        return now
+
+    # One job per distinct question; repeats share its result
+    slot: Dict[str, int] = {}
+    job_of: List[int] = []
+    jobs: List[Dict] = []
+    for q in questions:
+        key = _normalise(q)
+        if key not in slot:
+            slot[key] = len(jobs)
+            jobs.append({"question": q, "hits": None, "qvec": None, "answer": None,
+                         "cached": False, "error": None, "done": False})
+        job_of.append(slot[key])
+
+    t = time.perf_counter()
+    exact = await asyncio.to_thread(lambda: [exact_search(j["question"], k, folders) for j in jobs])
+    for job, hits in zip(jobs, exact):
+        job["hits"] = hits
+    t = mark("exact", t)
+
+    semantic = [j for j in jobs if j["hits"] is None]
+    cache, version = get_answer_cache(), None
+    if semantic:
+        qmat = await embed_questions([j["question"] for j in semantic])
+        t = mark("embed", t)
+        version = index_version()
+        for job, qvec in zip(semantic, qmat):
+            job["qvec"] = qvec
+            cached = cache.lookup(qvec, version) if use_cache else None
+            if cached is not None:
+                job.update(answer=cached, cached=True, done=True)
+        todo = [i for i, j in enumerate(semantic) if not j["done"]]
+        if todo:
+            hits = await asyncio.to_thread(search_hybrid_batch, [semantic[i]["question"] for i in todo],
+                                           qmat[todo], k, folders)
+            for i, h in zip(todo, hits):
+                semantic[i]["hits"] = h
+        t = mark("search", t)
+
+    # Questions that retrieve the same chunks, in the same order, share a context
+    pending = [j for j in jobs if not j["done"]]
+    contexts: Dict[tuple, str] = {}
+
+    def context_of(hits) -> str:
+        key = tuple(vid for vid, _, _ in hits or [])
+        if key not in contexts:
+            contexts[key] = build_context(hits) if hits else ""
+        return contexts[key]
+
+    def with_tables(job):
+        # Spreadsheet rows the question names by label go first
+        job["hits"] = table_hits(job["question"], folders) + (job["hits"] or [])
+        return context_of(job["hits"])
+
+    prompts = await asyncio.to_thread(lambda: [with_tables(j) for j in pending])
+    t = mark("context", t)
+
+    results: List[Optional[Dict]] = [None] * len(questions)
+    emitted = 0
+
+    def emit():
+        # Hand out results in input order, as far as they are ready
+        nonlocal emitted
+        while emitted < len(questions) and jobs[job_of[emitted]]["done"]:
+            job = jobs[job_of[emitted]]
+            results[emitted] = {"question": questions[emitted], "answer": job["answer"],
+                                "sources": _sources(job["hits"]), "cached": job["cached"],
+                                "error": job["error"]}
+            if on_result is not None:
+                on_result(emitted, results[emitted])
+            emitted += 1
+
+    limiter = RateLimiter(rpm)
+    gate = asyncio.Semaphore(max(1, concurrency))
+    client = answer_async.get_client()
+
+    async def complete(job: Dict, context: str):
+        try:
+            async with gate:
+                await limiter.acquire()
+                job["answer"] = await client.chat(build_messages(job["question"], context))
+            if use_cache and job["qvec"] is not None:
+                cache.put(job["qvec"], job["question"], job["answer"], version)
+        except Exception as e:
+            job["error"] = f"{type(e).__name__}: {e}"
+        job["done"] = True
+        emit()
+
+    emit()
+    await asyncio.gather(*(complete(j, c) for j, c in zip(pending, prompts)))
+    mark("completions", t)
+    mark("total", t0)
+    return results
+
+def answer_all(questions: List[str], k: int = 5, folders: Optional[List[str]] = None,
+               use_cache: bool = True, concurrency: int = BATCH_CONCURRENCY, rpm: float = BATCH_RPM,
+               on_result: Optional[Callable[[int, Dict], None]] = None,
+               timings: Optional[Dict[str, float]] = None) -> List[Dict]:
+    """Sync entry point: answer_all_async on answer_async's shared loop (on_result runs there)."""
+    return answer_async.run(answer_all_async(questions, k, folders, use_cache, concurrency, rpm,
+                                             on_result, timings))
+
+# ─────────────────────────────────────────────────────────────
+# CLI
+# ─────────────────────────────────────────────────────────────
+def read_questions(path: str) -> List[Dict]:
+    """
+    A .jsonl file of objects with a "question" field (other fields are
+    copied to the output), or plain text: one question per line, with
+    blank lines and lines starting with # skipped.
+    """
+    with open(path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    if path.endswith(".jsonl"):
+        return [json.loads(line) for line in lines if line]
+    return [{"question": line} for line in lines if line and not line.startswith("#")]
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Answer a batch of questions against the knowledge base")
+    ap.add_argument("questions", help="questions file (.txt, one per line, or .jsonl)")
+    ap.add_argument("--out", default="-", help="JSONL output path (default: stdout)")
+    ap.add_argument("--k", type=int, default=5, help="sources per question")
+    ap.add_argument("--folder", action="append", dest="folders", help="only search this Drive folder (repeatable)")
+    ap.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    ap.add_argument("--rpm", type=float, default=BATCH_RPM, help="completion requests per minute (0 = no limit)")
+    ap.add_argument("--no-cache", action="store_true", help="don't reuse or store cached answers")
+    args = ap.parse_args()
+
+    records = read_questions(args.questions)
+    out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8")
+
+    def write(i: int, result: Dict):
+        row = {"id": i + 1, **records[i], **result}
+        out.write(json.dumps(row, ensure_ascii=False) + "\n")
+        out.flush()
+
+    timings: Dict[str, float] = {}
+    try:
+        results = answer_all([r["question"] for r in records], k=args.k, folders=args.folders,
+                             use_cache=not args.no_cache, concurrency=args.concurrency, rpm=args.rpm,
+                             on_result=write, timings=timings)
+    finally:
+        answer_async.close()
+        if out is not sys.stdout:
+            out.close()
+    failed = sum(r["error"] is not None for r in results)
+    stages = "  ".join(f"{s} {timings[s]:.0f} ms" for s in ("embed", "search", "context", "completions")
+                       if s in timings)
+    print(f"{'⚠️' if failed else '✅'} {len(results)} questions: {sum(r['cached'] for r in results)} cached, "
+          f"{failed} failed, {timings['total'] / 1000:.1f}s ({stages})", file=sys.stderr)
+    sys.exit(1 if failed else 0)
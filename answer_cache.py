@@ -0,0 +1,125 @@
+"""
+Semantic cache of generated answers.
+
+A question is looked up by its embedding: if an earlier question scored at
+least `threshold` cosine similarity and was answered against the same index
+version, its answer is reused without searching or calling the LLM.
+Entries from older index versions are dropped as soon as a refresh is seen;
+others expire after `ttl` seconds or when the cache is full (least recently
+used first).
+"""
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import metrics
+
+DEFAULT_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.93"))
+DEFAULT_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+DEFAULT_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+
+
+class AnswerCache:
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, ttl: float = DEFAULT_TTL,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        # Row i of _vecs belongs to _entries[i]; vectors are unit-normalised so
+        # one matrix-vector product scores every cached question.
+        self._vecs = np.zeros((0, 0), dtype=np.float32)
+        self._entries: List[Dict] = []
+
+    @staticmethod
+    def _normalise(vec: np.ndarray) -> np.ndarray:
+        vec = np.asarray(vec, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _sync_version(self, version: str):
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self.version = version
+            self._entries = []
+            self._vecs = np.zeros((0, 0), dtype=np.float32)
+
+    def _drop(self, keep: np.ndarray):
+        self._entries = [e for e, k in zip(self._entries, keep) if k]
+        self._vecs = self._vecs[keep]
+
+    def lookup(self, qvec: np.ndarray, version: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            self._sync_version(version)
+            if self._entries:
+                fresh = np.array([now - e["created"] < self.ttl for e in self._entries])
+                if not fresh.all():
+                    self.evictions += int((~fresh).sum())
+                    self._drop(fresh)
+            if self._entries:
+                scores = self._vecs @ self._normalise(qvec)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entry = self._entries[best]
+                    entry["last_used"] = now
+                    self.hits += 1
+                    metrics.inc("cache_lookups_total", cache="answer", result="hit")
+                    return entry["answer"]
+            self.misses += 1
+            metrics.inc("cache_lookups_total", cache="answer", result="miss")
+            return None
+
+    def put(self, qvec: np.ndarray, query: str, answer: str, version: str):
+        now = time.time()
+        vec = self._normalise(qvec)
+        with self._lock:
+            self._sync_version(version)
+            if len(self._entries) >= self.max_entries:
+                lru = min(range(len(self._entries)), key=lambda i: self._entries[i]["last_used"])
+                keep = np.ones(len(self._entries), dtype=bool)
+                keep[lru] = False
+                self._drop(keep)
+                self.evictions += 1
+            self._entries.append({"query": query, "answer": answer, "created": now, "last_used": now})
+            self._vecs = vec[None, :] if not self._vecs.size else np.vstack([self._vecs, vec])
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+            self._vecs = np.zeros((0, 0), dtype=np.float32)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "threshold": self.threshold,
+        }
+
+
+_cache: Optional[AnswerCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    """Process-wide cache shared by every chat session."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnswerCache()
+    return _cache
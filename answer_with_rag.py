@@ -1,34 +1,112 @@
-from typing import List, Dict
-from semantic_search import search
-
-# OpenAI client setup
-try:
-    from openai import OpenAI
-    client = OpenAI()
-    use_client = True
-except Exception:
-    import openai
-    import os
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-    use_client = False
+import math
+import re
+import time
+from typing import List, Dict, Iterator, Optional
+import metrics
+from chunk_utils import count_tokens, overlap_length, truncate_to_tokens
+from semantic_search import embed_query, exact_search, get_openai, index_version, search_hybrid, table_hits
+from answer_cache import get_answer_cache
 
 COMPLETIONS_MODEL = "gpt-4o"
-MAX_CONTEXT_CHARS = 8000
-
-def build_context(topk: List[Dict]) -> str:
-    parts, total = [], 0
-    for r in topk:
-        fname = r[2].get("filename", "unknown.txt")
-        cid = r[2].get("chunk_id", 0)
-        text = r[2].get("text_preview", "")
-        snippet = f"[SOURCE: {fname} | CHUNK: {cid}]\n{text}\n"
-        if total + len(snippet) > MAX_CONTEXT_CHARS:
-            break
-        parts.append(snippet)
-        total += len(snippet)
-    return "\n".join(parts)
+# Prompt budget for retrieved sources, in tokens
+MAX_CONTEXT_TOKENS = 3000
+# Knapsack granularity: snippet sizes are rounded up to multiples of this
+PACK_TOKEN_STEP = 8
+# Chat turns included in the prompt
+HISTORY_TURNS = 4
+# Neighbouring chunks share at most this many chars (chunker overlap + slack)
+MAX_CHUNK_OVERLAP = 2000
+# The header file_parser writes at the top of each file (so, of chunk 0)
+_FILE_HEADER_RE = re.compile(r"\A\[FOLDER\]:.*\n\[FILE\]:.*\n*")
 
-def ask_gpt(query: str, context: str = "", chat_history: List[Dict] = []) -> str:
+def _snippet(span: Dict) -> str:
+    first, last = span["first"], span["last"]
+    cid = first if first == last else f"{first}-{last}"
+    also = f" | ALSO IN: {', '.join(span['also'])}" if span.get("also") else ""
+    return f"[SOURCE: {span['filename']} | CHUNK: {cid}{also}]\n{span['text']}\n"
+
+def merge_hits(topk: List) -> List[Dict]:
+    """
+    Turn ranked hits into source spans: identical texts are dropped, and hits
+    on consecutive chunks of one file are joined with their overlap removed.
+    A span's value is the sum of 1/(rank+1) over its hits. A hit's
+    near-duplicates in other files (collapsed at ingest) are listed in the
+    span's "also" when they hold the same text, and are hits of their own,
+    with their own text, when they don't.
+    """
+    by_file: Dict[str, List[Dict]] = {}
+    seen = set()
+    for rank, (_, _, meta) in enumerate(topk):
+        text = meta.get("text") or meta.get("text_preview", "")
+        if not text:
+            continue
+        body = _FILE_HEADER_RE.sub("", text)
+        occurrences, also = [], []
+        for src in meta.get("also_in", ()):
+            if src.get("text") and _FILE_HEADER_RE.sub("", src["text"]) != body:
+                occurrences.append((src["filename"], src["chunk_id"], src["text"], []))
+            else:
+                also.append(f"{src['filename']}#{src['chunk_id']}")
+        occurrences.insert(0, (meta.get("filename", "unknown.txt"), meta.get("chunk_id", 0), text, also))
+        for fname, chunk_id, text, also in occurrences:
+            if text in seen:
+                continue
+            seen.add(text)
+            by_file.setdefault(fname, []).append(
+                {"chunk_id": chunk_id, "text": text, "rank": rank, "also": also})
+
+    spans = []
+    for fname, hits in by_file.items():
+        hits.sort(key=lambda h: h["chunk_id"])
+        cur = None
+        for h in hits:
+            if cur is not None and h["chunk_id"] == cur["last"] + 1:
+                ov = overlap_length(cur["text"], h["text"], MAX_CHUNK_OVERLAP)
+                cur["text"] += h["text"][ov:] if ov else "\n\n" + h["text"]
+                cur["last"] = h["chunk_id"]
+                cur["rank"] = min(cur["rank"], h["rank"])
+                cur["value"] += 1.0 / (h["rank"] + 1)
+                cur["also"] += [a for a in h["also"] if a not in cur["also"]]
+            else:
+                cur = {"filename": fname, "first": h["chunk_id"], "last": h["chunk_id"],
+                       "text": h["text"], "rank": h["rank"], "value": 1.0 / (h["rank"] + 1),
+                       "also": list(h["also"])}
+                spans.append(cur)
+    return spans
+
+def _knapsack(weights: List[int], values: List[float], capacity: int) -> List[int]:
+    # 0/1 knapsack by dynamic programming over the (coarsened) token budget
+    best = [0.0] * (capacity + 1)
+    take = [[False] * (capacity + 1) for _ in weights]
+    for i, (w, v) in enumerate(zip(weights, values)):
+        for c in range(capacity, w - 1, -1):
+            if best[c - w] + v > best[c]:
+                best[c] = best[c - w] + v
+                take[i][c] = True
+    chosen, c = [], capacity
+    for i in range(len(weights) - 1, -1, -1):
+        if take[i][c]:
+            chosen.append(i)
+            c -= weights[i]
+    return chosen
+
+def build_context(topk: List, max_tokens: int = MAX_CONTEXT_TOKENS) -> str:
+    """
+    Pack the most valuable set of source spans into max_tokens. Unlike a
+    greedy cut-off, a large span that doesn't fit no longer blocks smaller,
+    lower-ranked ones; a span bigger than the whole budget is truncated.
+    """
+    spans = merge_hits(topk)
+    for span in spans:
+        header = count_tokens(_snippet(dict(span, text="")))
+        if count_tokens(span["text"]) + header > max_tokens:
+            span["text"] = truncate_to_tokens(span["text"], max(0, max_tokens - header))
+    weights = [math.ceil(count_tokens(_snippet(s)) / PACK_TOKEN_STEP) for s in spans]
+    chosen = _knapsack(weights, [s["value"] for s in spans], max_tokens // PACK_TOKEN_STEP)
+    chosen.sort(key=lambda i: spans[i]["rank"])
+    return "\n".join(_snippet(spans[i]) for i in chosen)
+
+def build_messages(query: str, context: str = "", chat_history: List[Dict] = []) -> List[Dict]:
     system = (
         "You are a smart Virtual CEO assistant. If sources are provided, answer using them and cite by filename and chunk like [CEO_Notes.txt#2]. "
         "If no sources are provided, use your general knowledge."
@@ -36,8 +114,8 @@ def ask_gpt(query: str, context: str = "", chat_history: List[Dict] = []) -> str
 
     messages = [{"role": "system", "content": system}]
 
-    # Include up to last 4 chat history turns
-    for msg in chat_history[-4:]:
+    # Include up to the last HISTORY_TURNS chat turns
+    for msg in chat_history[-HISTORY_TURNS:]:
         content = msg.get("content", "")
         timestamp = msg.get("timestamp", "")
         role = msg.get("role", "user")
@@ -51,31 +129,150 @@ def ask_gpt(query: str, context: str = "", chat_history: List[Dict] = []) -> str
         })
     else:
         messages.append({"role": "user", "content": query})
+    return messages
+
+def is_follow_up(chat_history: Optional[List[Dict]]) -> bool:
+    """True when the prompt includes earlier turns, so the answer depends on more than the query."""
+    return bool(HISTORY_TURNS and chat_history)
+
+def ask_gpt(query: str, context: str = "", chat_history: List[Dict] = []) -> str:
+    messages = build_messages(query, context, chat_history)
 
     # Call OpenAI ChatCompletion
+    metrics.inc("api_requests_total", endpoint="chat")
+    client, use_client = get_openai()
+    with metrics.span("completion"):
+        if use_client:
+            resp = client.chat.completions.create(
+                model=COMPLETIONS_MODEL,
+                messages=messages,
+                temperature=0.2,
+            )
+            metrics.record_usage(COMPLETIONS_MODEL, {
+                "prompt_tokens": resp.usage.prompt_tokens,
+                "completion_tokens": resp.usage.completion_tokens} if resp.usage else None)
+            return resp.choices[0].message.content
+        else:
+            resp = client.ChatCompletion.create(
+                model=COMPLETIONS_MODEL,
+                messages=messages,
+                temperature=0.2,
+            )
+            metrics.record_usage(COMPLETIONS_MODEL, resp.get("usage"))
+            return resp.choices[0].message["content"]
+
+def record_stream_usage(messages: List[Dict], n_deltas: int):
+    # Streamed completions carry no usage block: prompt tokens are counted
+    # locally and each delta is taken as one completion token
+    prompt = sum(count_tokens(m.get("content", "")) for m in messages)
+    metrics.record_usage(COMPLETIONS_MODEL, {"prompt_tokens": prompt, "completion_tokens": n_deltas})
+
+def ask_gpt_stream(query: str, context: str = "", chat_history: List[Dict] = []) -> Iterator[str]:
+    """Like ask_gpt, but yields the answer text in deltas as they arrive."""
+    messages = build_messages(query, context, chat_history)
+    metrics.inc("api_requests_total", endpoint="chat")
+    n = 0
+    with metrics.span("completion"):
+        for delta in _stream_deltas(messages):
+            n += 1
+            yield delta
+    record_stream_usage(messages, n)
+
+def _stream_deltas(messages: List[Dict]) -> Iterator[str]:
+    client, use_client = get_openai()
     if use_client:
-        resp = client.chat.completions.create(
+        stream = client.chat.completions.create(
             model=COMPLETIONS_MODEL,
             messages=messages,
             temperature=0.2,
+            stream=True,
         )
-        return resp.choices[0].message.content
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
     else:
-        resp = openai.ChatCompletion.create(
+        stream = client.ChatCompletion.create(
             model=COMPLETIONS_MODEL,
             messages=messages,
             temperature=0.2,
+            stream=True,
         )
-        return resp.choices[0].message["content"]
+        for chunk in stream:
+            delta = chunk["choices"][0].get("delta", {}) if chunk["choices"] else {}
+            if delta.get("content"):
+                yield delta["content"]
 
-def answer(query: str, k: int = 5, chat_history: List[Dict] = []) -> str:
-    hits = search(query, k=k)
+@metrics.timed("total")
+def answer(query: str, k: int = 5, chat_history: List[Dict] = [], use_cache: bool = True,
+           folders: Optional[List[str]] = None) -> str:
+    # Exact-term queries (codes, figures, quoted phrases) are served from the
+    # lexical index without embedding. Otherwise near-identical questions
+    # against the same index version reuse the earlier answer: no search and
+    # no completion call. folders scopes retrieval to those Drive folders;
+    # scoped answers and follow-ups bypass the answer cache, which is keyed
+    # by query only. Spreadsheet rows the question names by label go first.
+    use_cache = use_cache and folders is None and not is_follow_up(chat_history)
+    hits = exact_search(query, k, folders=folders)
+    qvec = None
+    if hits is None:
+        qvec = embed_query(query)
+        version = index_version()
+        cache = get_answer_cache()
+        if use_cache:
+            cached = cache.lookup(qvec, version)
+            if cached is not None:
+                return cached
+        with metrics.span("search"):
+            hits = search_hybrid(query, qvec, k=k, folders=folders)
+    hits = table_hits(query, folders=folders) + (hits or [])
     if not hits:
-        return ask_gpt(query, context="", chat_history=chat_history)
-    context = build_context(hits)
-    return ask_gpt(query, context=context, chat_history=chat_history)
+        reply = ask_gpt(query, context="", chat_history=chat_history)
+    else:
+        with metrics.span("context"):
+            context = build_context(hits)
+        reply = ask_gpt(query, context=context, chat_history=chat_history)
+    if use_cache and qvec is not None:
+        cache.put(qvec, query, reply, version)
+    return reply
+
+def answer_stream(query: str, k: int = 5, chat_history: List[Dict] = [],
+                  use_cache: bool = True, folders: Optional[List[str]] = None) -> Iterator[str]:
+    # Retrieval runs before the first delta; the completion is streamed.
+    # A cache hit is yielded whole; a completed stream is cached.
+    t0 = time.perf_counter()
+    use_cache = use_cache and folders is None and not is_follow_up(chat_history)
+    hits = exact_search(query, k, folders=folders)
+    qvec = None
+    if hits is None:
+        qvec = embed_query(query)
+        version = index_version()
+        cache = get_answer_cache()
+        if use_cache:
+            cached = cache.lookup(qvec, version)
+            if cached is not None:
+                metrics.observe_stage("first_token", time.perf_counter() - t0)
+                yield cached
+                metrics.observe_stage("total", time.perf_counter() - t0)
+                return
+        with metrics.span("search"):
+            hits = search_hybrid(query, qvec, k=k, folders=folders)
+    hits = table_hits(query, folders=folders) + (hits or [])
+    with metrics.span("context"):
+        context = build_context(hits) if hits else ""
+    parts = []
+    for delta in ask_gpt_stream(query, context=context, chat_history=chat_history):
+        if not parts:
+            metrics.observe_stage("first_token", time.perf_counter() - t0)
+        parts.append(delta)
+        yield delta
+    metrics.observe_stage("total", time.perf_counter() - t0)
+    if use_cache and qvec is not None:
+        cache.put(qvec, query, "".join(parts), version)
 
 # Optional CLI test
 if __name__ == "__main__":
-    from chat_ceo import load_history
-    print(answer("What are the goals for Q3 based on CEO notes?", chat_history=load_history()))
+    from chat_history import get_history_store
+    store = get_history_store()
+    recent = store.sessions(limit=1)
+    history = store.tail(recent[0]["session"], HISTORY_TURNS) if recent else []
+    print(answer("What are the goals for Q3 based on CEO notes?", chat_history=history))
@@ -0,0 +1,96 @@
+"""
+Bulk question answering: answer_with_rag.answer() in a loop vs
+answer_batch.answer_all, against the stub API and a synthetic index. Both
+runs start with cold embedding caches, with the answer cache off.
+
+    python -m benchmarks.bench_batch --questions 40 --latency 0.05 --token-latency 0.005
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import fake_openai
+from benchmarks.synthetic import make_corpus
+
+
+def fresh_embedding_cache(path: Path):
+    import embedding_cache
+    if embedding_cache._cache is not None:
+        embedding_cache._cache.close()
+    embedding_cache._cache = embedding_cache.EmbeddingCache(path)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=200)
+    ap.add_argument("--questions", type=int, default=40)
+    ap.add_argument("--repeat-share", type=float, default=0.1, help="share of questions asked twice")
+    ap.add_argument("--latency", type=float, default=0.05, help="stub API latency per request (s)")
+    ap.add_argument("--token-latency", type=float, default=0.005)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--rpm", type=float, default=0, help="completion rate limit for the batch (0 = none)")
+    args = ap.parse_args()
+
+    server, base_url = fake_openai.start_server(latency=args.latency, token_latency=args.token_latency)
+    fake_openai.point_openai_at(base_url)
+    import metrics
+    metrics.METRICS_DIR = ""
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            os.chdir(d)
+            parsed = Path("parsed_data")
+            parsed.mkdir()
+            for i, doc in enumerate(make_corpus(args.docs, 4000, seed=0)):
+                (parsed / f"doc_{i:04d}.txt").write_text(
+                    f"[FOLDER]: Dept{i % 4}\n[FILE]: doc_{i:04d}.txt\n\n{doc}", encoding="utf-8")
+            fresh_embedding_cache(Path(d) / "index_cache.sqlite")
+            import embed_and_store
+            embed_and_store.main()
+
+            import answer_async
+            import answer_batch
+            import answer_with_rag
+            rng = random.Random(1)
+            words = " ".join(make_corpus(5, 4000, seed=7)).split()
+            questions = [f"What do we know about {' '.join(rng.sample(words, 5))}?"
+                         for _ in range(args.questions)]
+            repeats = int(len(questions) * args.repeat_share)
+            questions = questions[:len(questions) - repeats] + questions[:repeats]
+
+            fresh_embedding_cache(Path(d) / "loop_cache.sqlite")
+            before = server.requests
+            t0 = time.perf_counter()
+            looped = [answer_with_rag.answer(q, use_cache=False) for q in questions]
+            loop_s, loop_requests = time.perf_counter() - t0, server.requests - before
+
+            fresh_embedding_cache(Path(d) / "batch_cache.sqlite")
+            before = server.requests
+            timings = {}
+            t0 = time.perf_counter()
+            batched = answer_batch.answer_all(questions, use_cache=False, concurrency=args.concurrency,
+                                              rpm=args.rpm, timings=timings)
+            batch_s, batch_requests = time.perf_counter() - t0, server.requests - before
+            answer_async.close()
+            assert all(r["error"] is None for r in batched), [r["error"] for r in batched if r["error"]]
+            assert len(batched) == len(looped)
+            os.chdir(cwd)
+    finally:
+        os.chdir(cwd)
+        server.shutdown()
+
+    n = len(questions)
+    print(f"{n} questions ({repeats} repeated), {args.latency * 1000:.0f} ms per request")
+    print(f"  answer() loop   {loop_s:7.2f} s  {n / loop_s:7.1f} q/s  {loop_requests} requests")
+    print(f"  answer_all      {batch_s:7.2f} s  {n / batch_s:7.1f} q/s  {batch_requests} requests  "
+          f"({loop_s / batch_s:.1f}x)")
+    print("  batch stages    " + "  ".join(f"{s} {timings[s]:.0f} ms" for s in
+                                           ("exact", "embed", "search", "context", "completions")
+                                           if s in timings))
+
+
+if __name__ == "__main__":
+    main()
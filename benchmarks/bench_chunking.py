@@ -0,0 +1,76 @@
+"""
+Chunker throughput (MB/s) and chunk-size bounds on multi-MB documents, for
+the previous paragraph-only chunker and chunk_utils.simple_chunks.
+
+Shapes: normal paragraphs, text with no blank lines (PDF page dumps), and a
+numeric table dump (df.to_string of a spreadsheet).
+
+    python -m benchmarks.bench_chunking --sizes 1 4 16
+"""
+import argparse
+import random
+import re
+import time
+from typing import Callable, Dict, List
+
+from benchmarks.synthetic import make_document
+from chunk_utils import count_tokens, simple_chunks
+
+
+def legacy_chunks(text: str, max_chars: int = 3500, overlap: int = 300) -> List[Dict]:
+    # The chunker before sentence splitting and token budgets, for comparison
+    paras = [p.strip() for p in re.split(r"\n{2,}", text) if p.strip()]
+    chunks, cur, size = [], [], 0
+    for p in paras:
+        if size + len(p) + 2 <= max_chars:
+            cur.append(p); size += len(p) + 2
+        else:
+            if cur:
+                chunks.append("\n\n".join(cur))
+            tail = "\n\n".join(cur)[-overlap:] if cur and overlap > 0 else ""
+            cur = [tail, p] if tail else [p]
+            size = len("\n\n".join(cur))
+    if cur:
+        chunks.append("\n\n".join(cur))
+    return [{"chunk_id": i, "text": c} for i, c in enumerate(chunks)]
+
+
+def make_shapes(mb: float, seed: int = 0) -> Dict[str, str]:
+    rng = random.Random(seed)
+    target = int(mb * 1e6)
+    paragraphs = make_document(rng, target)
+    rows = [" ".join(f"{rng.uniform(-1e6, 1e6):12.2f}" for _ in range(10)) for _ in range(target // 130)]
+    return {
+        "paragraphs": paragraphs,
+        "no-blank-lines": paragraphs.replace("\n\n", "\n"),
+        "table-dump": "\n".join(rows),
+    }
+
+
+def measure(fn: Callable, text: str) -> Dict:
+    t0 = time.perf_counter()
+    chunks = fn(text)
+    elapsed = time.perf_counter() - t0
+    sizes = [len(c["text"]) for c in chunks]
+    longest = max(chunks, key=lambda c: len(c["text"]))["text"]
+    return {"mb_s": len(text) / 1e6 / elapsed, "chunks": len(chunks), "max_chars": max(sizes),
+            "max_tokens": count_tokens(longest) if len(longest) < 200_000 else None}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 16], help="document sizes in MB")
+    args = ap.parse_args()
+
+    print(f"{'shape':16s} {'MB':>5s} {'chunker':8s} {'MB/s':>8s} {'chunks':>7s} {'max chars':>10s} {'max tok':>8s}")
+    for mb in args.sizes:
+        for shape, text in make_shapes(mb).items():
+            for name, fn in (("legacy", legacy_chunks), ("new", simple_chunks)):
+                r = measure(fn, text)
+                tok = "?" if r["max_tokens"] is None else r["max_tokens"]
+                print(f"{shape:16s} {mb:5.1f} {name:8s} {r['mb_s']:8.2f} {r['chunks']:7d} "
+                      f"{r['max_chars']:10d} {tok:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Near-duplicate collapsing at ingest: embed_and_store with DEDUP on vs off,
+against the stub API, over a synthetic corpus with the usual redundancy of
+a shared Drive: exact copies ("Copy of ..."), file versions with a few words
+edited, and meeting notes that paste in paragraphs of other documents.
+Each run starts from an empty index and a cold embedding cache, in its own
+process. Search latency and top-k crowding (hits that are near-duplicates
+of a better-ranked hit) are then measured against each index.
+
+    python -m benchmarks.bench_dedup --docs 120 --latency 0.05
+"""
+import argparse
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import fake_openai
+from benchmarks.synthetic import make_document, make_paragraph
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def make_files(n_docs: int, seed: int = 0):
+    """(folder, filename, text) for base documents plus copies, versions and notes."""
+    rng = random.Random(seed)
+    base = [(f"Dept{i % 4}", f"doc_{i:04d}.txt", make_document(rng, 8000)) for i in range(n_docs)]
+    files = list(base)
+    for folder, name, text in base:
+        roll = rng.random()
+        if roll < 0.2:
+            files.append((folder, f"Copy of {name}", text))
+        elif roll < 0.5:
+            words = text.split(" ")
+            for j in rng.sample(range(len(words)), max(1, len(words) // 400)):
+                words[j] = "amended"
+            files.append((folder, name.replace(".txt", "_v2.txt"), " ".join(words)))
+    for i in range(n_docs // 5):
+        folder = f"Dept{i % 4}"
+        sources = [t for f, _, t in base if f == folder]
+        paras = [p for t in rng.sample(sources, 2) for p in t.split("\n\n")[:6]]
+        notes = paras + [make_paragraph(rng) for _ in range(4)]
+        files.append((folder, f"notes_{i:03d}.txt", "\n\n".join(notes)))
+    return files
+
+
+def refresh(workdir: Path, dedup: bool) -> dict:
+    env = {**os.environ, "DEDUP": "1" if dedup else "0", "METRICS_DIR": "",
+           "PYTHONPATH": str(ROOT)}
+    t0 = time.perf_counter()
+    out = subprocess.run([sys.executable, str(ROOT / "embed_and_store.py")], cwd=workdir, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    seconds = time.perf_counter() - t0
+    found = re.search(r"(\d+) chunks to embed, (\d+) near-duplicates", out)
+    misses = re.search(r"Embedding cache: \d+ hits, (\d+) misses", out)
+    return {"seconds": seconds, "canonical": int(found.group(1)), "dupes": int(found.group(2)),
+            "embedded": int(misses.group(1))}
+
+
+def probe(workdir: Path, queries, k: int) -> dict:
+    """Search latency and crowding against the index in workdir."""
+    import numpy as np
+    import semantic_search
+    from dedup import NEAR_DUP_THRESHOLD, signature, similarity
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        semantic_search.invalidate_resources()
+        qvecs = fake_openai.fake_embeddings(queries)
+        semantic_search.search_hybrid(queries[0], qvecs[0], k)  # load the index
+        times, crowded = [], 0
+        for q, qvec in zip(queries, qvecs):
+            t0 = time.perf_counter()
+            hits = semantic_search.search_hybrid(q, np.asarray(qvec, dtype=np.float32), k)
+            times.append((time.perf_counter() - t0) * 1000)
+            sigs = [signature(m.get("text", "")) for _, _, m in hits]
+            crowded += sum(any(similarity(sigs[i], sigs[j]) >= NEAR_DUP_THRESHOLD for j in range(i))
+                           for i in range(len(sigs)))
+        vectors = sum(sh["index"].ntotal for sh in semantic_search.get_resources()[0].values())
+        size = sum(p.stat().st_size for p in semantic_search.live_dir().rglob("*") if p.is_file())
+        semantic_search.invalidate_resources()
+    finally:
+        os.chdir(cwd)
+    return {"p50": statistics.median(times), "crowded": crowded / (len(queries) * k),
+            "vectors": vectors, "bytes": size}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=120)
+    ap.add_argument("--queries", type=int, default=100)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--latency", type=float, default=0.05, help="stub API latency per request (s)")
+    args = ap.parse_args()
+
+    files = make_files(args.docs)
+    rng = random.Random(3)
+    words = " ".join(t for _, _, t in files[:20]).split()
+    queries = [" ".join(rng.sample(words, 6)) for _ in range(args.queries)]
+
+    server, base_url = fake_openai.start_server(latency=args.latency)
+    fake_openai.point_openai_at(base_url)
+    import metrics
+    metrics.METRICS_DIR = ""
+    results = {}
+    try:
+        for dedup in (False, True):
+            with tempfile.TemporaryDirectory() as d:
+                parsed = Path(d) / "parsed_data"
+                parsed.mkdir()
+                for folder, name, text in files:
+                    (parsed / name).write_text(f"[FOLDER]: {folder}\n[FILE]: {name}\n\n{text}", encoding="utf-8")
+                before = server.requests
+                r = refresh(Path(d), dedup)
+                r["requests"] = server.requests - before
+                r.update(probe(Path(d), queries, args.k))
+                results[dedup] = r
+    finally:
+        server.shutdown()
+
+    off, on = results[False], results[True]
+    print(f"{len(files)} files ({args.docs} originals), {args.latency * 1000:.0f} ms per request")
+    print(f"  {'':18}{'DEDUP=0':>12}{'DEDUP=1':>12}")
+    rows = [("chunks embedded", "embedded", "{:d}"), ("embed requests", "requests", "{:d}"),
+            ("vectors", "vectors", "{:d}"), ("index+store MB", "bytes", "{:.1f}"),
+            ("refresh s", "seconds", "{:.2f}"), ("search p50 ms", "p50", "{:.2f}"),
+            ("top-k crowded", "crowded", "{:.1%}")]
+    for label, key, fmt in rows:
+        a, b = off[key], on[key]
+        if key == "bytes":
+            a, b = a / 2 ** 20, b / 2 ** 20
+        print(f"  {label:18}{fmt.format(a):>12}{fmt.format(b):>12}")
+    print(f"  near-duplicate chunks collapsed: {on['dupes']} of {on['dupes'] + on['canonical']}")
+
+
+if __name__ == "__main__":
+    main()
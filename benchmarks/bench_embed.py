@@ -0,0 +1,49 @@
+"""
+Embedding pipeline throughput against the local fake API.
+
+    python -m benchmarks.bench_embed --chunks 400 --latency 0.08
+"""
+import argparse
+import time
+
+import fake_openai
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chunks", type=int, default=400)
+    ap.add_argument("--latency", type=float, default=0.08, help="fake per-request latency (s)")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--rate-limit-every", type=int, default=0)
+    ap.add_argument("--serial-sample", type=int, default=40, help="chunks timed on the one-by-one path")
+    args = ap.parse_args()
+
+    server, base_url = fake_openai.start_server(latency=args.latency,
+                                                rate_limit_every=args.rate_limit_every)
+    fake_openai.point_openai_at(base_url)
+    import embed_and_store
+    from benchmarks.synthetic import make_chunks
+
+    texts = make_chunks(args.chunks)
+
+    sample = texts[:args.serial_sample]
+    t0 = time.perf_counter()
+    for t in sample:
+        embed_and_store.get_embedding(t)
+    serial_rate = len(sample) / (time.perf_counter() - t0)
+
+    before = server.requests
+    t0 = time.perf_counter()
+    vecs = embed_and_store.embed_texts(texts, workers=args.workers)
+    elapsed = time.perf_counter() - t0
+    ok = sum(v is not None for v in vecs)
+
+    print(f"serial    : {serial_rate:8.1f} chunks/s  (sampled {len(sample)})")
+    print(f"batched   : {ok / elapsed:8.1f} chunks/s  ({ok}/{len(texts)} in {elapsed:.2f}s, "
+          f"{server.requests - before} requests, {server.rate_limited} rate-limited)")
+    print(f"speed-up  : {ok / elapsed / serial_rate:8.1f}x")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
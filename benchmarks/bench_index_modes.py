@@ -0,0 +1,79 @@
+"""
+Recall vs latency of each index mode against exact flat search, on a
+synthetic clustered corpus.
+
+    python -m benchmarks.bench_index_modes --n 50000 --dim 256
+"""
+import argparse
+import time
+
+import numpy as np
+import faiss
+
+from index_factory import build_index, search_parameters
+
+
+def clustered_corpus(n: int, dim: int, n_queries: int, seed: int = 0):
+    # Documents sit around topic centroids, like chunks of related files
+    rng = np.random.default_rng(seed)
+    centroids = rng.normal(size=(max(8, n // 200), dim)).astype(np.float32)
+    assign = rng.integers(0, len(centroids), size=n + n_queries)
+    pts = centroids[assign] + 0.35 * rng.normal(size=(n + n_queries, dim)).astype(np.float32)
+    return np.ascontiguousarray(pts[:n]), np.ascontiguousarray(pts[n:])
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+
+
+def time_search(index, queries, k, params):
+    threads = faiss.omp_get_max_threads()
+    faiss.omp_set_num_threads(1)  # per-query latency, as in the app
+    lat = []
+    for q in queries:
+        t0 = time.perf_counter()
+        index.search(q.reshape(1, -1), k, params=params)
+        lat.append(time.perf_counter() - t0)
+    faiss.omp_set_num_threads(threads)
+    _, found = index.search(queries, k, params=params)
+    lat_ms = np.array(lat) * 1000
+    return found, float(np.percentile(lat_ms, 50)), float(np.percentile(lat_ms, 95))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=50_000)
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    args = ap.parse_args()
+
+    xb, xq = clustered_corpus(args.n, args.dim, args.queries)
+    ids = np.arange(args.n)
+
+    sweeps = {
+        "flat": [{}],
+        "ivf": [{"nprobe": p} for p in (1, 4, 16, 64)],
+        "hnsw": [{"ef_search": e} for e in (16, 32, 64, 128)],
+        "ivfpq": [{"nprobe": p} for p in (4, 16, 64)],
+    }
+    truth = None
+    print(f"{'mode':<6} {'setting':<14} {'build s':>8} {'MB':>8} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for mode, settings in sweeps.items():
+        t0 = time.perf_counter()
+        index, params = build_index(xb, ids, mode=mode)
+        build_s = time.perf_counter() - t0
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+        for setting in settings:
+            sp = search_parameters(params, setting.get("nprobe"), setting.get("ef_search"))
+            found, p50, p95 = time_search(index, xq, args.k, sp)
+            if truth is None:
+                truth = found
+            label = ",".join(f"{k}={v}" for k, v in setting.items()) or "exact"
+            print(f"{params['mode']:<6} {label:<14} {build_s:8.2f} {size_mb:8.1f} "
+                  f"{recall_at_k(found, truth):10.3f} {p50:8.3f} {p95:8.3f}")
+
+
+if __name__ == "__main__":
+    main()
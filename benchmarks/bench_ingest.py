@@ -0,0 +1,72 @@
+"""
+Drive ingestion throughput: the one-file-at-a-time path vs the pipelined
+ingester (threaded downloads + process-pool extraction), against FakeDrive.
+
+    python -m benchmarks.bench_ingest --files 48 --download-latency 0.15
+"""
+import argparse
+import random
+import tempfile
+import time
+
+import fake_drive
+import file_parser
+from benchmarks.synthetic import make_docx_bytes, make_document, make_pdf_bytes, make_xlsx_bytes
+
+
+def build_drive(n_files: int, folders: int, download_latency: float, seed: int = 0):
+    rng = random.Random(seed)
+    drive = fake_drive.FakeDrive(list_latency=0.02, download_latency=download_latency)
+    root = drive.add_folder(file_parser.FOLDER_NAME)
+    folder_ids = [drive.add_folder(f"Dept{i}", parent=root) for i in range(folders)]
+    for i in range(n_files):
+        parent = folder_ids[i % folders]
+        kind = i % 3
+        if kind == 0:
+            drive.add_file(f"deck_{i}.pdf", parent,
+                           make_pdf_bytes([make_document(rng, 2500) for _ in range(6)]), file_parser.PDF_MIME)
+        elif kind == 1:
+            drive.add_file(f"notes_{i}.docx", parent,
+                           make_docx_bytes(make_document(rng, 12_000)), file_parser.DOCX_MIME)
+        else:
+            drive.add_file(f"plan_{i}.xlsx", parent, make_xlsx_bytes(300, seed=i), file_parser.XLSX_MIME)
+    return drive
+
+
+def run(drive, out_dir, **kwargs) -> float:
+    file_parser.OUTPUT_DIR = out_dir
+    file_parser.DRIVE_MANIFEST_PATH = f"{out_dir}/_drive_manifest.json"
+    t0 = time.perf_counter()
+    file_parser.main(full_rebuild=True, **kwargs)
+    return time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=48)
+    ap.add_argument("--folders", type=int, default=4)
+    ap.add_argument("--download-latency", type=float, default=0.15)
+    ap.add_argument("--download-workers", type=int, default=file_parser.DOWNLOAD_WORKERS)
+    ap.add_argument("--extract-workers", type=int, default=file_parser.EXTRACT_WORKERS)
+    args = ap.parse_args()
+
+    drive = build_drive(args.files, args.folders, args.download_latency)
+    file_parser.set_service_factory(drive.service)
+
+    import contextlib
+    import io
+    with contextlib.redirect_stdout(io.StringIO()):
+        with tempfile.TemporaryDirectory() as d:
+            serial = run(drive, d, download_workers=1, extract_workers=1, use_processes=False)
+        with tempfile.TemporaryDirectory() as d:
+            piped = run(drive, d, download_workers=args.download_workers,
+                        extract_workers=args.extract_workers)
+
+    print(f"serial    : {serial:7.2f}s  ({args.files / serial:6.1f} files/s)")
+    print(f"pipelined : {piped:7.2f}s  ({args.files / piped:6.1f} files/s, "
+          f"{args.download_workers} download threads, {args.extract_workers} extract processes)")
+    print(f"speed-up  : {serial / piped:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+PDF extraction speed (pages/s) per backend on generated documents, plus
+PyMuPDF split into parallel page ranges.
+
+    python -m benchmarks.bench_pdf --pages 200 --workers 4
+"""
+import argparse
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import file_parser
+from benchmarks.synthetic import make_document, make_pdf_bytes
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    text = fn(*args)
+    return time.perf_counter() - t0, len(text)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pages", type=int, default=200)
+    ap.add_argument("--workers", type=int, default=file_parser.EXTRACT_WORKERS)
+    args = ap.parse_args()
+
+    rng = random.Random(0)
+    data = make_pdf_bytes([make_document(rng, 3000) for _ in range(args.pages)])
+    print(f"{args.pages}-page PDF, {len(data) / 1e6:.1f} MB")
+
+    for name in sorted(file_parser.PDF_BACKENDS):
+        secs, chars = timed(file_parser.extract_pdf_range, data, 0, args.pages, name)
+        print(f"{name:<18}: {args.pages / secs:8.1f} pages/s  ({chars} chars)")
+
+    if "pymupdf" in file_parser.PDF_BACKENDS:
+        with ProcessPoolExecutor(args.workers) as pool:
+            pool.submit(int).result()  # start the workers outside the timing
+            secs, chars = timed(file_parser.extract_pdf_parallel, data, pool, "pymupdf")
+        print(f"{'pymupdf x' + str(args.workers) + ' ranges':<18}: {args.pages / secs:8.1f} pages/s  ({chars} chars)")
+
+
+if __name__ == "__main__":
+    main()
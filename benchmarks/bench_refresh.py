@@ -0,0 +1,97 @@
+"""
+Incremental refresh per index mode: embed_and_store.main() on a synthetic
+corpus, then an edit to one file (patched in place, or rebuilt for modes
+that cannot delete), a switch to another mode, an edit refreshed without a
+mode (shards keep theirs) and a full rebuild of one folder. Every step
+checks that each shard holds exactly the vectors the manifest tracks, in
+the mode last asked for, and that search still answers. The approximate modes' minimum corpus sizes are
+lowered so IVF shards are built at this scale.
+
+    python -m benchmarks.bench_refresh --docs 300
+"""
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import fake_openai
+from benchmarks.synthetic import make_corpus, make_sentence
+
+
+def check(label: str, seconds: float, mode: str):
+    import json
+    import embed_and_store
+    import semantic_search
+    from index_factory import reconstruct
+    semantic_search.invalidate_resources()
+    shards, store = semantic_search.get_resources()
+    manifest = json.loads((semantic_search.live_dir() / "manifest.json").read_text(encoding="utf-8"))
+    tracked = {}
+    for e in manifest["files"].values():
+        tracked.setdefault(embed_and_store.shard_slug(e.get("folder")), set()).update(v for _, v in e["chunks"])
+    for slug, sh in shards.items():
+        vids = sorted(tracked.get(slug, ()))
+        assert sh["index"].ntotal == len(vids), f"{label}: shard {slug} holds {sh['index'].ntotal}, expected {len(vids)}"
+        reconstruct(sh["index"], vids)  # raises when an ID is missing
+        assert sh["params"]["requested_mode"] == mode, f"{label}: shard {slug} is {sh['params']['requested_mode']}"
+    assert store.count() == sum(map(len, tracked.values())), f"{label}: chunk store out of step"
+    assert semantic_search.search("quarter revenue forecast", k=5), f"{label}: no search results"
+    modes = sorted({sh["params"]["mode"] for sh in shards.values()})
+    print(f"  {label:22s} {seconds:7.2f}s  {store.count():5d} vectors  shards: {', '.join(modes)}")
+    semantic_search.invalidate_resources()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=300)
+    ap.add_argument("--modes", nargs="+", default=["flat", "ivf", "hnsw"],
+                    help="ivfpq also works, with FAISS warnings about its small training set")
+    args = ap.parse_args()
+
+    import index_factory
+    import metrics
+    metrics.METRICS_DIR = ""
+    index_factory.MIN_VECTORS.update({"ivf": 100, "ivfpq": 256})  # PQ trains on >= 256 points
+    server, base_url = fake_openai.start_server(latency=0)
+    fake_openai.point_openai_at(base_url)
+    import contextlib
+    import io
+    import random
+    import embed_and_store
+    cwd = os.getcwd()
+    try:
+        for mode in args.modes:
+            other = "flat" if mode != "flat" else "ivf"
+            print(f"{mode}:")
+            with tempfile.TemporaryDirectory() as d:
+                os.chdir(d)
+                parsed = Path("parsed_data")
+                parsed.mkdir()
+                for i, doc in enumerate(make_corpus(args.docs, 4000, seed=0)):
+                    (parsed / f"doc_{i:04d}.txt").write_text(
+                        f"[FOLDER]: Dept{i % 2}\n[FILE]: doc_{i:04d}.txt\n\n{doc}", encoding="utf-8")
+                steps = [
+                    ("build", dict(index_mode=mode), None, mode),
+                    ("edit one file", dict(index_mode=mode), "doc_0000.txt", mode),
+                    (f"switch to {other}", dict(index_mode=other), None, other),
+                    ("edit, no mode given", dict(), "doc_0002.txt", other),
+                    ("full rebuild Dept1", dict(full_rebuild=True, folders=["Dept1"]), "doc_0001.txt", other),
+                ]
+                rng = random.Random(1)
+                for label, kwargs, edit, expect in steps:
+                    if edit:
+                        with open(parsed / edit, "a", encoding="utf-8") as f:
+                            f.write("\n\n" + make_sentence(rng))
+                    t0 = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        embed_and_store.main(**kwargs)
+                    check(label, time.perf_counter() - t0, expect)
+                os.chdir(cwd)
+    finally:
+        os.chdir(cwd)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
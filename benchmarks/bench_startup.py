@@ -0,0 +1,139 @@
+"""
+App startup cost: module import times and the Streamlit app's first render,
+each measured in a fresh interpreter (the median of --repeats runs).
+
+  import   `import <module>` for the chat stack and the ingestion modules,
+           with the heavy third-party packages each one drags in
+  render   chat_ceo.py under streamlit's AppTest: the login page, the first
+           render of the chat view after login, a rerun, and the first
+           question answered (against the stub API and a small index)
+
+    python -m benchmarks.bench_startup --repeats 5
+    python -m benchmarks.bench_startup --root ../old-checkout   # compare a checkout
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import fake_openai
+from benchmarks.synthetic import make_corpus
+
+ROOT = Path(__file__).resolve().parent.parent
+MODULES = ["semantic_search", "answer_with_rag", "answer_async", "chat_history", "answer_cache",
+           "metrics", "file_parser", "embed_and_store"]
+# Packages worth knowing about when they load at startup
+HEAVY = ["faiss", "openai", "aiohttp", "pymupdf", "fitz", "PyPDF2", "docx", "openpyxl",
+         "googleapiclient", "pandas", "tqdm"]
+
+_IMPORT = """
+import sys, time, json
+t0 = time.perf_counter()
+import {module}
+print(json.dumps({{"s": time.perf_counter() - t0,
+                  "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+# Each view is rendered in its own interpreter so the imports are cold
+_RENDER = """
+import json, time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=120)
+out = {{}}
+if {login}:
+    t0 = time.perf_counter(); at.run(); out["login_s"] = time.perf_counter() - t0
+else:
+    at.session_state["authenticated"] = True
+    t0 = time.perf_counter(); at.run(); out["chat_first_s"] = time.perf_counter() - t0
+    t0 = time.perf_counter(); at.run(); out["chat_rerun_s"] = time.perf_counter() - t0
+    t0 = time.perf_counter(); at.chat_input[0].set_value({question!r}).run()
+    out["first_answer_s"] = time.perf_counter() - t0
+    assert not at.exception, at.exception
+import sys
+out["heavy"] = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps(out))
+"""
+
+
+def run_child(code: str, root: Path, cwd: str) -> dict:
+    env = dict(os.environ, PYTHONPATH=str(root), METRICS_DIR="",
+               EMBED_CACHE_PATH=str(Path(cwd) / "cache.sqlite"))
+    res = subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True,
+                         text=True, timeout=600)
+    if res.returncode != 0:
+        raise RuntimeError(res.stderr.strip()[-2000:])
+    return json.loads(res.stdout.strip().splitlines()[-1])
+
+
+def build_index(root: Path, cwd: str, n_docs: int):
+    # Indexed in a child too, so this process never imports the app's modules
+    parsed = Path(cwd) / "parsed_data"
+    parsed.mkdir(exist_ok=True)
+    for i, doc in enumerate(make_corpus(n_docs, 3000, seed=0)):
+        (parsed / f"doc_{i:04d}.txt").write_text(
+            f"[FOLDER]: Dept{i % 4}\n[FILE]: doc_{i:04d}.txt\n\n{doc}", encoding="utf-8")
+    run_child("import embed_and_store, json; embed_and_store.main(); print(json.dumps({}))", root, cwd)
+
+
+def median_ms(runs, key):
+    return statistics.median(r[key] for r in runs) * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeats", type=int, default=5)
+    ap.add_argument("--docs", type=int, default=40, help="documents indexed for the first question")
+    ap.add_argument("--root", default=str(ROOT), help="checkout to measure")
+    ap.add_argument("--out", help="write the results as JSON")
+    args = ap.parse_args()
+    root = Path(args.root).resolve()
+    app = str(root / "chat_ceo.py")
+
+    server, base_url = fake_openai.start_server()
+    fake_openai.point_openai_at(base_url)  # children inherit the environment
+    results = {"import": {}, "render": {}}
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            print(f"▶ Imports ({args.repeats} cold runs each)")
+            for module in MODULES:
+                runs = [run_child(_IMPORT.format(module=module, heavy=HEAVY), root, d)
+                        for _ in range(args.repeats)]
+                ms = median_ms(runs, "s")
+                results["import"][module] = {"median_ms": round(ms, 1), "loads": runs[0]["heavy"]}
+                print(f"  {module:16s} {ms:8.1f} ms   {' '.join(runs[0]['heavy'])}")
+
+            build_index(root, d, args.docs)
+            print(f"▶ First render of chat_ceo.py ({args.repeats} cold runs)")
+            question = " ".join(random.Random(1).sample(make_corpus(1, 400, seed=1)[0].split(), 6))
+            login = [run_child(_RENDER.format(app=app, login=True, question=question, heavy=HEAVY), root, d)
+                     for _ in range(args.repeats)]
+            chat = [run_child(_RENDER.format(app=app, login=False, question=question, heavy=HEAVY), root, d)
+                    for _ in range(args.repeats)]
+            results["render"] = {
+                "login_ms": round(median_ms(login, "login_s"), 1),
+                "chat_first_ms": round(median_ms(chat, "chat_first_s"), 1),
+                "chat_rerun_ms": round(median_ms(chat, "chat_rerun_s"), 1),
+                "first_answer_ms": round(median_ms(chat, "first_answer_s"), 1),
+                "login_loads": login[0]["heavy"],
+                "chat_loads": chat[0]["heavy"],
+            }
+    finally:
+        server.shutdown()
+
+    r = results["render"]
+    print(f"  login page         {r['login_ms']:8.1f} ms   {' '.join(r['login_loads'])}")
+    print(f"  chat, first render {r['chat_first_ms']:8.1f} ms")
+    print(f"  chat, rerun        {r['chat_rerun_ms']:8.1f} ms")
+    print(f"  first answer       {r['first_answer_ms']:8.1f} ms   {' '.join(r['chat_loads'])}")
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, indent=1), encoding="utf-8")
+        print(f"✅ Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
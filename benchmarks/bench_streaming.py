@@ -0,0 +1,46 @@
+"""
+Time-to-first-token vs full-answer latency for ask_gpt / ask_gpt_stream,
+against the local stub completion server.
+
+    python -m benchmarks.bench_streaming --token-latency 0.02 --answer-tokens 200
+"""
+import argparse
+import time
+
+import fake_openai
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--first-token-latency", type=float, default=0.3)
+    ap.add_argument("--token-latency", type=float, default=0.02)
+    ap.add_argument("--answer-tokens", type=int, default=200)
+    args = ap.parse_args()
+
+    server, base_url = fake_openai.start_server(first_token_latency=args.first_token_latency,
+                                                token_latency=args.token_latency,
+                                                answer_tokens=args.answer_tokens)
+    fake_openai.point_openai_at(base_url)
+    import answer_with_rag
+
+    query = "What are our Q3 goals?"
+    t0 = time.perf_counter()
+    full = answer_with_rag.ask_gpt(query)
+    blocking = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    ttft, parts = None, []
+    for delta in answer_with_rag.ask_gpt_stream(query):
+        if ttft is None:
+            ttft = time.perf_counter() - t0
+        parts.append(delta)
+    streamed = time.perf_counter() - t0
+
+    assert "".join(parts) == full, "streamed text differs from the blocking answer"
+    print(f"blocking answer      : {blocking * 1000:8.1f} ms until anything is shown")
+    print(f"streaming first token: {ttft * 1000:8.1f} ms  ({len(parts)} deltas, done at {streamed * 1000:.1f} ms)")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
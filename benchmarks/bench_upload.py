@@ -0,0 +1,91 @@
+"""
+Drive upload throughput: the per-file path (a folder lookup per path segment
+and a files().list per file, one upload at a time) vs gdrive_uploader's bulk
+sync_folder, against FakeDrive. Runs a first upload, a re-sync with nothing
+changed, and a re-sync after editing a tenth of the files.
+
+    python -m benchmarks.bench_upload --files 120 --latency 0.05
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+import fake_drive
+import gdrive_uploader
+from benchmarks.synthetic import make_document
+
+DRIVE_ROOT = "AI_CEO_KnowledgeBase"
+
+
+def build_tree(root: str, n_files: int, folders: int, chars: int, seed: int = 0):
+    rng = random.Random(seed)
+    paths = []
+    for i in range(n_files):
+        folder = os.path.join(root, f"Dept{i % folders}", f"Team{i % 3}")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"notes_{i:04d}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(make_document(rng, chars))
+        paths.append(path)
+    return paths
+
+
+def per_file(local_dir: str):
+    # What callers had to do before sync_folder, without any caching
+    service = gdrive_uploader.get_service()
+    for dirpath, _, filenames in os.walk(local_dir):
+        rel = os.path.relpath(dirpath, local_dir)
+        for name in sorted(filenames):
+            gdrive_uploader._folder_ids.clear()
+            folder_id = gdrive_uploader.resolve_path(service, f"{DRIVE_ROOT}/{rel}")
+            gdrive_uploader.upload_or_update_file(service, os.path.join(dirpath, name), folder_id)
+
+
+def timed(drive, fn, *args, **kwargs):
+    drive.calls.clear()
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn(*args, **kwargs)
+    return time.perf_counter() - t0, dict(drive.calls)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=120)
+    ap.add_argument("--folders", type=int, default=4)
+    ap.add_argument("--chars", type=int, default=20_000)
+    ap.add_argument("--latency", type=float, default=0.05, help="per Drive request / upload chunk (s)")
+    ap.add_argument("--workers", type=int, default=gdrive_uploader.UPLOAD_WORKERS)
+    args = ap.parse_args()
+
+    rows = []
+    for label in ("per-file", "sync_folder"):
+        drive = fake_drive.FakeDrive(list_latency=args.latency, upload_latency=args.latency)
+        gdrive_uploader.set_service_factory(drive.service)
+        with tempfile.TemporaryDirectory() as d:
+            paths = build_tree(d, args.files, args.folders, args.chars)
+            if label == "per-file":
+                run = lambda: per_file(d)
+            else:
+                run = lambda: gdrive_uploader.sync_folder(d, DRIVE_ROOT, workers=args.workers)
+            rows.append((label, "first upload", *timed(drive, run)))
+            rows.append((label, "unchanged", *timed(drive, run)))
+            edited = paths[::10]
+            for path in edited:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(" (edited)")
+            rows.append((label, f"{len(edited)} edited", *timed(drive, run)))
+    gdrive_uploader.set_service_factory(None)
+
+    print(f"{args.files} files in {args.folders * 3} folders, {args.latency * 1000:.0f} ms per request")
+    for label, case, elapsed, calls in rows:
+        detail = " ".join(f"{k}={v}" for k, v in sorted(calls.items()))
+        print(f"  {label:12s} {case:14s} {elapsed:7.2f} s   {detail}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Load test: N concurrent chat sessions against the local stub API, comparing
+the threaded sync pipeline (answer_with_rag.answer_stream) with the asyncio
+one (answer_async). Builds a small synthetic knowledge base in a temp dir.
+
+    python -m benchmarks.load_chat --sessions 50 --turns 3 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+import fake_openai
+from benchmarks.synthetic import make_corpus, make_sentence
+
+
+def build_kb(n_docs: int):
+    Path("parsed_data").mkdir(exist_ok=True)
+    for i, doc in enumerate(make_corpus(n_docs, 6000)):
+        Path(f"parsed_data/doc_{i:03d}.txt").write_text(f"[FOLDER]: Bench\n[FILE]: doc_{i:03d}.txt\n\n{doc}")
+    import embed_and_store
+    embed_and_store.main()
+
+
+def questions(sessions: int, turns: int, seed: int = 0) -> List[List[str]]:
+    # Distinct questions, so neither cache short-circuits the pipeline
+    rng = random.Random(seed)
+    return [[f"{make_sentence(rng)} ({s}.{t})" for t in range(turns)] for s in range(sessions)]
+
+
+def run_sync(qs: List[List[str]], k: int) -> List[Dict]:
+    import answer_with_rag
+
+    def session(turns: List[str]) -> List[Dict]:
+        history, rows = [], []
+        for q in turns:
+            t0 = time.perf_counter()
+            first, parts = None, []
+            for delta in answer_with_rag.answer_stream(q, k=k, chat_history=history, use_cache=False):
+                if first is None:
+                    first = (time.perf_counter() - t0) * 1000
+                parts.append(delta)
+            rows.append({"first_token": first, "total": (time.perf_counter() - t0) * 1000})
+            history += [{"role": "user", "content": q}, {"role": "assistant", "content": "".join(parts)}]
+        return rows
+
+    with ThreadPoolExecutor(len(qs)) as pool:
+        return [r for rows in pool.map(session, qs) for r in rows]
+
+
+def run_async(qs: List[List[str]], k: int) -> List[Dict]:
+    import answer_async
+
+    async def session(turns: List[str]) -> List[Dict]:
+        history, rows = [], []
+        for q in turns:
+            timings: Dict[str, float] = {}
+            parts = [d async for d in answer_async.answer_events(
+                q, k=k, history_loader=lambda: list(history), use_cache=False, timings=timings)]
+            rows.append(timings)
+            history += [{"role": "user", "content": q}, {"role": "assistant", "content": "".join(parts)}]
+        return rows
+
+    async def all_sessions():
+        results = await asyncio.gather(*(session(t) for t in qs))
+        return [r for rows in results for r in rows]
+
+    return answer_async.run(all_sessions())
+
+
+def report(name: str, rows: List[Dict], wall: float):
+    print(f"\n{name}: {len(rows)} turns in {wall:.2f}s ({len(rows) / wall:.1f} turns/s)")
+    stages = [s for s in ("history", "lexical", "embed", "search", "context", "first_token",
+                          "completion", "total") if any(s in r for r in rows)]
+    for stage in stages:
+        vals = np.array([r[stage] for r in rows if r.get(stage) is not None])
+        print(f"  {stage:12s} p50 {np.percentile(vals, 50):8.1f} ms   p95 {np.percentile(vals, 95):8.1f} ms")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sessions", type=int, default=20)
+    ap.add_argument("--turns", type=int, default=3)
+    ap.add_argument("--docs", type=int, default=40)
+    ap.add_argument("--k", type=int, default=7)
+    ap.add_argument("--latency", type=float, default=0.05, help="stub API latency per request")
+    ap.add_argument("--first-token-latency", type=float, default=0.2)
+    ap.add_argument("--token-latency", type=float, default=0.005)
+    ap.add_argument("--answer-tokens", type=int, default=80)
+    ap.add_argument("--mode", choices=["sync", "async", "both"], default="both")
+    args = ap.parse_args()
+
+    server, base_url = fake_openai.start_server(latency=args.latency,
+                                                first_token_latency=args.first_token_latency,
+                                                token_latency=args.token_latency,
+                                                answer_tokens=args.answer_tokens)
+    fake_openai.point_openai_at(base_url)
+    with tempfile.TemporaryDirectory() as d:
+        os.chdir(d)
+        os.environ["EMBED_CACHE_PATH"] = str(Path(d) / "cache.sqlite")
+        build_kb(args.docs)
+        import answer_async  # imported and started up front, outside the timed runs
+        answer_async.get_loop()
+        qs = questions(args.sessions, args.turns)
+        print(f"{args.sessions} sessions x {args.turns} turns, stub latency {args.latency * 1000:.0f} ms")
+        if args.mode in ("sync", "both"):
+            t0 = time.perf_counter()
+            rows = run_sync(qs, args.k)
+            report("sync (thread per session)", rows, time.perf_counter() - t0)
+        if args.mode in ("async", "both"):
+            qs = questions(args.sessions, args.turns, seed=1)
+            t0 = time.perf_counter()
+            rows = run_async(qs, args.k)
+            report("async (shared loop, pooled client)", rows, time.perf_counter() - t0)
+            print(f"  HTTP requests: {answer_async.get_client().requests}")
+        answer_async.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
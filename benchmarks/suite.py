@@ -0,0 +1,292 @@
+"""
+Offline benchmark suite: chunking, the embedding pipeline, index builds and
+search latency across corpus sizes, with JSON results for comparing runs.
+
+Everything runs locally and deterministically: synthetic documents
+(benchmarks.synthetic), the fake OpenAI API with its feature-hashed
+embedder (fake_openai), and a fresh temp directory and embedding cache per
+corpus size. For each size:
+
+  chunk      chunk_utils.simple_chunks over the corpus (MB/s)
+  embed      embed_and_store.embed_texts against the stub API (chunks/s)
+  index      build_index per mode: build time, serialized size, RSS growth,
+             single-query search p50/p95/p99 and recall@k against flat
+  retrieval  embed_and_store.main() on the corpus (all embeddings cached),
+             then semantic_search.search p50/p95/p99 per search mode, and
+             hybrid without the re-ranking stage
+
+    python -m benchmarks.suite --sizes 100 500 2000 --out bench.json
+    python -m benchmarks.suite --sizes 100 500 --baseline bench.json   # flag regressions
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import fake_openai
+from benchmarks.synthetic import make_corpus, make_sentence
+
+# Metrics where a larger value is a regression; everything else numeric
+# that ends in "_per_s" is a throughput, where smaller is a regression.
+_LOWER_IS_BETTER = ("_ms", "_s", "_mb")
+# Too noisy to gate on (allocator and page-cache effects)
+_NOT_COMPARED = ("rss_growth_mb",)
+
+
+def percentiles(samples_s: List[float]) -> Dict[str, float]:
+    ms = np.asarray(samples_s) * 1000
+    return {f"p{q}_ms": round(float(np.percentile(ms, q)), 4) for q in (50, 95, 99)}
+
+
+def rss_mb() -> Optional[float]:
+    # Resident set size (Linux); None elsewhere
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        return None
+
+
+def make_queries(n: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    return [make_sentence(rng) for _ in range(n)]
+
+
+# ─────────────────────────────────────────────────────────────
+# Stages
+# ─────────────────────────────────────────────────────────────
+def bench_chunking(docs: List[str]) -> Dict:
+    from chunk_utils import simple_chunks
+    t0 = time.perf_counter()
+    chunks = [c["text"] for d in docs for c in simple_chunks(d)]
+    elapsed = time.perf_counter() - t0
+    mb = sum(map(len, docs)) / 1e6
+    return {"chunks": len(chunks), "corpus_mb": round(mb, 3), "elapsed_s": round(elapsed, 4),
+            "mb_per_s": round(mb / elapsed, 3)}, chunks
+
+
+def bench_embedding(server, chunks: List[str]) -> Dict:
+    import embed_and_store
+    before = server.requests
+    t0 = time.perf_counter()
+    vecs = embed_and_store.embed_texts(chunks)
+    elapsed = time.perf_counter() - t0
+    ok = [v for v in vecs if v is not None]
+    return {"chunks": len(chunks), "embedded": len(ok), "requests": server.requests - before,
+            "elapsed_s": round(elapsed, 4), "chunks_per_s": round(len(ok) / elapsed, 1)}, np.vstack(ok)
+
+
+def bench_index(vecs: np.ndarray, queries: np.ndarray, modes: List[str], k: int) -> Dict:
+    import faiss
+    from index_factory import build_index, search_parameters
+    ids = np.arange(len(vecs))
+    threads = faiss.omp_get_max_threads()
+    faiss.omp_set_num_threads(1)  # per-query latency, as in the app
+    out, truth = {}, None
+    try:
+        for mode in modes:
+            rss0 = rss_mb()
+            t0 = time.perf_counter()
+            index, params = build_index(vecs, ids, mode=mode)
+            build_s = time.perf_counter() - t0
+            rss1 = rss_mb()
+            sp = search_parameters(params)
+            lat, found = [], []
+            for q in queries:
+                t0 = time.perf_counter()
+                _, I = index.search(q.reshape(1, -1), k, params=sp)
+                lat.append(time.perf_counter() - t0)
+                found.append(I[0])
+            if truth is None and params["mode"] == "flat":
+                truth = found
+            recall = (float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+                      if truth is not None else None)
+            out[mode] = {"effective_mode": params["mode"], "build_s": round(build_s, 4),
+                         "index_mb": round(faiss.serialize_index(index).nbytes / 1e6, 3),
+                         "rss_growth_mb": round(rss1 - rss0, 1) if rss0 is not None else None,
+                         f"recall_at_{k}": round(recall, 4) if recall is not None else None,
+                         **percentiles(lat)}
+            del index
+    finally:
+        faiss.omp_set_num_threads(threads)
+    return out
+
+
+def bench_retrieval(docs: List[str], queries: List[str], k: int) -> Dict:
+    import embed_and_store
+    import semantic_search
+    parsed = Path("parsed_data")
+    parsed.mkdir(exist_ok=True)
+    for i, doc in enumerate(docs):
+        folder = f"Dept{i % 4}"
+        (parsed / f"doc_{i:05d}.txt").write_text(
+            f"[FOLDER]: {folder}\n[FILE]: doc_{i:05d}.txt\n\n{doc}", encoding="utf-8")
+    t0 = time.perf_counter()
+    embed_and_store.main()
+    refresh_s = time.perf_counter() - t0
+    semantic_search.invalidate_resources()
+    semantic_search.get_resources()
+    for q in queries:
+        semantic_search.embed_query(q)  # cached, so latency excludes the API
+    out = {"refresh_s": round(refresh_s, 4)}
+    for mode in semantic_search.SEARCH_MODES:
+        lat = []
+        for q in queries:
+            t0 = time.perf_counter()
+            semantic_search.search(q, k=k, mode=mode)
+            lat.append(time.perf_counter() - t0)
+        out[mode] = percentiles(lat)
+    # Cost of the re-ranking stage: hybrid with the first stage only
+    lat = []
+    for q in queries:
+        t0 = time.perf_counter()
+        semantic_search.search(q, k=k, mode="hybrid", rerank_hits=False)
+        lat.append(time.perf_counter() - t0)
+    out["hybrid_first_stage"] = percentiles(lat)
+    return out
+
+
+def run_size(server, n_docs: int, args) -> Dict:
+    import embed_and_store
+    import semantic_search
+    docs = make_corpus(n_docs, args.doc_chars, seed=n_docs)
+    result = {"docs": n_docs}
+    result["chunk"], chunks = bench_chunking(docs)
+    result["embed"], vecs = bench_embedding(server, chunks)
+    qtexts = make_queries(args.queries, seed=n_docs + 1)
+    qvecs = fake_openai.fake_embeddings(qtexts)
+    result["index"] = bench_index(vecs, qvecs, args.modes, args.k)
+    result["retrieval"] = bench_retrieval(docs, qtexts, args.k)
+    # Release this size's resident state before the next one
+    embed_and_store.store.close()
+    embed_and_store.store = None
+    semantic_search.invalidate_resources()
+    return result
+
+
+# ─────────────────────────────────────────────────────────────
+# Comparison
+# ─────────────────────────────────────────────────────────────
+def _flatten(d: Dict, prefix: str = "") -> Dict[str, float]:
+    out = {}
+    for key, value in d.items():
+        name = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            out.update(_flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[name] = float(value)
+    return out
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float, min_delta_ms: float = 1.0) -> List[str]:
+    """
+    Metrics that got worse than the baseline by more than tolerance (a
+    fraction). Timings that moved by less than min_delta_ms are ignored:
+    sub-millisecond tails are mostly scheduler noise.
+    """
+    cur, base = _flatten(current["results"]), _flatten(baseline["results"])
+    worse = []
+    for name, old in sorted(base.items()):
+        new = cur.get(name)
+        if new is None or old <= 0 or name.endswith(_NOT_COMPARED):
+            continue
+        if name.endswith("_per_s"):
+            change = (old - new) / old
+        elif name.endswith(_LOWER_IS_BETTER):
+            change = (new - old) / old
+            scale = 1.0 if name.endswith("_ms") else 1000.0 if name.endswith("_s") else None
+            if scale is not None and (new - old) * scale < min_delta_ms:
+                continue
+        else:
+            continue  # counts, recall, sizes of the corpus
+        if change > tolerance:
+            worse.append(f"{name}: {old:g} -> {new:g} ({change:+.0%})")
+    return worse
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=Path(__file__).resolve().parent, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 2000], help="corpus sizes in documents")
+    ap.add_argument("--doc-chars", type=int, default=6000)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--modes", nargs="+", default=["flat", "ivf", "hnsw"])
+    ap.add_argument("--latency", type=float, default=0.0, help="stub API latency per request (s)")
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--baseline", help="earlier results JSON to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before flagging")
+    ap.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore smaller absolute slowdowns")
+    args = ap.parse_args()
+    out_path = Path(args.out).resolve()
+    baseline_path = Path(args.baseline).resolve() if args.baseline else None
+
+    import faiss
+    import embedding_cache
+    import metrics
+    metrics.METRICS_DIR = ""  # keep snapshots out of the temp dirs
+    server, base_url = fake_openai.start_server(latency=args.latency)
+    fake_openai.point_openai_at(base_url)
+    results = {}
+    cwd = os.getcwd()
+    try:
+        for n_docs in args.sizes:
+            with tempfile.TemporaryDirectory() as d:
+                os.chdir(d)
+                # Cold embedding cache per size
+                embedding_cache._cache = embedding_cache.EmbeddingCache(Path(d) / "cache.sqlite")
+                print(f"▶ {n_docs} documents")
+                results[str(n_docs)] = r = run_size(server, n_docs, args)
+                embedding_cache._cache.close()
+                os.chdir(cwd)
+            print(f"  chunk {r['chunk']['mb_per_s']} MB/s · embed {r['embed']['chunks_per_s']} chunks/s · "
+                  f"refresh {r['retrieval']['refresh_s']} s")
+            for mode, m in r["index"].items():
+                print(f"  index {mode:6s} build {m['build_s']:.3f}s  {m['index_mb']:.1f} MB  "
+                      f"p50 {m['p50_ms']:.3f} ms  p99 {m['p99_ms']:.3f} ms")
+            for mode in ("vector", "lexical", "hybrid", "hybrid_first_stage"):
+                m = r["retrieval"][mode]
+                print(f"  search {mode:18s} p50 {m['p50_ms']:.2f} ms  p95 {m['p95_ms']:.2f} ms  "
+                      f"p99 {m['p99_ms']:.2f} ms")
+    finally:
+        os.chdir(cwd)
+        server.shutdown()
+
+    report = {
+        "meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": git_commit(),
+                 "python": sys.version.split()[0], "platform": platform.platform(),
+                 "faiss": getattr(faiss, "__version__", None), "numpy": np.__version__,
+                 "args": vars(args)},
+        "results": results,
+    }
+    out_path.write_text(json.dumps(report, indent=1), encoding="utf-8")
+    print(f"✅ Results written to {out_path}")
+    if baseline_path:
+        worse = compare(report, json.loads(baseline_path.read_text(encoding="utf-8")), args.tolerance,
+                        args.min_delta_ms)
+        if worse:
+            print(f"⚠️ {len(worse)} regression(s) beyond {args.tolerance:.0%}:")
+            for line in worse:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"✅ No regressions beyond {args.tolerance:.0%} against {baseline_path.name}")
+
+
+if __name__ == "__main__":
+    main()
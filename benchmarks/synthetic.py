@@ -0,0 +1,88 @@
+"""Deterministic synthetic business text for offline benchmarks."""
+import random
+from typing import List
+
+_WORDS = (
+    "revenue margin pipeline hiring roadmap board quarter forecast churn budget "
+    "investor runway launch customer partner pricing contract renewal headcount "
+    "strategy risk compliance audit vendor product market growth retention "
+    "engineering sales marketing finance operations legal security cloud data"
+).split()
+_NAMES = ["Alice", "Bikram", "Chen", "Dana", "Emeka", "Farah", "Goran", "Hana"]
+
+
+def make_sentence(rng: random.Random) -> str:
+    words = [rng.choice(_WORDS) for _ in range(rng.randint(8, 20))]
+    if rng.random() < 0.3:
+        words.insert(rng.randrange(len(words)), rng.choice(_NAMES))
+    if rng.random() < 0.2:
+        words.append(f"${rng.randint(1, 999)}k")
+    return " ".join(words).capitalize() + "."
+
+
+def make_paragraph(rng: random.Random) -> str:
+    return " ".join(make_sentence(rng) for _ in range(rng.randint(2, 7)))
+
+
+def make_document(rng: random.Random, target_chars: int) -> str:
+    paras, size = [], 0
+    while size < target_chars:
+        p = make_paragraph(rng)
+        paras.append(p)
+        size += len(p) + 2
+    return "\n\n".join(paras)
+
+
+def make_corpus(n_docs: int, doc_chars: int = 6000, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return [make_document(rng, doc_chars) for _ in range(n_docs)]
+
+
+def make_chunks(n: int, chars: int = 3000, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return [make_document(rng, chars)[:chars] for _ in range(n)]
+
+
+# ─────────────────────────────────────────────────────────────
+# Office documents
+# ─────────────────────────────────────────────────────────────
+def make_docx_bytes(text: str) -> bytes:
+    import io
+    import docx
+    doc = docx.Document()
+    for para in text.split("\n\n"):
+        doc.add_paragraph(para)
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+
+def make_pdf_bytes(pages: List[str]) -> bytes:
+    try:
+        import pymupdf
+    except ImportError:  # PyMuPDF < 1.24
+        import fitz as pymupdf
+    pdf = pymupdf.open()
+    for text in pages:
+        page = pdf.new_page()
+        page.insert_textbox(pymupdf.Rect(36, 36, 576, 806), text, fontsize=9)
+    data = pdf.tobytes()
+    pdf.close()
+    return data
+
+
+def make_xlsx_bytes(n_rows: int, seed: int = 0, sheets: int = 1) -> bytes:
+    import io
+    from openpyxl import Workbook
+    rng = random.Random(seed)
+    wb = Workbook(write_only=True)
+    for s in range(sheets):
+        ws = wb.create_sheet(f"Sheet{s + 1}")
+        ws.append(["Month", "Region", "Revenue", "Cost", "Headcount", "Notes"])
+        for i in range(n_rows):
+            ws.append([f"2025-{i % 12 + 1:02d}", rng.choice(["NA", "EU", "APAC"]),
+                       rng.randint(10_000, 900_000), rng.randint(5_000, 400_000),
+                       rng.randint(5, 400), make_sentence(rng)])
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
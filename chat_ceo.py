@@ -1,12 +1,7 @@
-import json
+import math
 from pathlib import Path
 from datetime import datetime
 import streamlit as st
-import pandas as pd
-
-import file_parser
-import embed_and_store
-from answer_with_rag import answer
 
 # ──────────────────────────────────
 # Login System
@@ -37,40 +32,98 @@ if not st.session_state["authenticated"]:
     login()
     st.stop()
 
+# The chat stack is imported past the login gate, so the login page renders
+# without it; ingestion (file_parser, embed_and_store) runs in refresh_jobs'
+# worker process.
+import answer_async
+import metrics
+import refresh_jobs
+from answer_cache import get_answer_cache
+from answer_with_rag import HISTORY_TURNS
+from chat_history import get_history_store, new_session_id
+from semantic_search import list_folders
+
 # ──────────────────────────────────
 # Constants
 # ──────────────────────────────────
-HIST_PATH = Path("chat_history.json")
-REFRESH_PATH = Path("last_refresh.txt")
 UPLOAD_DIR = Path("docs")
 UPLOAD_DIR.mkdir(exist_ok=True)
+CHAT_TAIL_TURNS = 50    # messages rendered in the chat view
+HISTORY_PAGE_SIZE = 20  # messages per page in View History
 
 # ──────────────────────────────────
 # Helper Functions
 # ──────────────────────────────────
-def load_history():
-    if HIST_PATH.exists():
-        return json.loads(HIST_PATH.read_text(encoding="utf-8"))
-    return []
+def get_session_id():
+    # Each browser session is its own conversation log
+    if "chat_session" not in st.session_state:
+        st.session_state["chat_session"] = new_session_id()
+    return st.session_state["chat_session"]
+
+def load_history(n=CHAT_TAIL_TURNS):
+    return get_history_store().tail(get_session_id(), n)
+
+def prior_turns_loader(user_turn, n=HISTORY_TURNS):
+    # The loader runs off the script thread, so the session is read here
+    session = get_session_id()
 
-def save_history(history):
-    HIST_PATH.write_text(json.dumps(history, ensure_ascii=False, indent=2), encoding="utf-8")
+    def load():
+        # Earlier turns only, as the question goes last in the prompt; its own
+        # append runs in the background and may have landed
+        turns = get_history_store().tail(session, n + 1)
+        if turns and turns[-1] == user_turn:
+            turns.pop()
+        return turns[-n:]
+    return load
 
-def reset_chat():
-    if HIST_PATH.exists():
-        HIST_PATH.unlink()
+def append_turns(turns):
+    # Appends run in the background, in order, off the path to the answer
+    answer_async.submit_background(get_history_store().append, get_session_id(), turns,
+                                   key="chat_history")
 
-def save_refresh_time():
-    REFRESH_PATH.write_text(datetime.now().strftime('%b-%d-%Y %I:%M %p'))
+def reset_chat(session):
+    answer_async.submit_background(get_history_store().delete_session, session, key="chat_history")
 
-def load_refresh_time():
-    if REFRESH_PATH.exists():
-        return REFRESH_PATH.read_text()
-    return "Never"
+def folder_options():
+    try:
+        return list_folders()
+    except FileNotFoundError:
+        return []  # nothing indexed yet
 
-def export_history_to_csv(history: list) -> bytes:
-    df = pd.DataFrame(history)
-    return df.to_csv(index=False).encode('utf-8')
+def show_job(job):
+    """Progress of a refresh job, one bar per stage."""
+    state = job["state"]
+    started = datetime.fromtimestamp(job["created"]).strftime('%b-%d-%Y %I:%M %p')
+    st.markdown(f"**Refresh started {started}** · `{state}`")
+    for name, s in job["stages"].items():
+        done, total = s.get("done", 0), s.get("total")
+        rate = f" · {s['rate']:.1f} {s['unit']}/s" if s.get("rate") else ""
+        count = f"{done} / {total}" if total else f"{done}"
+        label = f"{name}: {count} {s['unit']}{rate} · {s.get('elapsed_s', 0):.0f}s"
+        st.progress(min(done / total, 1.0) if total else (1.0 if s.get("finished") else 0.0), text=label)
+    if state == "succeeded":
+        st.success("✅ Data refreshed and embedded successfully.")
+    elif state == "failed":
+        st.error(f"❌ Failed: {job['error']}")
+    elif state == "cancelled":
+        st.warning("⏹️ Cancelled; the previous knowledge base is still in use.")
+
+@st.fragment(run_every=1.0)
+def refresh_status():
+    # Polls the job file; the whole page reruns when a job ends
+    job = refresh_jobs.latest_job()
+    running = job is not None and job["state"] not in refresh_jobs.FINAL_STATES
+    if st.session_state.get("refresh_running") and not running:
+        st.session_state["refresh_running"] = False
+        st.rerun()
+    st.session_state["refresh_running"] = running
+    if job is None:
+        return
+    show_job(job)
+    if running:
+        st.button("⏹️ Cancel Refresh", on_click=refresh_jobs.cancel_job, args=(job["id"],))
+    with st.expander("Log"):
+        st.code(refresh_jobs.read_log(job["id"], 5000) or "(empty)")
 
 # ──────────────────────────────────
 # Page & Sidebar
@@ -83,52 +136,105 @@ if st.sidebar.button("🔓 Logout"):
     st.session_state["authenticated"] = False
     st.rerun()  # Updated here
 
-mode = st.sidebar.radio("Navigation", ["💬 New Chat", "📜 View History", "🔁 Refresh Data"])
+mode = st.sidebar.radio("Navigation", ["💬 New Chat", "📜 View History", "🔁 Refresh Data", "📈 Metrics"])
+_answer_stats = get_answer_cache().stats()
+st.sidebar.caption(f"⚡ Answer cache: {_answer_stats['hits']} hits / "
+                   f"{_answer_stats['hits'] + _answer_stats['misses']} questions "
+                   f"({_answer_stats['hit_rate']:.0%})")
 
 # ──────────────────────────────────
 # Mode: Refresh Embeddings from Drive
 # ──────────────────────────────────
 if mode == "🔁 Refresh Data":
     st.title("🔁 Refresh AI Knowledge Base")
-    st.caption("This will re-parse documents and re-embed knowledge vectors.")
-    st.markdown(f"🧓 **Last Refreshed:** {load_refresh_time()}")
+    st.caption("Only new or changed documents are re-parsed and re-embedded. Refreshes run in the "
+               "background; answers come from the current knowledge base until the new one is ready.")
+    st.markdown(f"🧓 **Last Refreshed:** {refresh_jobs.load_refresh_time()}")
+    full_rebuild = st.checkbox("Full rebuild (re-download and re-embed everything)")
 
-    if st.button("🚀 Run File Parser + Embedder"):
-        with st.spinner("Refreshing knowledge base..."):
-            try:
-                file_parser.main()
-                embed_and_store.main()
-                save_refresh_time()
-                st.success("✅ Data refreshed and embedded successfully.")
-                st.markdown(f"🧓 **Last Refreshed:** {load_refresh_time()}")
-            except Exception as e:
-                st.error(f"❌ Failed: {e}")
+    if st.button("🚀 Run File Parser + Embedder", disabled=refresh_jobs.active_job() is not None):
+        try:
+            refresh_jobs.start_refresh(full_rebuild=full_rebuild)
+            st.rerun()
+        except RuntimeError as e:
+            st.warning(f"⚠️ {e}")
+    refresh_status()
+
+# ──────────────────────────────────
+# Mode: Latency & Usage Metrics
+# ──────────────────────────────────
+elif mode == "📈 Metrics":
+    st.title("📈 Latency & Usage")
+    source = st.radio("Source", ["This app", "All processes (saved snapshots)"], horizontal=True,
+                      help="Saved snapshots include CLI refreshes and benchmarks")
+    if source == "This app":
+        snap = metrics.get_registry().snapshot()
+    else:
+        metrics.flush()
+        snap = metrics.merge(metrics.load_snapshots())
+    report = metrics.summary(snap)
+
+    if not report["histograms"] and not report["counters"]:
+        st.info("No requests recorded yet.")
+    else:
+        st.subheader("⏱️ Stages (slowest p95 first)")
+        st.dataframe([{k: round(v, 1) if isinstance(v, float) else v for k, v in row.items()}
+                      for row in report["histograms"]])
+        st.subheader("🔢 Counters")
+        st.dataframe(report["counters"])
+
+    col1, col2, col3 = st.columns(3)
+    col1.download_button("⬇️ Prometheus text", data=lambda: metrics.prometheus_text(snap),
+                         file_name="metrics.prom", mime="text/plain")
+    col2.download_button("⬇️ JSON", data=lambda: metrics.to_json(snap),
+                         file_name="metrics.json", mime="application/json")
+    if col3.button("🧹 Reset This App's Metrics"):
+        metrics.get_registry().reset()
+        st.rerun()
 
 # ──────────────────────────────────
 # Mode: View Chat History
 # ──────────────────────────────────
 elif mode == "📜 View History":
     st.title("📜 Chat History")
-    history = load_history()
+    store = get_history_store()
+    sessions = store.sessions()
 
-    if not history:
+    if not sessions:
         st.info("No chat history found.")
     else:
-        for turn in history:
+        info = {s["session"]: s for s in sessions}
+        session = st.selectbox(
+            "Conversation", list(info),
+            format_func=lambda sid: f"[{info[sid]['started'] or sid}] {info[sid]['title']} "
+                                    f"({info[sid]['turns']} messages)")
+        pages = max(1, math.ceil(info[session]["turns"] / HISTORY_PAGE_SIZE))
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=pages) - 1
+
+        for turn in store.page(session, page, HISTORY_PAGE_SIZE):
             role = "👤 You" if turn.get("role") == "user" else "🧠 Assistant"
-            timestamp = turn.get("timestamp", "N/A")
+            timestamp = turn.get("timestamp") or "N/A"
             st.markdown(f"**{role} | [{timestamp}]**  \n{turn.get('content', '')}")
 
         st.markdown("---")
+        # CSVs are generated only when clicked, streamed row by row from the store
+        st.download_button(
+            label="⬇️ Download Conversation as CSV",
+            data=lambda: store.csv_file(session),
+            file_name=f"chat_history_{session}.csv",
+            mime="text/csv",
+            key="csv_session"
+        )
         st.download_button(
-            label="⬇️ Download Chat History as CSV",
-            data=export_history_to_csv(history),
+            label="⬇️ Download All Chat History as CSV",
+            data=lambda: store.csv_file(),
             file_name="chat_history.csv",
-            mime="text/csv"
+            mime="text/csv",
+            key="csv_all"
         )
 
-        if st.button("🗑️ Clear Chat History"):
-            reset_chat()
+        if st.button("🗑️ Clear This Conversation"):
+            reset_chat(session)
             st.success("History cleared.")
 
 # ──────────────────────────────────
@@ -137,35 +243,69 @@ elif mode == "📜 View History":
 elif mode == "💬 New Chat":
     st.title("🧠 AI CEO Assistant")
     st.caption("Ask about meetings, projects, hiring, finances, and research. Answers cite your documents.")
-    st.markdown(f"🧓 **Last Refreshed:** {load_refresh_time()}")
-
-    history = load_history()
+    st.markdown(f"🧓 **Last Refreshed:** {refresh_jobs.load_refresh_time()}")
+    # Empty selection searches every department
+    scope = st.sidebar.multiselect("📁 Departments", folder_options(),
+                                   help="Limit answers to these Drive folders")
 
-    for turn in history:
-        with st.chat_message(turn.get("role", "assistant")):
-            st.markdown(f"**[{turn.get('timestamp', 'N/A')}]**  \n{turn.get('content', '')}")
+    if st.button("🆕 New Conversation"):
+        st.session_state.pop("chat_session", None)
+        st.rerun()
 
+    # The input is pinned to the bottom wherever it is created; reading it
+    # first lets the answer start before the conversation is rendered
     user_msg = st.chat_input("Type your question…")
+    user_turn, answer_stream, timings = None, None, {}
     if user_msg:
         now = datetime.now().strftime('%b-%d-%Y %I:%M%p')
-        history.append({
+        user_turn = {
             "role": "user",
             "content": user_msg,
             "timestamp": now
-        })
+        }
+        # Retrieval and the prompt's earlier turns load on the answer loop
+        # while the page renders
+        answer_stream = answer_async.stream_answer(user_msg, k=7, timings=timings,
+                                                   folders=scope or None,
+                                                   history_loader=prior_turns_loader(user_turn))
+        append_turns([user_turn])
+
+    history = load_history()
+    if len(history) == CHAT_TAIL_TURNS:
+        st.caption(f"Showing the latest {CHAT_TAIL_TURNS} messages; older ones are in 📜 View History.")
+    if user_turn is not None and history and history[-1] == user_turn:
+        history.pop()  # rendered below, with the answer
+
+    for turn in history:
+        with st.chat_message(turn.get("role", "assistant")):
+            st.markdown(f"**[{turn.get('timestamp') or 'N/A'}]**  \n{turn.get('content', '')}")
+
+    if user_msg:
+        with st.chat_message("user"):
+            st.markdown(f"**[{user_turn['timestamp']}]**  \n{user_msg}")
 
         with st.chat_message("assistant"):
-            with st.spinner("Thinking…"):
+            st.markdown(f"**[{datetime.now().strftime('%b-%d-%Y %I:%M%p')}]**")
+            # Render tokens as they arrive; keep whatever streamed before an error
+            parts = []
+
+            def _stream():
                 try:
-                    reply = answer(user_msg, k=7, chat_history=history)
+                    for delta in answer_stream:
+                        parts.append(delta)
+                        yield delta
                 except Exception as e:
-                    reply = f"Error: {e}"
-            st.markdown(f"**[{datetime.now().strftime('%b-%d-%Y %I:%M%p')}]**  \n{reply}")
+                    err = f"Error: {e}"
+                    parts.append(("\n\n" if parts else "") + err)
+                    yield parts[-1]
+
+            st.write_stream(_stream())
+            reply = "".join(parts)
+            if timings:
+                st.caption("⏱️ " + " · ".join(f"{name} {ms:.0f} ms" for name, ms in timings.items()))
 
-        history.append({
+        append_turns([{
             "role": "assistant",
             "content": reply,
             "timestamp": datetime.now().strftime('%b-%d-%Y %I:%M%p')
-        })
-
-        save_history(history)
+        }])
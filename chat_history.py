@@ -0,0 +1,172 @@
+"""
+Append-only chat history, one log per chat session, in SQLite (WAL).
+
+A turn is one INSERT, so saving costs the same on the first message and the
+thousandth, and concurrent sessions append without rewriting each other's
+data. Reads are index range scans: the last N turns for the prompt and the
+chat view, or one page at a time for the history browser. CSV export
+streams rows instead of building a DataFrame.
+"""
+import csv
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import metrics
+
+HISTORY_DB_PATH = Path(os.getenv("CHAT_HISTORY_PATH", "chat_history.sqlite"))
+LEGACY_JSON_PATH = Path("chat_history.json")
+CSV_COLUMNS = ("session", "role", "content", "timestamp")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    session   TEXT NOT NULL,
+    role      TEXT NOT NULL,
+    content   TEXT NOT NULL,
+    timestamp TEXT,
+    created   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS turns_by_session ON turns(session, id);
+"""
+
+
+def new_session_id() -> str:
+    return time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+
+
+class ChatHistoryStore:
+    def __init__(self, path: Path = HISTORY_DB_PATH):
+        self.path = Path(path)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread (Streamlit script threads, background writers)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---- writes ----
+    @metrics.timed("history_write")
+    def append(self, session: str, turns: List[Dict]):
+        now = time.time()
+        conn = self._conn()
+        conn.executemany(
+            "INSERT INTO turns (session, role, content, timestamp, created) VALUES (?, ?, ?, ?, ?)",
+            [(session, t.get("role", "user"), t.get("content", ""), t.get("timestamp"), now)
+             for t in turns])
+        conn.commit()
+
+    def delete_session(self, session: str):
+        conn = self._conn()
+        conn.execute("DELETE FROM turns WHERE session = ?", (session,))
+        conn.commit()
+
+    def import_json(self, path: Path = LEGACY_JSON_PATH, session: str = "imported") -> int:
+        """Move a legacy chat_history.json into the store (renamed to .bak afterwards)."""
+        path = Path(path)
+        if not path.exists():
+            return 0
+        turns = json.loads(path.read_text(encoding="utf-8"))
+        if turns:
+            self.append(session, turns)
+        path.replace(path.with_suffix(".json.bak"))
+        return len(turns)
+
+    # ---- reads ----
+    @metrics.timed("history_read")
+    def tail(self, session: str, n: int) -> List[Dict]:
+        """The last n turns of a session, oldest first."""
+        rows = self._conn().execute(
+            "SELECT role, content, timestamp FROM turns WHERE session = ? ORDER BY id DESC LIMIT ?",
+            (session, int(n))).fetchall()
+        return [{"role": r, "content": c, "timestamp": ts} for r, c, ts in reversed(rows)]
+
+    def page(self, session: str, page: int, page_size: int = 20) -> List[Dict]:
+        """Turns of one page (0 = oldest), oldest first."""
+        rows = self._conn().execute(
+            "SELECT role, content, timestamp FROM turns WHERE session = ? ORDER BY id LIMIT ? OFFSET ?",
+            (session, int(page_size), int(page) * int(page_size))).fetchall()
+        return [{"role": r, "content": c, "timestamp": ts} for r, c, ts in rows]
+
+    def count(self, session: Optional[str] = None) -> int:
+        if session is None:
+            return self._conn().execute("SELECT COUNT(*) FROM turns").fetchone()[0]
+        return self._conn().execute("SELECT COUNT(*) FROM turns WHERE session = ?",
+                                    (session,)).fetchone()[0]
+
+    def sessions(self, limit: int = 200) -> List[Dict]:
+        """Most recent sessions first, with turn count and opening question."""
+        rows = self._conn().execute(
+            "SELECT session, COUNT(*), MIN(id), MAX(created) FROM turns "
+            "GROUP BY session ORDER BY MAX(id) DESC LIMIT ?", (int(limit),)).fetchall()
+        out = []
+        for session, n, first_id, last in rows:
+            first = self._conn().execute("SELECT content, timestamp FROM turns WHERE id = ?",
+                                         (first_id,)).fetchone()
+            out.append({"session": session, "turns": n, "title": first[0][:80],
+                        "started": first[1], "last_active": last})
+        return out
+
+    # ---- export ----
+    def iter_csv(self, session: Optional[str] = None, batch: int = 500) -> Iterator[str]:
+        """CSV text in chunks of `batch` rows, header first."""
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(CSV_COLUMNS)
+        query = "SELECT session, role, content, timestamp FROM turns"
+        params: tuple = ()
+        if session is not None:
+            query += " WHERE session = ?"
+            params = (session,)
+        cur = self._conn().execute(query + " ORDER BY id", params)
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows:
+                break
+            writer.writerows(rows)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+
+    def csv_file(self, session: Optional[str] = None):
+        """The CSV in a spooled temp file (in memory up to 8 MB, then on disk)."""
+        f = tempfile.SpooledTemporaryFile(max_size=8 << 20)
+        for chunk in self.iter_csv(session):
+            f.write(chunk.encode("utf-8"))
+        f.seek(0)
+        return f
+
+
+_store: Optional[ChatHistoryStore] = None
+_store_lock = threading.Lock()
+
+
+def get_history_store() -> ChatHistoryStore:
+    """Process-wide store; imports a legacy chat_history.json on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = ChatHistoryStore()
+                n = store.import_json()
+                if n:
+                    print(f"✅ Imported {n} turns from {LEGACY_JSON_PATH} into {HISTORY_DB_PATH}")
+                _store = store
+    return _store
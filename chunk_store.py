@@ -0,0 +1,374 @@
+"""
+SQLite store for chunk text and provenance, keyed by FAISS vector ID.
+
+Replaces the pickled metadata dict: readers fetch just the k rows a search
+returns (primary-key lookups) instead of unpickling every chunk, and the
+embedder appends and deletes rows in place during incremental refreshes.
+Writes are staged in one transaction and become visible on commit().
+
+The same database holds an FTS5 full-text index over the chunk text, kept in
+sync by triggers, for BM25 keyword search. FTS5 stores delta-encoded posting
+lists, so the lexical index costs a fraction of the text it covers and is
+patched in the same transaction as the chunk rows.
+
+Near-duplicate chunks share one vector (see dedup): the chunk row is the
+canonical copy, and every other place a near-duplicate occurs is a row in
+chunk_sources with that occurrence's own text (in the lexical index too),
+returned with the chunk as "also_in". chunk_signatures keeps each canonical
+chunk's MinHash signature and number key for matching later refreshes.
+"""
+import pickle
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+PREVIEW_CHARS = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    vid        INTEGER PRIMARY KEY,
+    filename   TEXT NOT NULL,
+    path       TEXT NOT NULL,
+    folder     TEXT,
+    chunk_id   INTEGER NOT NULL,
+    chunk_hash TEXT,
+    text       TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_by_file ON chunks(filename, chunk_id);
+CREATE INDEX IF NOT EXISTS chunks_by_folder ON chunks(folder);
+CREATE TABLE IF NOT EXISTS chunk_sources (
+    id       INTEGER PRIMARY KEY,
+    vid      INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    path     TEXT NOT NULL,
+    folder   TEXT,
+    chunk_id INTEGER NOT NULL,
+    chunk_hash TEXT,
+    text     TEXT
+);
+CREATE INDEX IF NOT EXISTS chunk_sources_by_vid ON chunk_sources(vid);
+CREATE INDEX IF NOT EXISTS chunk_sources_by_file ON chunk_sources(filename);
+CREATE TABLE IF NOT EXISTS chunk_signatures (
+    vid  INTEGER PRIMARY KEY,
+    sig  BLOB NOT NULL,
+    nums INTEGER
+);
+"""
+# External-content FTS tables: postings only, the text stays in `chunks`
+# (and in `chunk_sources` for other occurrences of near-duplicates)
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+    text, content='chunks', content_rowid='vid', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunks_fts(rowid, text) VALUES (new.vid, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+    INSERT INTO chunks_fts(chunks_fts, rowid, text) VALUES ('delete', old.vid, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_au AFTER UPDATE OF text ON chunks BEGIN
+    INSERT INTO chunks_fts(chunks_fts, rowid, text) VALUES ('delete', old.vid, old.text);
+    INSERT INTO chunks_fts(rowid, text) VALUES (new.vid, new.text);
+END;
+CREATE VIRTUAL TABLE IF NOT EXISTS chunk_sources_fts USING fts5(
+    text, content='chunk_sources', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS chunk_sources_ai AFTER INSERT ON chunk_sources BEGIN
+    INSERT INTO chunk_sources_fts(rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS chunk_sources_ad AFTER DELETE ON chunk_sources BEGIN
+    INSERT INTO chunk_sources_fts(chunk_sources_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+_WORD_RE = re.compile(r"\w+")
+_COLUMNS = ("vid", "filename", "path", "folder", "chunk_id", "chunk_hash", "text")
+_SOURCE_COLUMNS = ("vid", "filename", "path", "folder", "chunk_id", "chunk_hash", "text")
+# SQLite caps bound parameters; IN lists are sent in parts of this size
+_IN_BATCH = 500
+
+
+MATCH_MODES = ("any", "all", "phrase")
+
+
+def fts_query(query: str, match: str = "any") -> str:
+    """
+    Quote every word so user input is never parsed as FTS syntax.
+      any    - words OR-ed (classic BM25 ranking)
+      all    - every whitespace-separated term must occur; a term that splits
+               into several words ("DC-2041") must occur as a phrase
+      phrase - the whole query as one phrase
+    """
+    if match == "phrase":
+        words = _WORD_RE.findall(query.lower())
+        return '"' + " ".join(words) + '"' if words else ""
+    if match == "all":
+        terms = [" ".join(_WORD_RE.findall(t)) for t in query.lower().split()]
+        return " AND ".join(f'"{t}"' for t in dict.fromkeys(terms) if t)
+    words = _WORD_RE.findall(query.lower())
+    return " OR ".join(f'"{w}"' for w in dict.fromkeys(words))
+
+
+def _row_to_meta(row) -> Dict:
+    meta = dict(zip(_COLUMNS, row))
+    meta["text_preview"] = meta["text"][:PREVIEW_CHARS]
+    return meta
+
+
+class ChunkStore:
+    def __init__(self, path: Path, readonly: bool = False):
+        self.path = Path(path)
+        self.readonly = readonly
+        if not readonly:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        # One connection per thread: sqlite3 connections are not shareable,
+        # and WAL lets readers proceed while the embedder writes.
+        self._local = threading.local()
+        if not readonly:
+            conn = self._conn()
+            old_sources = self._take_v1_sources(conn)
+            conn.executescript(_SCHEMA)
+            if "nums" not in {r[1] for r in conn.execute("PRAGMA table_info(chunk_signatures)")}:
+                conn.execute("ALTER TABLE chunk_signatures ADD COLUMN nums INTEGER")
+            has_fts = {r[0] for r in conn.execute(
+                "SELECT name FROM sqlite_master WHERE name IN ('chunks_fts', 'chunk_sources_fts')")}
+            conn.executescript(_FTS_SCHEMA)
+            for table in ("chunks_fts", "chunk_sources_fts"):
+                if table not in has_fts:
+                    # Store created before this lexical index: index existing rows
+                    conn.execute(f"INSERT INTO {table}({table}) VALUES ('rebuild')")
+            self.add_sources(old_sources)
+            conn.commit()
+
+    @staticmethod
+    def _take_v1_sources(conn: sqlite3.Connection) -> List[Dict]:
+        # chunk_sources from before it kept each occurrence's text (and an id
+        # for its lexical index): the rows are re-added, with text unknown
+        columns = {r[1] for r in conn.execute("PRAGMA table_info(chunk_sources)")}
+        if not columns or "id" in columns:
+            return []
+        rows = [dict(zip(_SOURCE_COLUMNS, r)) for r in conn.execute(
+            "SELECT vid, filename, path, folder, chunk_id FROM chunk_sources")]
+        conn.execute("DROP TABLE chunk_sources")
+        return rows
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.readonly:
+                conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+            else:
+                conn = sqlite3.connect(str(self.path), timeout=30)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---- reads ----
+    def _select_in(self, sql: str, ids: Sequence) -> List[tuple]:
+        """Rows of sql (ending in "IN ({})") for all ids, queried in parts."""
+        ids = list(ids)
+        rows = []
+        for i in range(0, len(ids), _IN_BATCH):
+            part = ids[i:i + _IN_BATCH]
+            rows += self._conn().execute(sql.format(",".join("?" * len(part))), part).fetchall()
+        return rows
+
+    def get_many(self, vids: Sequence[int]) -> Dict[int, Dict]:
+        vids = [int(v) for v in vids]
+        out = {row[0]: _row_to_meta(row) for row in self._select_in(
+            f"SELECT {', '.join(_COLUMNS)} FROM chunks WHERE vid IN ({{}})", vids)}
+        for vid, sources in self.sources(out).items():
+            out[vid]["also_in"] = sources
+        return out
+
+    def sources(self, vids: Iterable[int]) -> Dict[int, List[Dict]]:
+        """
+        Other occurrences of near-duplicate chunks:
+        vid -> [{filename, path, folder, chunk_id, chunk_hash, text}]; text is
+        the occurrence's own (None when recorded before it was kept).
+        """
+        try:
+            rows = self._select_in(f"SELECT {', '.join(_SOURCE_COLUMNS)} FROM chunk_sources "
+                                   "WHERE vid IN ({}) ORDER BY filename, chunk_id", [int(v) for v in vids])
+        except sqlite3.OperationalError:
+            return {}  # read-only store written before near-duplicate detection
+        out: Dict[int, List[Dict]] = {}
+        for row in rows:
+            out.setdefault(row[0], []).append(dict(zip(_SOURCE_COLUMNS[1:], row[1:])))
+        return out
+
+    def owners(self, vids: Iterable[int]) -> Dict[int, str]:
+        """vid -> filename of the canonical chunk row."""
+        return dict(self._select_in("SELECT vid, filename FROM chunks WHERE vid IN ({})", [int(v) for v in vids]))
+
+    def signatures(self, vids: Iterable[int]) -> Dict[int, tuple]:
+        """vid -> (signature bytes, number key); the key is None for rows stored without one."""
+        return {vid: (sig, nums) for vid, sig, nums in self._select_in(
+            "SELECT vid, sig, nums FROM chunk_signatures WHERE vid IN ({})", [int(v) for v in vids])}
+
+    def get(self, vid: int, default=None) -> Optional[Dict]:
+        return self.get_many([vid]).get(int(vid), default)
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def ids(self) -> List[int]:
+        return [r[0] for r in self._conn().execute("SELECT vid FROM chunks ORDER BY vid")]
+
+    def lexical_search(self, query: str, limit: int = 20, match: str = "any",
+                       folders: Optional[Sequence[str]] = None) -> List[tuple]:
+        """Top (vid, bm25 score) pairs for query, best first; higher is better.
+        folders restricts hits to chunks from those Drive folders."""
+        expr = fts_query(query, match)
+        if not expr or (folders is not None and not folders):
+            return []
+        marks = ",".join("?" * len(folders)) if folders is not None else ""
+        sql = "SELECT rowid, -bm25(chunks_fts) AS score FROM chunks_fts WHERE chunks_fts MATCH ?"
+        params: list = [expr]
+        if folders is not None:
+            sql += f" AND rowid IN (SELECT vid FROM chunks WHERE folder IN ({marks}))"
+            params += list(folders)
+        try:
+            rows = self._conn().execute(sql + " ORDER BY bm25(chunks_fts) LIMIT ?",
+                                        (*params, int(limit))).fetchall()
+        except sqlite3.OperationalError:
+            return []  # read-only store written before the lexical index existed
+        # Other occurrences of near-duplicates match on their own text, as their chunk
+        sql = ("SELECT s.vid, -bm25(chunk_sources_fts) FROM chunk_sources_fts "
+               "JOIN chunk_sources s ON s.id = chunk_sources_fts.rowid WHERE chunk_sources_fts MATCH ?")
+        if folders is not None:
+            sql += f" AND s.folder IN ({marks})"
+        try:
+            rows += self._conn().execute(sql + " ORDER BY bm25(chunk_sources_fts) LIMIT ?",
+                                         (*params, int(limit))).fetchall()
+        except sqlite3.OperationalError:
+            pass  # read-only store written before sources were indexed
+        best: Dict[int, float] = {}
+        for vid, score in rows:
+            best[int(vid)] = max(best.get(int(vid), float("-inf")), float(score))
+        return sorted(best.items(), key=lambda x: -x[1])[:limit]
+
+    def folders(self) -> List[str]:
+        return [r[0] for r in self._conn().execute(
+            "SELECT DISTINCT folder FROM chunks WHERE folder IS NOT NULL ORDER BY folder")]
+
+    def iter_chunks(self, batch: int = 1000) -> Iterable[Dict]:
+        cur = self._conn().execute(f"SELECT {', '.join(_COLUMNS)} FROM chunks ORDER BY vid")
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows:
+                return
+            for row in rows:
+                yield _row_to_meta(row)
+
+    # ---- staged writes ----
+    def add_many(self, rows: Iterable[Dict]):
+        self._conn().executemany(
+            "INSERT OR REPLACE INTO chunks (vid, filename, path, folder, chunk_id, chunk_hash, text) "
+            "VALUES (:vid, :filename, :path, :folder, :chunk_id, :chunk_hash, :text)",
+            [{"folder": None, "chunk_hash": None, **r} for r in rows],
+        )
+
+    def delete_many(self, vids: Iterable[int]):
+        params = [(int(v),) for v in vids]
+        conn = self._conn()
+        for table in ("chunks", "chunk_sources", "chunk_signatures"):
+            conn.executemany(f"DELETE FROM {table} WHERE vid = ?", params)
+
+    def set_chunk_ids(self, pairs: Iterable[tuple]):
+        """pairs of (vid, chunk_id): positions shift when a file is edited."""
+        self._conn().executemany("UPDATE chunks SET chunk_id = ? WHERE vid = ?",
+                                 [(int(c), int(v)) for v, c in pairs])
+
+    def add_sources(self, rows: Iterable[Dict]):
+        """Record more occurrences of canonical chunks ({vid, filename, path, folder, chunk_id, chunk_hash, text})."""
+        self._conn().executemany(
+            "INSERT INTO chunk_sources (vid, filename, path, folder, chunk_id, chunk_hash, text) "
+            "VALUES (:vid, :filename, :path, :folder, :chunk_id, :chunk_hash, :text)",
+            [{"folder": None, "chunk_hash": None, "text": None, **r} for r in rows],
+        )
+
+    def delete_sources(self, filenames: Iterable[str]):
+        self._conn().executemany("DELETE FROM chunk_sources WHERE filename = ?", [(f,) for f in filenames])
+
+    def promote_source(self, vid: int) -> bool:
+        """
+        Make one of vid's other occurrences the canonical row (its file went
+        away): provenance and text, so the lexical index follows.
+        """
+        conn = self._conn()
+        row = conn.execute("SELECT id, filename, path, folder, chunk_id, chunk_hash, text FROM chunk_sources "
+                           "WHERE vid = ? ORDER BY filename, chunk_id LIMIT 1", (int(vid),)).fetchone()
+        if row is None:
+            return False
+        conn.execute("UPDATE chunks SET filename = ?, path = ?, folder = ?, chunk_id = ?, "
+                     "chunk_hash = COALESCE(?, chunk_hash), text = COALESCE(?, text) WHERE vid = ?",
+                     (*row[1:], int(vid)))
+        conn.execute("DELETE FROM chunk_sources WHERE id = ?", (row[0],))
+        return True
+
+    def put_signatures(self, rows: Iterable[tuple]):
+        """rows of (vid, signature bytes, number key)."""
+        self._conn().executemany("INSERT OR REPLACE INTO chunk_signatures (vid, sig, nums) VALUES (?, ?, ?)",
+                                 [(int(v), bytes(sig), int(nums)) for v, sig, nums in rows])
+
+    def clear(self):
+        conn = self._conn()
+        for table in ("chunks", "chunk_sources", "chunk_signatures"):
+            conn.execute(f"DELETE FROM {table}")
+
+    def commit(self):
+        self._conn().commit()
+
+    def rollback(self):
+        self._conn().rollback()
+
+    def import_metadata(self, metadata: Dict[int, Dict]):
+        """Load a legacy metadata.pkl dict (previews stand in for missing full text)."""
+        self.add_many({
+            "vid": vid,
+            "filename": m.get("filename", "unknown.txt"),
+            "path": m.get("path", ""),
+            "chunk_id": m.get("chunk_id", 0),
+            "text": m.get("text") or m.get("text_preview", ""),
+        } for vid, m in metadata.items())
+
+    def backup(self, path: Path):
+        """Write a consistent copy of the store to path (SQLite online backup)."""
+        dst = sqlite3.connect(str(path))
+        try:
+            self._conn().backup(dst)
+        finally:
+            dst.close()
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class LegacyMetadata:
+    """Read-only ChunkStore interface over an old metadata.pkl dict."""
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            self._meta: Dict[int, Dict] = pickle.load(f)
+
+    def get_many(self, vids: Sequence[int]) -> Dict[int, Dict]:
+        return {int(v): self._meta[int(v)] for v in vids if int(v) in self._meta}
+
+    def get(self, vid: int, default=None) -> Optional[Dict]:
+        return self._meta.get(int(vid), default)
+
+    def count(self) -> int:
+        return len(self._meta)
+
+    def lexical_search(self, query: str, limit: int = 20, match: str = "any",
+                       folders: Optional[Sequence[str]] = None) -> List[tuple]:
+        return []  # no lexical index until the next refresh migrates the pickle
+
+    def folders(self) -> List[str]:
+        return sorted({m.get("folder") for m in self._meta.values() if m.get("folder")})
@@ -1,24 +1,161 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
+import hashlib
 import re
 
-def simple_chunks(text: str, max_chars: int = 3500, overlap: int = 300) -> List[Dict]:
+import numpy as np
+
+# ── Token counting ──
+# tiktoken when it is installed and its BPE tables are available (it fetches
+# them on first use); otherwise ~4 chars per token, which is close for English.
+TOKENIZER_ENCODING = "o200k_base"  # gpt-4o
+_encoder = None
+_encoder_loaded = False
+
+def _get_encoder():
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        _encoder_loaded = True
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception:
+            _encoder = None
+    return _encoder
+
+def count_tokens(text: str) -> int:
+    enc = _get_encoder()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    enc = _get_encoder()
+    if enc is not None:
+        ids = enc.encode(text, disallowed_special=())
+        return text if len(ids) <= max_tokens else enc.decode(ids[:max_tokens])
+    return text[:max(0, max_tokens) * 4]
+
+def overlap_length(left: str, right: str, limit: Optional[int] = None) -> int:
     """
-    Split text into overlapping chunks at paragraph boundaries.
-    - max_chars: soft limit per chunk
-    - overlap: carry last N chars from previous chunk to next
+    Length of the longest suffix of `left` that is also a prefix of `right`
+    (prefix function over right + sentinel + left, linear time).
     """
-    paras = [p.strip() for p in re.split(r"\n{2,}", text) if p.strip()]
-    chunks, cur, size = [], [], 0
-    for p in paras:
-        if size + len(p) + 2 <= max_chars:
-            cur.append(p); size += len(p) + 2
+    n = min(len(left), len(right), limit if limit is not None else len(right))
+    if n == 0:
+        return 0
+    s = right[:n] + "\0" + left[-n:]
+    pi = [0] * len(s)
+    for i in range(1, len(s)):
+        j = pi[i - 1]
+        while j and s[i] != s[j]:
+            j = pi[j - 1]
+        if s[i] == s[j]:
+            j += 1
+        pi[i] = j
+    return pi[-1]
+
+# ── Chunking ──
+MAX_CHUNK_CHARS = 3500
+MAX_CHUNK_TOKENS = 1000
+CHUNK_OVERLAP = 300
+_PARA_RE = re.compile(r"\n{2,}")
+_SENTENCE_END_RE = re.compile(r"[.!?;:]\s")
+
+def chunk_hash(text: str) -> str:
+    """Deterministic content hash of a chunk (dedupe key, stable vector IDs)."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def token_counts(texts: List[str]) -> np.ndarray:
+    enc = _get_encoder()
+    if enc is not None:
+        return np.fromiter((len(ids) for ids in enc.encode_ordinary_batch(texts)),
+                           dtype=np.int64, count=len(texts))
+    return np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts)) // 4 + 1
+
+def _cut(text: str, start: int, max_chars: int) -> int:
+    # Furthest line break or sentence end within max_chars, else the last
+    # space, else a hard cut. Only the window is scanned, so splitting a
+    # paragraph stays linear in its length.
+    limit = start + max_chars
+    cut = text.rfind("\n", start + 1, limit)
+    last = None
+    for last in _SENTENCE_END_RE.finditer(text, max(start + 1, cut), limit):
+        pass
+    if last is not None:
+        cut = last.start() + 1
+    if cut > start:
+        return cut
+    space = text.rfind(" ", start + 1, limit)
+    return space if space > start else limit
+
+def split_long(text: str, max_chars: int, max_tokens: Optional[int] = None) -> List[str]:
+    """Split one oversized paragraph into pieces within both budgets."""
+    pieces, start, n = [], 0, len(text)
+    while start < n:
+        end = n if n - start <= max_chars else _cut(text, start, max_chars)
+        piece = text[start:end].strip()
+        if max_tokens and piece and count_tokens(piece) > max_tokens:
+            # Dense text (numbers, code): shrink the window until it fits
+            width = end - start
+            while width > 1 and count_tokens(piece) > max_tokens:
+                width = max(1, int(width * 0.8))
+                end = _cut(text, start, width)
+                piece = text[start:end].strip()
+        if piece:
+            pieces.append(piece)
+        start = max(end, start + 1)
+    return pieces
+
+def simple_chunks(text: str, max_chars: int = MAX_CHUNK_CHARS, overlap: int = CHUNK_OVERLAP,
+                  max_tokens: Optional[int] = MAX_CHUNK_TOKENS) -> List[Dict]:
+    """
+    Split text into overlapping chunks at paragraph boundaries, in linear time.
+    - max_chars / max_tokens: hard limits per chunk; paragraphs over either
+      are first split at sentence or line boundaries
+    - overlap: carry last N chars from previous chunk to next (dropped when
+      it would push the next chunk over a limit)
+    Each chunk carries a sha256 `hash` of its text.
+    """
+    # Pieces of split paragraphs leave room for the overlap tail
+    piece_chars = max(max_chars - overlap - 2, max_chars // 2)
+    piece_tokens = max(max_tokens - overlap // 2, max_tokens // 2) if max_tokens else None
+    units: List[str] = []
+    for p in _PARA_RE.split(text):
+        p = p.strip()
+        if not p:
+            continue
+        if len(p) > max_chars or (max_tokens and len(p) > max_tokens and count_tokens(p) > max_tokens):
+            units.extend(split_long(p, piece_chars, piece_tokens))
         else:
-            if cur:
-                chunks.append("\n\n".join(cur))
-            tail = "\n\n".join(cur)[-overlap:] if cur and overlap > 0 else ""
-            cur = [tail, p] if tail else [p]
-            size = len("\n\n".join(cur))
-    if cur:
-        chunks.append("\n\n".join(cur))
-    return [{"chunk_id": i, "text": c} for i, c in enumerate(chunks)]
+            units.append(p)
+    if not units:
+        return []
+
+    # Joined length of units[i:j] is C[j] - C[i] - 2 (each unit costs its
+    # length plus the "\n\n" separator), so the end of every chunk is one
+    # binary search over the prefix sums; nothing is re-joined to measure it.
+    C = np.concatenate(([0], np.cumsum(np.fromiter((len(u) + 2 for u in units), dtype=np.int64,
+                                                    count=len(units)))))
+    T = np.concatenate(([0], np.cumsum(token_counts(units) + 1))) if max_tokens else None
+
+    def end_of_chunk(i: int, extra_chars: int, extra_tokens: int) -> int:
+        j = int(np.searchsorted(C, C[i] + max_chars + 2 - extra_chars, side="right")) - 1
+        if T is not None:
+            j = min(j, int(np.searchsorted(T, T[i] + max_tokens + 1 - extra_tokens, side="right")) - 1)
+        return j
 
+    chunks, i, tail = [], 0, ""
+    while i < len(units):
+        j = i
+        if tail:
+            # The tail costs its length plus a separator
+            j = end_of_chunk(i, len(tail) + 2, count_tokens(tail) + 1 if T is not None else 0)
+        if j <= i:
+            tail = ""
+            j = max(end_of_chunk(i, 0, 0), i + 1)
+        body = "\n\n".join(units[i:j])
+        chunk = f"{tail}\n\n{body}" if tail else body
+        chunks.append(chunk)
+        tail = chunk[-overlap:] if overlap > 0 else ""
+        i = j
+    return [{"chunk_id": i, "text": c, "hash": chunk_hash(c)} for i, c in enumerate(chunks)]
@@ -0,0 +1,108 @@
+"""
+Near-duplicate detection for chunks: MinHash signatures over word shingles,
+bucketed with locality-sensitive hashing (LSH).
+
+A chunk's signature holds, for each of NUM_PERM hash functions, the minimum
+hash over its word 3-grams. The share of positions where two signatures agree
+estimates the Jaccard similarity of their shingle sets. LSH splits signatures
+into bands and only compares chunks that agree on a whole band, so finding
+a chunk's near-duplicates costs a few dict lookups rather than a scan. With
+16 bands of 8 rows, pairs at Jaccard 0.9 collide with probability ~1 and
+unrelated ones almost never. Candidates are then checked against
+NEAR_DUP_THRESHOLD.
+
+Figures are what versions of a document most often differ in, and a changed
+"$12M" barely moves the Jaccard estimate; chunks only count as duplicates
+when their numbers, in order, are the same too (numbers_key).
+
+Signatures are stored with the chunks (chunk_store) and compared across
+refreshes, so the hash functions come from a fixed seed.
+"""
+import os
+import re
+import zlib
+from typing import Dict, List, Optional
+
+import numpy as np
+
+NUM_PERM = 128
+LSH_BANDS = 16
+SHINGLE_WORDS = 3
+# Estimated Jaccard similarity at which two chunks count as duplicates
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.9"))
+
+_WORD_RE = re.compile(r"\w+")
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)*")
+# Multiply-shift hashes ((a * x + b) mod 2^64) >> 32 of 32-bit shingle hashes
+_rng = np.random.default_rng(0x5EED)
+_A = _rng.integers(1, 1 << 63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 1 << 63, NUM_PERM, dtype=np.uint64)
+
+
+def shingles(text: str) -> np.ndarray:
+    """32-bit hashes of the distinct word 3-grams (of the whole text when shorter)."""
+    words = _WORD_RE.findall(text.lower())
+    w = np.fromiter((zlib.crc32(t.encode("utf-8")) for t in words), dtype=np.uint64, count=len(words))
+    n = min(SHINGLE_WORDS, len(w))
+    if n == 0:
+        return np.zeros(1, dtype=np.uint64)
+    # Order-sensitive mix of n consecutive word hashes (uint64 wraps); the
+    # top 32 bits, kept, depend on every word
+    mix = np.uint64(0x9E3779B97F4A7C15)
+    h = np.zeros(len(w) - n + 1, dtype=np.uint64)
+    for i in range(n):
+        h = (h + w[i:len(w) - n + 1 + i]) * mix
+    return np.unique(h >> np.uint64(32))
+
+
+def signature(text: str) -> np.ndarray:
+    """MinHash signature: NUM_PERM uint32 values."""
+    x = shingles(text)
+    h = (_A[:, None] * x[None, :] + _B[:, None]) >> np.uint64(32)  # uint64 wraps: mod 2^64
+    return h.min(axis=1).astype(np.uint32)
+
+
+def numbers_key(text: str) -> int:
+    """32-bit hash of the numbers in text, in order."""
+    return zlib.crc32(" ".join(_NUMBER_RE.findall(text)).encode("ascii"))
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+class LSHIndex:
+    """Banded LSH over MinHash signatures (plus number keys), keyed by int ids."""
+
+    def __init__(self, bands: int = LSH_BANDS):
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+        self._sigs: Dict[int, np.ndarray] = {}
+        self._nums: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._sigs)
+
+    def _keys(self, sig: np.ndarray):
+        for band in range(self.bands):
+            yield band, sig[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, key: int, sig: np.ndarray, nums: int = 0):
+        self._sigs[key] = sig
+        self._nums[key] = nums
+        for band, k in self._keys(sig):
+            self._buckets[band].setdefault(k, []).append(key)
+
+    def query(self, sig: np.ndarray, nums: int = 0, threshold: float = NEAR_DUP_THRESHOLD) -> Optional[int]:
+        """The most similar key with the same number key, at or above threshold (lowest id on ties), or None."""
+        seen = set()
+        for band, k in self._keys(sig):
+            seen.update(c for c in self._buckets[band].get(k, ()) if self._nums[c] == nums)
+        if not seen:
+            return None
+        keys = sorted(seen)
+        scores = np.count_nonzero(np.vstack([self._sigs[c] for c in keys]) == sig, axis=1) / len(sig)
+        best = int(np.argmax(scores))
+        return keys[best] if scores[best] >= threshold else None
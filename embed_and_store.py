@@ -1,67 +1,557 @@
 import os
-import time
+import re
+import json
 import pickle
+import time
+import shutil
+import uuid
+import hashlib
+import random
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional, List
+from typing import Callable, Dict, Optional, List
 
 import numpy as np
 import faiss
 from dotenv import load_dotenv
 from tqdm import tqdm
 
+import metrics
 from chunk_utils import simple_chunks
+from chunk_store import ChunkStore
+from dedup import NUM_PERM, LSHIndex, numbers_key, signature
+from embedding_cache import get_cache
+from index_factory import (DEFAULT_MODE, INDEX_MODES, build_index, default_params, empty_index,
+                           needs_rebuild, reconstruct, supports_remove)
 
-# -------- Load OpenAI API Key --------
-import streamlit as st
 import openai
 
-# Use secret key for Streamlit Cloud
-openai.api_key = st.secrets["OPENAI_API_KEY"]
+# -------- Load OpenAI API Key --------
+# Read on the first API call, not at import: the app imports this module
+# only for a refresh, and st.secrets parses the secrets file.
+_key_loaded = False
+_key_lock = threading.Lock()
+
+def load_api_key():
+    global _key_loaded
+    if _key_loaded:
+        return
+    with _key_lock:
+        if _key_loaded:
+            return
+        import streamlit as st
+        # Use secret key for Streamlit Cloud; fall back to the environment for CLI runs
+        try:
+            openai.api_key = st.secrets["OPENAI_API_KEY"]
+        except FileNotFoundError:
+            load_dotenv()
+            openai.api_key = os.getenv("OPENAI_API_KEY")
+        _key_loaded = True
 
 
 # -------- Paths & Config --------
 PARSED_DIR = Path("parsed_data")
-EMBED_DIR = Path("embeddings")
-EMBED_DIR.mkdir(parents=True, exist_ok=True)
+EMBED_DIR = Path("embeddings")  # created by the chunk store on first write
 
 EMBED_MODEL = "text-embedding-3-small"
 EMBED_DIM = 1536
-INDEX_PATH = EMBED_DIR / "faiss.index"
-META_PATH = EMBED_DIR / "metadata.pkl"
+# Batching: many chunks per embeddings request, several requests in flight.
+# Token counts are estimated (~4 chars/token) and kept well under the API's
+# per-request limit.
+BATCH_MAX_ITEMS = 128
+BATCH_MAX_TOKENS = 60_000
+EMBED_WORKERS = 4
+MAX_RETRIES = 6
+# Near-duplicate chunks within a shard (file versions, copies, overlapping
+# notes) share one vector and are stored as extra sources of it (see dedup)
+DEDUP = os.getenv("DEDUP", "1") != "0"
+# Blue/green releases: every refresh writes a complete set of artifacts to a
+# new directory, releases/<name>/, seeded from the live one, and publishes it
+# by atomically replacing CURRENT (which names the live release). Readers
+# never see a half-written index, and a failed or cancelled refresh leaves
+# the live release untouched. The release that was live before is kept for
+# readers that resolved CURRENT just before the swap.
+RELEASES_DIR = EMBED_DIR / "releases"
+CURRENT_PATH = EMBED_DIR / "CURRENT"
+
+# Artifact paths, inside the release being written (see use_release); they
+# start at the unversioned layout directly in EMBED_DIR, used before releases.
+# One FAISS index per Drive folder ("shard"): shards/<slug>/faiss.index and
+# index_params.json (index mode, see index_factory). Vector IDs are global.
+SHARDS_DIR = EMBED_DIR / "shards"
+# slug -> {"folder": label, "count": vectors, "version": changes on rewrite}
+SHARDS_PATH = EMBED_DIR / "shards.json"
+DEFAULT_SHARD = "_default"  # files without a [FOLDER] header
+# Chunk text and provenance by vector ID (replaces the pickled metadata dict)
+CHUNKS_PATH = EMBED_DIR / "chunks.sqlite"
+VERSION_PATH = EMBED_DIR / "VERSION"
+# Per-file and per-chunk content hashes -> stable vector IDs, for incremental refreshes
+MANIFEST_PATH = EMBED_DIR / "manifest.json"
+# Single-index layout used before shards; removed with the unversioned layout
+LEGACY_PATHS = [EMBED_DIR / "faiss.index", EMBED_DIR / "index_params.json", EMBED_DIR / "metadata.pkl"]
 
-# FAISS index
-base_index = faiss.IndexFlatL2(EMBED_DIM)
-index = faiss.IndexIDMap2(base_index)
+# slug -> {"folder", "index", "params", "version"}
+shards: Dict[str, Dict] = {}
 
-metadata: Dict[int, Dict] = {}  # id -> metadata
+store: Optional[ChunkStore] = None  # id -> chunk text and provenance
 next_id = 0
 
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
 # -------- Embedding --------
-def get_embedding(text: str) -> Optional[np.ndarray]:
-    for attempt in range(4):
+# When any worker is rate limited, all workers hold off until this time.
+_backoff_until = 0.0
+_backoff_lock = threading.Lock()
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+def make_batches(texts: List[str], max_items: int = BATCH_MAX_ITEMS,
+                 max_tokens: int = BATCH_MAX_TOKENS) -> List[List[int]]:
+    """
+    Group text positions into request-sized batches, preserving order.
+    A batch closes when adding the next text would exceed either budget.
+    """
+    batches, cur, tokens = [], [], 0
+    for i, t in enumerate(texts):
+        n = estimate_tokens(t)
+        if cur and (len(cur) >= max_items or tokens + n > max_tokens):
+            batches.append(cur)
+            cur, tokens = [], 0
+        cur.append(i)
+        tokens += n
+    if cur:
+        batches.append(cur)
+    return batches
+
+def _retry_after(err: Exception) -> Optional[float]:
+    headers = getattr(err, "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def _is_rate_limit(err: Exception) -> bool:
+    return isinstance(err, openai.error.RateLimitError) or getattr(err, "http_status", None) == 429
+
+def _wait_for_backoff():
+    delay = _backoff_until - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+def embed_batch(texts: List[str]) -> Optional[np.ndarray]:
+    """Embed texts in one request; returns an (n, EMBED_DIM) float32 matrix or None."""
+    global _backoff_until
+    load_api_key()
+    for attempt in range(MAX_RETRIES):
+        _wait_for_backoff()
         try:
-            response = openai.Embedding.create(
-                model=EMBED_MODEL,
-                input=text
-            )
-            vec = response["data"][0]["embedding"]
-            arr = np.array(vec, dtype=np.float32)
-            if arr.shape != (EMBED_DIM,):
+            metrics.inc("api_requests_total", endpoint="embeddings")
+            with metrics.span("embed_batch"):
+                response = openai.Embedding.create(
+                    model=EMBED_MODEL,
+                    input=texts
+                )
+            metrics.record_usage(EMBED_MODEL, response.get("usage"))
+            rows = sorted(response["data"], key=lambda d: d["index"])
+            arr = np.array([r["embedding"] for r in rows], dtype=np.float32)
+            if arr.shape != (len(texts), EMBED_DIM):
                 raise ValueError(f"Unexpected embedding shape {arr.shape}")
             return arr
         except Exception as e:
-            wait = 1.5 ** attempt
-            print(f"Embedding error (attempt {attempt + 1}): {e}. Retrying in {wait:.1f}s...")
+            # Exponential backoff with jitter; honour Retry-After on 429s and
+            # make every worker pause, not just this one.
+            wait = (1.5 ** attempt) * (0.5 + random.random())
+            rate_limited = _is_rate_limit(e)
+            if rate_limited:
+                wait = max(wait, _retry_after(e) or 0.0)
+                with _backoff_lock:
+                    _backoff_until = max(_backoff_until, time.monotonic() + wait)
+            metrics.inc("api_retries_total", endpoint="embeddings",
+                        reason="rate_limit" if rate_limited else "error")
+            print(f"Embedding error (attempt {attempt + 1}, {len(texts)} texts): {e}. Retrying in {wait:.1f}s...")
             time.sleep(wait)
+    metrics.inc("api_failures_total", endpoint="embeddings")
     print("Failed to embed after retries.")
     return None
 
-def add_to_index(vec: np.ndarray, vid: int):
-    index.add_with_ids(vec.reshape(1, -1), np.array([vid], dtype=np.int64))
+def get_embedding(text: str) -> Optional[np.ndarray]:
+    cache = get_cache()
+    vec = cache.get(EMBED_MODEL, text)
+    if vec is not None:
+        return vec
+    arr = embed_batch([text])
+    if arr is None:
+        return None
+    cache.put(EMBED_MODEL, text, arr[0])
+    return arr[0]
+
+def embed_texts(texts: List[str], workers: int = EMBED_WORKERS,
+                progress: Optional[tqdm] = None) -> List[Optional[np.ndarray]]:
+    """
+    Embed many texts with batched requests, keeping up to `workers` requests
+    in flight. Texts found in the embedding cache cost no API call.
+    Result order matches `texts`; failed batches yield None rows.
+    """
+    cache = get_cache()
+    out: List[Optional[np.ndarray]] = cache.get_many(EMBED_MODEL, texts)
+    missing = [i for i, v in enumerate(out) if v is None]
+    if progress is not None:
+        progress.update(len(texts) - len(missing))
+    batches = [[missing[j] for j in b] for b in make_batches([texts[i] for i in missing])]
+
+    def _run(positions: List[int]):
+        batch = [texts[i] for i in positions]
+        arr = embed_batch(batch)
+        if arr is not None:
+            cache.put_many(EMBED_MODEL, batch, arr)
+            for row, i in enumerate(positions):
+                out[i] = arr[row]
+        if progress is not None:
+            progress.update(len(positions))
+
+    pool = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        list(pool.map(_run, batches))
+    finally:
+        # On an error (e.g. a cancelled refresh) queued batches are dropped
+        pool.shutdown(cancel_futures=True)
+    return out
+
+def add_many_to_index(index, vecs: np.ndarray, vids: List[int]):
+    if len(vids):
+        index.add_with_ids(np.ascontiguousarray(vecs, dtype=np.float32), np.asarray(vids, dtype=np.int64))
+
+def remove_from_index(index, vids: List[int]):
+    if vids:
+        index.remove_ids(np.asarray(vids, dtype=np.int64))
+        store.delete_many(vids)
+
+def parse_header(text: str) -> Dict:
+    # file_parser writes "[FOLDER]: <label>\n[FILE]: <name>" at the top
+    header = {}
+    for line in text.splitlines()[:2]:
+        if line.startswith("[FOLDER]:"):
+            header["folder"] = line.split(":", 1)[1].strip()
+        elif line.startswith("[FILE]:"):
+            header["file"] = line.split(":", 1)[1].strip()
+    return header
+
+def shard_slug(folder: Optional[str]) -> str:
+    # Filesystem-safe and unique per label (the hash separates "HR" / "hr")
+    if not folder:
+        return DEFAULT_SHARD
+    base = re.sub(r"[^A-Za-z0-9_-]+", "_", folder).strip("_").lower()[:40] or "folder"
+    return f"{base}-{hashlib.sha1(folder.encode('utf-8')).hexdigest()[:6]}"
+
+def shard_paths(slug: str):
+    d = SHARDS_DIR / slug
+    return d / "faiss.index", d / "index_params.json"
+
+def new_shard(folder: Optional[str]) -> Dict:
+    return {"folder": folder, "index": empty_index(EMBED_DIM),
+            "params": default_params("flat", 0, EMBED_DIM), "version": None}
+
+def shard_mode(sh: Dict, mode: Optional[str]) -> str:
+    """The mode to build a shard in: mode if given, else the one it was built for."""
+    if mode is not None:
+        return mode
+    if not sh["index"].ntotal:
+        return DEFAULT_MODE
+    return sh["params"].get("requested_mode", sh["params"].get("mode", DEFAULT_MODE))
+
+# -------- State --------
+def empty_manifest() -> Dict:
+    # files: filename -> {"sha": file hash, "folder": label,
+    #                     "chunks": [[chunk hash, vector id], ...]}
+    return {"next_id": 0, "files": {}}
+
+def _open_store() -> ChunkStore:
+    global store
+    if store is None:
+        store = ChunkStore(CHUNKS_PATH)
+    return store
+
+def reset_state() -> Dict:
+    global shards, next_id
+    shards = {}
+    _open_store().clear()
+    next_id = 0
+    return empty_manifest()
+
+def _legacy_texts():
+    # (vid, chunk text) of the single index: from its chunk store, else from
+    # metadata.pkl ("text" since incremental refreshes; previews only before)
+    legacy_store = EMBED_DIR / "chunks.sqlite"
+    if legacy_store.exists():
+        for meta in ChunkStore(legacy_store, readonly=True).iter_chunks():
+            yield meta["vid"], meta["text"]
+    elif (EMBED_DIR / "metadata.pkl").exists():
+        with open(EMBED_DIR / "metadata.pkl", "rb") as f:
+            for vid, meta in pickle.load(f).items():
+                if meta.get("text"):
+                    yield int(vid), meta["text"]
+
+def seed_cache_from_legacy() -> int:
+    """
+    Put the single pre-shard index's vectors into the embedding cache, keyed
+    by chunk text, so splitting it into shards only embeds chunks whose text
+    changed (it may predate the cache). Returns how many vectors were cached.
+    """
+    index_path, params_path = EMBED_DIR / "faiss.index", EMBED_DIR / "index_params.json"
+    if not index_path.exists():
+        return 0
+    params = json.loads(params_path.read_text(encoding="utf-8")) if params_path.exists() else {}
+    if params.get("mode") == "ivfpq":
+        return 0  # decoded PQ codes only approximate the embeddings
+    index = faiss.read_index(str(index_path))
+    if index.d != EMBED_DIM:
+        return 0
+    cache, seeded = get_cache(), 0
+    batch: List[tuple] = []
+
+    def flush():
+        nonlocal seeded
+        vecs = reconstruct(index, [vid for vid, _ in batch])
+        cache.put_many(EMBED_MODEL, [text for _, text in batch], list(vecs))
+        seeded += len(batch)
+        batch.clear()
+
+    try:
+        for item in _legacy_texts():
+            batch.append(item)
+            if len(batch) == 1000:
+                flush()
+        if batch:
+            flush()
+    except (RuntimeError, sqlite3.Error, pickle.UnpicklingError) as e:
+        print(f"⚠️ Could not reuse vectors from the single index: {e}")
+    return seeded
+
+def load_state() -> Dict:
+    """
+    Load the saved shards, chunk store and manifest into module state so a
+    refresh can patch them. Falls back to an empty state when anything is
+    missing or the pieces disagree.
+    """
+    global shards, next_id
+    if not (SHARDS_PATH.exists() and MANIFEST_PATH.exists() and CHUNKS_PATH.exists()):
+        if any(p.exists() for p in LEGACY_PATHS):
+            seeded = seed_cache_from_legacy()
+            print(f"ℹ️ Splitting the single index into per-folder shards ({seeded} of its vectors "
+                  "reused; chunks whose text changed since, or that it kept only previews of, "
+                  "are re-embedded).")
+        return reset_state()
+    manifest = json.loads(MANIFEST_PATH.read_text(encoding="utf-8"))
+    registry = json.loads(SHARDS_PATH.read_text(encoding="utf-8"))
+    _open_store()
+    tracked: Dict[str, set] = {}  # near-duplicates make files share vector IDs
+    for e in manifest["files"].values():
+        tracked.setdefault(shard_slug(e.get("folder")), set()).update(vid for _, vid in e["chunks"])
+    loaded = {}
+    for slug, info in registry.items():
+        index_path, params_path = shard_paths(slug)
+        if not (index_path.exists() and params_path.exists()):
+            break
+        loaded[slug] = {"folder": info["folder"], "index": faiss.read_index(str(index_path)),
+                        "params": json.loads(params_path.read_text(encoding="utf-8")),
+                        "version": info["version"]}
+    counts = {slug: sh["index"].ntotal for slug, sh in loaded.items() if sh["index"].ntotal}
+    if len(loaded) != len(registry) or counts != {k: len(v) for k, v in tracked.items() if v} \
+            or store.count() != sum(map(len, tracked.values())):
+        print("⚠️ Shards, chunk store and manifest disagree; rebuilding from scratch.")
+        return reset_state()
+    shards, next_id = loaded, manifest["next_id"]
+    return manifest
+
+# -------- Near-duplicates --------
+def _indexed_lsh(vids: List[int]) -> LSHIndex:
+    """LSH over the stored signatures of indexed chunks; missing ones are computed and saved."""
+    lsh = LSHIndex()
+    stored = {vid: (sig, nums) for vid, (sig, nums) in store.signatures(vids).items()
+              if len(sig) == NUM_PERM * 4 and nums is not None}
+    missing = [vid for vid in vids if vid not in stored]
+    if missing:
+        # Chunks indexed before signatures (or number keys) were kept, once
+        print(f"ℹ️ Computing near-duplicate signatures for {len(missing)} indexed chunks.")
+        for i in range(0, len(missing), 1000):
+            metas = store.get_many(missing[i:i + 1000])
+            computed = [(vid, signature(m["text"]).tobytes(), numbers_key(m["text"])) for vid, m in metas.items()]
+            store.put_signatures(computed)
+            stored.update((vid, (sig, nums)) for vid, sig, nums in computed)
+    for vid, (sig, nums) in stored.items():
+        lsh.add(vid, np.frombuffer(sig, dtype=np.uint32), nums)
+    return lsh
+
+def _source_row(vid: int, fp: Path, ch: Dict, folder: Optional[str]) -> Dict:
+    # One more occurrence of a canonical chunk, with its own text
+    return {"vid": vid, "filename": fp.name, "path": str(fp), "folder": folder,
+            "chunk_id": ch["chunk_id"], "chunk_hash": ch["hash"], "text": ch["text"]}
+
+def collapse_near_duplicates(pending: List[tuple], indexed: Dict[str, List[int]]):
+    """
+    Split pending chunks into canonical ones, to embed, and near-duplicates
+    of a chunk in the same shard: an indexed one (indexed maps slug -> vids
+    that stay indexed) or an earlier canonical one. Returns (canonical,
+    their (signature, number key) pairs, dupes); each dupe is (pending item,
+    key), key being the indexed vid, or -(position in canonical) - 1.
+    """
+    canonical, sigs, dupes = [], [], []
+    lsh_of: Dict[str, LSHIndex] = {}
+    for item in pending:
+        slug = shard_slug(item[4])
+        if slug not in lsh_of:
+            lsh_of[slug] = _indexed_lsh(indexed.get(slug, []))
+        sig, nums = signature(item[1]["text"]), numbers_key(item[1]["text"])
+        key = lsh_of[slug].query(sig, nums)
+        if key is None:
+            lsh_of[slug].add(-len(canonical) - 1, sig, nums)
+            canonical.append(item)
+            sigs.append((sig, nums))
+        else:
+            dupes.append((item, key))
+    return canonical, sigs, dupes
+
+# -------- Releases --------
+def live_dir() -> Path:
+    """Directory of the published artifacts: the CURRENT release, else EMBED_DIR."""
+    name = CURRENT_PATH.read_text(encoding="utf-8").strip() if CURRENT_PATH.exists() else ""
+    return RELEASES_DIR / name if name else EMBED_DIR
+
+def use_release(root: Path):
+    """Point the artifact paths (and the chunk store) at the artifacts in root."""
+    global SHARDS_DIR, SHARDS_PATH, CHUNKS_PATH, VERSION_PATH, MANIFEST_PATH, store
+    if store is not None:
+        store.close()
+        store = None
+    SHARDS_DIR, SHARDS_PATH = root / "shards", root / "shards.json"
+    CHUNKS_PATH, VERSION_PATH, MANIFEST_PATH = root / "chunks.sqlite", root / "VERSION", root / "manifest.json"
+
+def new_release() -> Path:
+    # Names sort by creation time
+    d = RELEASES_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    d.mkdir(parents=True)
+    return d
+
+def seed_release(src: Path, dst: Path):
+    """
+    Start dst as a copy of the artifacts in src, for a refresh to patch.
+    Shard files are hard-linked (they are only ever replaced, never written
+    in place); the chunk store is copied with SQLite's online backup.
+    """
+    if not all((src / name).exists() for name in ("shards.json", "manifest.json", "chunks.sqlite")):
+        return  # nothing sharded to start from; load_state starts empty
+    for f in sorted((src / "shards").glob("*/*")):
+        target = dst / "shards" / f.parent.name / f.name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(f, target)
+        except OSError:  # filesystem without hard links
+            shutil.copy2(f, target)
+    for name in ("shards.json", "manifest.json"):
+        shutil.copy2(src / name, dst / name)
+    src_store = ChunkStore(src / "chunks.sqlite", readonly=True)
+    try:
+        src_store.backup(dst / "chunks.sqlite")
+    finally:
+        src_store.close()
+
+def publish_release(release: Path):
+    """
+    Make release the live one by atomically replacing CURRENT, then delete
+    older artifacts except the ones that were live until now.
+    """
+    previous = live_dir()
+    _replace_atomically(CURRENT_PATH, lambda p: p.write_text(release.name, encoding="utf-8"))
+    for d in sorted(RELEASES_DIR.iterdir()):
+        # Newer directories belong to refreshes still running
+        if d.is_dir() and d.name < release.name and d != previous:
+            shutil.rmtree(d, ignore_errors=True)
+    if previous != EMBED_DIR:
+        for p in [EMBED_DIR / "shards.json", EMBED_DIR / "manifest.json", EMBED_DIR / "VERSION",
+                  *LEGACY_PATHS, *EMBED_DIR.glob("chunks.sqlite*")]:
+            if p.exists():
+                p.unlink()
+        shutil.rmtree(EMBED_DIR / "shards", ignore_errors=True)
+
+def discard_release(release: Path):
+    use_release(live_dir())
+    shutil.rmtree(release, ignore_errors=True)
+
+# -------- Saving --------
+def _replace_atomically(path: Path, write):
+    # Write next to the target and rename over it so readers never see a
+    # half-written file (and mmapped readers keep their old inode).
+    tmp = path.with_name(path.name + ".tmp")
+    write(tmp)
+    os.replace(tmp, path)
+
+def save_artifacts(changed: List[str], manifest: Optional[Dict] = None):
+    """
+    Write the shards in `changed` (others are left untouched on disk), then
+    the shard registry, manifest and VERSION. Emptied shards are deleted.
+    """
+    # Chunk rows are committed in one transaction right before the index swap
+    _open_store().commit()
+    for slug in changed:
+        sh = shards.get(slug)
+        if sh is None or sh["index"].ntotal == 0:
+            shards.pop(slug, None)
+            continue
+        index_path, params_path = shard_paths(slug)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        _replace_atomically(index_path, lambda p: faiss.write_index(sh["index"], str(p)))
+        _replace_atomically(params_path, lambda p: p.write_text(json.dumps(sh["params"]), encoding="utf-8"))
+        sh["version"] = uuid.uuid4().hex
+    registry = {slug: {"folder": sh["folder"], "count": sh["index"].ntotal, "version": sh["version"]}
+                for slug, sh in sorted(shards.items())}
+    _replace_atomically(SHARDS_PATH, lambda p: p.write_text(json.dumps(registry, indent=1), encoding="utf-8"))
+    if manifest is not None:
+        _replace_atomically(MANIFEST_PATH, lambda p: p.write_text(json.dumps(manifest), encoding="utf-8"))
+    _replace_atomically(VERSION_PATH, lambda p: p.write_text(uuid.uuid4().hex, encoding="utf-8"))
+    for d in SHARDS_DIR.iterdir() if SHARDS_DIR.exists() else []:
+        if d.is_dir() and d.name not in registry:
+            shutil.rmtree(d, ignore_errors=True)
 
 # -------- Main --------
-def main():
-    global next_id
+Progress = Callable[[str, int, Optional[int]], None]
+
+class _StageBar:
+    """tqdm stand-in for embed_texts that also reports to a progress callback."""
+
+    def __init__(self, bar: tqdm, progress: Progress, stage: str):
+        self.bar, self.progress, self.stage = bar, progress, stage
+        self._lock = threading.Lock()
+
+    def update(self, n: int):
+        with self._lock:
+            self.bar.update(n)
+            done = self.bar.n
+        self.progress(self.stage, done, self.bar.total)
+
+def main(full_rebuild: bool = False, index_mode: Optional[str] = None,
+         folders: Optional[List[str]] = None, progress: Optional[Progress] = None):
+    """
+    Bring the shards in line with parsed_data. Unchanged files are skipped,
+    unchanged chunks keep their vector IDs, and only new or edited chunks are
+    embedded; chunks that disappeared are removed from their shard. Only
+    shards with changes are rewritten.
+    A shard is rebuilt (and retrained) when index_mode is given and differs
+    from its mode, when it outgrows its training, or when its mode cannot
+    delete in place. Without index_mode each shard keeps the mode it was
+    built for; new shards get DEFAULT_MODE.
+    folders limits the refresh to those Drive folders; other shards, and
+    their files in the manifest, are left as they are.
+    The result is written to a new release, published only when complete.
+    progress, if given, is called as progress(stage, done, total) through
+    the stages scan (files), embed (chunks), index (shards) and save; an
+    exception it raises aborts the refresh and discards the release (it is
+    not called once saving has started).
+    """
     if not PARSED_DIR.exists():
         print(f"Missing folder: {PARSED_DIR.resolve()}")
         return
@@ -71,37 +561,232 @@ def main():
         print("No .txt files found in parsed_data.")
         return
 
-    print(f"Found {len(files)} files to embed (chunking enabled).")
-    for fp in tqdm(files, desc="Embedding"):
+    live = live_dir()
+    release = new_release()
+    use_release(release)
+    try:
+        if not (full_rebuild and folders is None):
+            seed_release(live, release)
+        changed = _refresh(files, full_rebuild, index_mode, folders,
+                           progress or (lambda stage, done, total: None))
+    except BaseException:
+        discard_release(release)
+        raise
+    if not changed:
+        discard_release(release)
+        return
+    publish_release(release)
+    print(f"✅ Published release {release.name}")
+
+def _refresh(files: List[Path], full_rebuild: bool, mode: Optional[str], folders: Optional[List[str]],
+             progress: Progress) -> bool:
+    """The body of main(), against the release in use; False when nothing changed."""
+    global next_id
+    scope = set(folders) if folders is not None else None
+    old_manifest = reset_state() if full_rebuild and scope is None else load_state()
+    old_files = old_manifest["files"]
+    new_files: Dict[str, Dict] = {}
+    pending = []  # (file path, chunk, chunk hash, manifest entry, folder)
+    unchanged = reused = 0
+
+    def in_scope(folder):
+        return scope is None or folder in scope
+
+    reindexed = []  # (vid, chunk, file, folder) for reused chunks
+    for n_scanned, fp in enumerate(files, 1):
+        progress("scan", n_scanned, len(files))
         text = fp.read_text(encoding="utf-8").strip()
+        folder = parse_header(text).get("folder")
+        prev = old_files.get(fp.name)
+        if not in_scope(folder):
+            if prev and not in_scope(prev.get("folder")):
+                new_files[fp.name] = prev
+            continue
+        sha = content_hash(text)
+        if prev and prev["sha"] == sha and prev.get("folder") == folder and not full_rebuild:
+            new_files[fp.name] = prev
+            unchanged += 1
+            continue
         if not text:
             print(f"Skipping empty: {fp.name}")
             continue
 
-        chunks = simple_chunks(text, max_chars=3500, overlap=300)
-        if not chunks:
-            chunks = [{"chunk_id": 0, "text": text[:3500]}]
+        chunks = simple_chunks(text)
 
+        # Identical chunks of the previous version keep their vector IDs
+        # (within the same shard; a file that moved folders is re-added)
+        available: Dict[str, List[int]] = {}
+        if prev and prev.get("folder") == folder and not full_rebuild:
+            for h, vid in prev["chunks"]:
+                available.setdefault(h, []).append(vid)
+        entry = {"sha": sha, "folder": folder, "chunks": []}
         for ch in chunks:
-            vec = get_embedding(ch["text"])
-            if vec is None:
-                print(f"Skipping chunk {ch['chunk_id']} of {fp.name} due to embedding failure.")
-                continue
-            add_to_index(vec, next_id)
-            metadata[next_id] = {
-                "filename": fp.name,
-                "path": str(fp),
-                "chunk_id": ch["chunk_id"],
-                "text_preview": ch["text"][:1000]
-            }
-            next_id += 1
-
-    faiss.write_index(index, str(INDEX_PATH))
-    with open(META_PATH, "wb") as f:
-        pickle.dump(metadata, f)
-
-    print(f"✅ Saved FAISS index to {INDEX_PATH}")
-    print(f"✅ Saved metadata for {len(metadata)} vectors to {META_PATH}")
+            h = ch["hash"]
+            if available.get(h):
+                vid = available[h].pop(0)
+                entry["chunks"].append([h, vid])
+                reindexed.append((vid, ch, fp, folder))
+                reused += 1
+            else:
+                pending.append((fp, ch, h, entry, folder))
+        new_files[fp.name] = entry
+    # Out-of-scope files that disappeared stay tracked until their folder is refreshed
+    for name, e in old_files.items():
+        if name not in new_files and not in_scope(e.get("folder")):
+            new_files[name] = e
+
+    # Near-duplicates of chunks that stay indexed (not of ones being replaced)
+    # or of other new chunks are not embedded
+    dupes, sigs = [], [None] * len(pending)
+    if DEDUP and pending:
+        indexed: Dict[str, List[int]] = {}
+        for e in new_files.values():
+            indexed.setdefault(shard_slug(e.get("folder")), []).extend(vid for _, vid in e["chunks"])
+        pending, sigs, dupes = collapse_near_duplicates(
+            pending, {slug: sorted(set(vids)) for slug, vids in indexed.items()})
+        for (_, _, h, entry, _), key in dupes:
+            if key >= 0:
+                entry["chunks"].append([h, key])
+
+    kept = {vid for e in new_files.values() for _, vid in e["chunks"]}
+    indexed_vids: Dict[str, set] = {}  # slug -> vids in the shard now (per the manifest)
+    for e in old_files.values():
+        indexed_vids.setdefault(shard_slug(e.get("folder")), set()).update(vid for _, vid in e["chunks"])
+    stale = {slug: sorted(vids - kept) for slug, vids in indexed_vids.items() if vids - kept}
+    adding: Dict[str, int] = {}
+    for _, _, _, _, folder in pending:
+        adding[shard_slug(folder)] = adding.get(shard_slug(folder), 0) + 1
+
+    # Shards to patch or rebuild; in-scope shards also when the mode changed
+    touched = set(stale) | set(adding)
+    if full_rebuild:
+        touched |= {slug for slug, sh in shards.items() if in_scope(sh["folder"])}
+    folder_of = {shard_slug(f): f for f in [e.get("folder") for e in new_files.values()]}
+    folder_of.update({slug: sh["folder"] for slug, sh in shards.items()})
+    rebuild = set()
+    for slug in {s for s in folder_of if in_scope(folder_of[s])} | touched:
+        sh = shards.get(slug) or new_shard(folder_of.get(slug))
+        n_total = sh["index"].ntotal - len(stale.get(slug, [])) + adding.get(slug, 0)
+        if n_total and (sh["index"].ntotal == 0 or full_rebuild or needs_rebuild(sh["params"], shard_mode(sh, mode), n_total)
+                        or (stale.get(slug) and not supports_remove(sh["params"]))):
+            rebuild.add(slug)
+    touched |= rebuild
+
+    if not pending and not stale and new_files == old_files and not rebuild:
+        total = sum(sh["index"].ntotal for sh in shards.values())
+        print(f"✅ Knowledge base up to date ({len(files)} files, {total} vectors, {len(shards)} shards).")
+        return False
+
+    print(f"Found {len(files)} files: {unchanged} unchanged, {reused} chunks reused, "
+          f"{len(pending)} chunks to embed, {len(dupes)} near-duplicates, "
+          f"{sum(map(len, stale.values()))} to remove, {len(touched)} shard(s) to update.")
+
+    # One embedding pass across shards keeps requests full
+    with tqdm(total=len(pending), desc="Embedding") as bar:
+        vecs = embed_texts([ch["text"] for _, ch, _, _, _ in pending],
+                           progress=_StageBar(bar, progress, "embed"))
+
+    # Files re-read or gone get their extra-source rows rewritten
+    redone = {name for name, e in new_files.items() if e is not old_files.get(name)}
+    redone |= old_files.keys() - new_files.keys()
+    store.delete_sources(redone)
+    source_rows = []
+
+    # A reused chunk is either this file's own canonical row or a duplicate
+    # of another file's
+    owners = store.owners(vid for vid, _, _, _ in reindexed)
+    own_ids, seen = [], set()
+    for vid, ch, fp, folder in reindexed:
+        if owners.get(vid) == fp.name and vid not in seen:
+            own_ids.append((vid, ch["chunk_id"]))
+            seen.add(vid)
+        else:
+            source_rows.append(_source_row(vid, fp, ch, folder))
+    store.set_chunk_ids(own_ids)
+
+    added: Dict[str, tuple] = {}  # slug -> (rows, vids)
+    chunk_rows, sig_rows = [], []
+    vid_of = [None] * len(pending)
+    for i, ((fp, ch, h, entry, folder), vec) in enumerate(zip(pending, vecs)):
+        if vec is None:
+            print(f"Skipping chunk {ch['chunk_id']} of {fp.name} due to embedding failure.")
+            entry["sha"] = None  # retry this file on the next refresh
+            continue
+        vid_of[i] = next_id
+        if sigs[i] is not None:
+            sig_rows.append((next_id, sigs[i][0].tobytes(), sigs[i][1]))
+        rows, vids = added.setdefault(shard_slug(folder), ([], []))
+        rows.append(vec)
+        vids.append(next_id)
+        entry["chunks"].append([h, next_id])
+        chunk_rows.append({
+            "vid": next_id,
+            "filename": fp.name,
+            "path": str(fp),
+            "folder": folder,
+            "chunk_id": ch["chunk_id"],
+            "chunk_hash": h,
+            "text": ch["text"]
+        })
+        next_id += 1
+    store.add_many(chunk_rows)
+    store.put_signatures(sig_rows)
+
+    for (fp, ch, h, entry, folder), key in dupes:
+        vid = key if key >= 0 else vid_of[-key - 1]
+        if vid is None:
+            entry["sha"] = None  # its canonical chunk failed to embed; retry the file
+            continue
+        if key < 0:
+            entry["chunks"].append([h, vid])
+        source_rows.append(_source_row(vid, fp, ch, folder))
+    store.add_sources(source_rows)
+
+    # Canonical rows whose file no longer has the chunk, while other files
+    # still do: one of those becomes the row, text included
+    refs = {name: {vid for _, vid in new_files[name]["chunks"]} for name in redone if name in new_files}
+    orphans = {vid for name in redone for _, vid in old_files.get(name, {}).get("chunks", [])
+               if vid in kept and vid not in refs.get(name, ())}
+    for vid, owner in store.owners(orphans).items():
+        if owner in redone and vid not in refs.get(owner, ()):
+            store.promote_source(vid)
+
+    for n_indexed, slug in enumerate(sorted(touched)):
+        progress("index", n_indexed, len(touched))
+        sh = shards.setdefault(slug, new_shard(folder_of.get(slug)))
+        rows, vids = added.get(slug, ([], []))
+        new_vecs = np.vstack(rows) if rows else np.zeros((0, EMBED_DIM), dtype=np.float32)
+        gone = stale.get(slug, [])
+        if slug in rebuild:
+            # From the manifest: IVF shards have no id_map to list their IDs
+            kept_ids = sorted(indexed_vids.get(slug, set()) - set(gone)) if sh["index"].ntotal else []
+            all_vecs = np.vstack([reconstruct(sh["index"], kept_ids), new_vecs])
+            store.delete_many(gone)
+            sh["index"], sh["params"] = build_index(all_vecs, kept_ids + vids, mode=shard_mode(sh, mode),
+                                                   dim=EMBED_DIM)
+            print(f"Built '{sh['params']['mode']}' index for shard {slug} over {len(all_vecs)} vectors.")
+        else:
+            remove_from_index(sh["index"], gone)
+            add_many_to_index(sh["index"], new_vecs, vids)
+
+    progress("index", len(touched), len(touched))
+    progress("save", 0, 1)
+    with metrics.span("save_index"):
+        save_artifacts(sorted(touched), {"next_id": next_id, "files": new_files})
+
+    print(f"✅ Saved {len(touched)} of {len(shards)} shards to {SHARDS_DIR}")
+    print(f"✅ Saved {store.count()} chunks to {CHUNKS_PATH}")
+    cache_stats = get_cache().stats()
+    print(f"ℹ️ Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    return True
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    ap = argparse.ArgumentParser(description="Embed parsed_data into the FAISS index")
+    ap.add_argument("--full", action="store_true", help="re-chunk and re-index everything")
+    ap.add_argument("--index-mode", choices=INDEX_MODES, default=None,
+                    help="rebuild shards in this mode (default: keep each shard's; new ones use INDEX_MODE)")
+    ap.add_argument("--folder", action="append", dest="folders",
+                    help="only refresh this Drive folder's shard (repeatable)")
+    args = ap.parse_args()
+    main(full_rebuild=args.full, index_mode=args.index_mode, folders=args.folders)
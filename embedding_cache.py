@@ -0,0 +1,151 @@
+"""
+On-disk embedding cache shared by embed_and_store (indexing) and
+semantic_search (queries).
+
+Entries are keyed by sha256(model, text) and stored as raw float32 blobs in
+SQLite (WAL mode, so the Streamlit app and a CLI refresh can share it). When
+the stored vectors exceed max_bytes the least recently used entries are
+evicted.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+import metrics
+
+CACHE_PATH = Path(os.getenv("EMBED_CACHE_PATH", "cache/embeddings.sqlite"))
+DEFAULT_MAX_BYTES = int(float(os.getenv("EMBED_CACHE_MAX_MB", "512")) * 1024 * 1024)
+# After eviction the cache is trimmed to this fraction of max_bytes, so
+# eviction runs occasionally rather than on every insert.
+EVICT_TO = 0.9
+
+
+def cache_key(model: str, text: str) -> bytes:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: Path = CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key BLOB PRIMARY KEY, vec BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings(last_used)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM embeddings").fetchone()[0]
+
+    # ---- lookups ----
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        keys = [cache_key(model, t) for t in texts]
+        found: Dict[bytes, bytes] = {}
+        with self._lock:
+            # SQLite caps bound parameters; 500 per query stays well under it
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                       [(now, k) for k in found])
+                self._conn.commit()
+            hits = sum(k in found for k in keys)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        metrics.inc("cache_lookups_total", hits, cache="embedding", result="hit")
+        metrics.inc("cache_lookups_total", len(keys) - hits, cache="embedding", result="miss")
+        return [np.frombuffer(found[k], dtype=np.float32).copy() if k in found else None for k in keys]
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        return self.get_many(model, [text])[0]
+
+    # ---- inserts ----
+    def put_many(self, model: str, texts: Sequence[str], vecs: Sequence[np.ndarray]):
+        now = time.time()
+        rows = [(cache_key(model, t), np.asarray(v, dtype=np.float32).tobytes(), now)
+                for t, v in zip(texts, vecs) if v is not None]
+        if not rows:
+            return
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vec, last_used) VALUES (?, ?, ?)", rows)
+            if self._conn.total_changes > before:
+                # Every vector of one model has the same size
+                self._total_bytes += (self._conn.total_changes - before) * len(rows[0][1])
+            self._conn.commit()
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def put(self, model: str, text: str, vec: np.ndarray):
+        self.put_many(model, [text], [vec])
+
+    def _evict(self):
+        excess = self._total_bytes - int(self.max_bytes * EVICT_TO)
+        victims = []
+        for key, size in self._conn.execute("SELECT key, LENGTH(vec) FROM embeddings ORDER BY last_used"):
+            if excess <= 0:
+                break
+            victims.append((key,))
+            excess -= size
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+        self.evictions += len(victims)
+        self._conn.commit()
+
+    # ---- stats ----
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> EmbeddingCache:
+    """Process-wide cache instance, opened on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache()
+    return _cache
+
+
+if __name__ == "__main__":
+    for k, v in get_cache().stats().items():
+        print(f"{k:>10}: {v}")
@@ -0,0 +1,274 @@
+"""
+In-memory stand-in for the Google Drive v3 service, for offline tests and
+benchmarks of file_parser (and other Drive code).
+
+It implements the subset of the API this repo calls: files().list with q /
+pageSize / pageToken; files().get_media, which works with googleapiclient's
+MediaIoBaseDownload (chunked ranged GETs); and files().create / update, with
+or without a media body (execute() or resumable next_chunk() over
+MediaFileUpload). Optional latencies simulate a real network.
+
+    drive = FakeDrive(list_latency=0.05, download_latency=0.1)
+    root = drive.add_folder("AI_CEO_KnowledgeBase")
+    hr = drive.add_folder("HR", parent=root)
+    drive.add_file("Policy.docx", hr, data, mime)
+    file_parser.set_service_factory(drive.service)
+    gdrive_uploader.set_service_factory(drive.service)
+"""
+import hashlib
+import itertools
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+_CLAUSE_RE = re.compile(
+    r"^\s*(?:"
+    r"(?P<field>name|mimeType)\s*(?P<op>=|!=)\s*'(?P<value>(?:[^'\\]|\\.)*)'"
+    r"|'(?P<parent>[^']+)'\s+in\s+parents"
+    r"|trashed\s*=\s*(?P<trashed>true|false)"
+    r")\s*$"
+)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class _Request:
+    """Mimics googleapiclient.http.HttpRequest just enough: execute()."""
+
+    def __init__(self, fn, latency: float = 0.0):
+        self._fn = fn
+        self._latency = latency
+
+    def execute(self, num_retries: int = 0):
+        if self._latency:
+            time.sleep(self._latency)
+        return self._fn()
+
+
+class _Response(dict):
+    def __init__(self, status: int, headers: Dict[str, str]):
+        super().__init__(headers)
+        self.status = status
+
+
+class _MediaHttp:
+    """The .http object MediaIoBaseDownload calls for each ranged chunk."""
+
+    def __init__(self, data: bytes, latency: float, bytes_per_sec: float):
+        self._data = data
+        self._latency = latency
+        self._bytes_per_sec = bytes_per_sec
+
+    def request(self, uri, method="GET", headers=None, **kwargs):
+        total = len(self._data)
+        rng = (headers or {}).get("range", f"bytes=0-{max(total - 1, 0)}")
+        start, end = (int(x) for x in rng.split("=", 1)[1].split("-"))
+        if total == 0:
+            return _Response(416, {"content-range": "bytes */0"}), b""
+        content = self._data[start:end + 1]
+        delay = self._latency + (len(content) / self._bytes_per_sec if self._bytes_per_sec else 0.0)
+        if delay:
+            time.sleep(delay)
+        return _Response(206, {"content-range": f"bytes {start}-{start + len(content) - 1}/{total}"}), content
+
+
+class _MediaRequest:
+    def __init__(self, file_id: str, data: bytes, latency: float, bytes_per_sec: float):
+        self.uri = f"fake://drive/files/{file_id}?alt=media"
+        self.headers: Dict[str, str] = {}
+        self.http = _MediaHttp(data, latency, bytes_per_sec)
+
+    def execute(self, num_retries: int = 0):
+        return self.http._data
+
+
+class _UploadProgress:
+    """Like googleapiclient.http.MediaUploadProgress."""
+
+    def __init__(self, resumable_progress: int, total_size: int):
+        self.resumable_progress = resumable_progress
+        self.total_size = total_size
+
+    def progress(self) -> float:
+        return self.resumable_progress / self.total_size if self.total_size else 0.0
+
+
+class _UploadRequest:
+    """files().create / update: execute(), or next_chunk() for a resumable media body."""
+
+    def __init__(self, drive: "FakeDrive", finish, media):
+        self._drive = drive
+        self._finish = finish
+        self._media = media
+        self._parts: List[bytes] = []
+        self._sent = 0
+
+    def _send(self, data: bytes):
+        drive = self._drive
+        drive._count("upload_chunk")
+        delay = drive.upload_latency + (len(data) / drive.bytes_per_sec if drive.bytes_per_sec else 0.0)
+        if delay:
+            time.sleep(delay)
+
+    def next_chunk(self, http=None, num_retries: int = 0):
+        media = self._media
+        if media is None or not media.resumable():
+            return None, self.execute()
+        total = media.size()
+        data = media.getbytes(self._sent, min(media.chunksize(), total - self._sent))
+        self._send(data)
+        self._parts.append(data)
+        self._sent += len(data)
+        if self._sent < total:
+            return _UploadProgress(self._sent, total), None
+        return None, self._finish(b"".join(self._parts))
+
+    def execute(self, num_retries: int = 0):
+        if self._media is None:
+            if self._drive.upload_latency:
+                time.sleep(self._drive.upload_latency)
+            return self._finish(None)
+        data = self._media.getbytes(0, self._media.size())
+        self._send(data)
+        return self._finish(data)
+
+
+class FakeDrive:
+    def __init__(self, list_latency: float = 0.0, download_latency: float = 0.0,
+                 bytes_per_sec: float = 0.0, upload_latency: float = 0.0):
+        self.list_latency = list_latency
+        self.download_latency = download_latency
+        self.upload_latency = upload_latency  # per create/update request and per upload chunk
+        self.bytes_per_sec = bytes_per_sec
+        self.entries: Dict[str, Dict] = {}
+        self.blobs: Dict[str, bytes] = {}
+        self.calls: Dict[str, int] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    # ---- fixture helpers ----
+    def _new_id(self) -> str:
+        with self._lock:
+            return f"f{next(self._ids):06d}"
+
+    def add_folder(self, name: str, parent: Optional[str] = None) -> str:
+        fid = self._new_id()
+        self.entries[fid] = {"id": fid, "name": name, "mimeType": FOLDER_MIME,
+                             "parents": [parent] if parent else [], "trashed": False,
+                             "modifiedTime": _now()}
+        return fid
+
+    def add_file(self, name: str, parent: str, data: bytes, mime: str) -> str:
+        fid = self._new_id()
+        self.entries[fid] = {"id": fid, "name": name, "mimeType": mime, "parents": [parent],
+                             "trashed": False}
+        self.set_content(fid, data)
+        return fid
+
+    def set_content(self, file_id: str, data: bytes):
+        self.blobs[file_id] = data
+        self.entries[file_id].update({
+            "md5Checksum": hashlib.md5(data).hexdigest(),
+            "size": str(len(data)),
+            "modifiedTime": _now(),
+        })
+
+    def delete(self, file_id: str):
+        self.entries.pop(file_id, None)
+        self.blobs.pop(file_id, None)
+
+    # ---- service surface ----
+    def service(self) -> "FakeDrive":
+        """Factory for file_parser.set_service_factory; the fake is thread-safe."""
+        return self
+
+    def files(self):
+        # service.files().list(...) — the fake is its own files collection
+        return self
+
+    def _count(self, name: str):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _matches(self, meta: Dict, q: Optional[str]) -> bool:
+        if not q:
+            return not meta["trashed"]
+        trashed_clause = False
+        for clause in re.split(r"\s+and\s+", q.strip()):
+            m = _CLAUSE_RE.match(clause)
+            if not m:
+                raise ValueError(f"FakeDrive cannot parse query clause: {clause!r}")
+            if m.group("field"):
+                value = m.group("value").replace("\\'", "'")
+                equal = meta.get(m.group("field")) == value
+                if equal != (m.group("op") == "="):
+                    return False
+            elif m.group("parent"):
+                if m.group("parent") not in meta["parents"]:
+                    return False
+            else:
+                trashed_clause = True
+                if meta["trashed"] != (m.group("trashed") == "true"):
+                    return False
+        return trashed_clause or not meta["trashed"]
+
+    def list(self, q: Optional[str] = None, pageSize: int = 100, pageToken: Optional[str] = None,
+             fields: Optional[str] = None, **kwargs) -> _Request:
+        def run():
+            self._count("list")
+            hits: List[Dict] = [dict((k, v) for k, v in meta.items() if k != "trashed")
+                                for meta in sorted(self.entries.values(), key=lambda m: m["id"])
+                                if self._matches(meta, q)]
+            start = int(pageToken or 0)
+            page = hits[start:start + pageSize]
+            result = {"files": page}
+            if start + pageSize < len(hits):
+                result["nextPageToken"] = str(start + pageSize)
+            return result
+        return _Request(run, self.list_latency)
+
+    def get_media(self, fileId: str, **kwargs) -> _MediaRequest:
+        self._count("get_media")
+        if fileId not in self.blobs:
+            raise KeyError(f"File not found: {fileId}")
+        return _MediaRequest(fileId, self.blobs[fileId], self.download_latency, self.bytes_per_sec)
+
+    def create(self, body: Optional[Dict] = None, media_body=None, fields: Optional[str] = None,
+               **kwargs) -> _UploadRequest:
+        body = dict(body or {})
+
+        def finish(data: Optional[bytes]) -> Dict:
+            self._count("create")
+            fid = self._new_id()
+            mime = body.get("mimeType") or (media_body.mimetype() if media_body else None)
+            self.entries[fid] = {"id": fid, "name": body.get("name", "Untitled"),
+                                 "mimeType": mime or "application/octet-stream",
+                                 "parents": list(body.get("parents", [])), "trashed": False,
+                                 "modifiedTime": _now()}
+            if data is not None:
+                self.set_content(fid, data)
+            return {k: v for k, v in self.entries[fid].items() if k != "trashed"}
+        return _UploadRequest(self, finish, media_body)
+
+    def update(self, fileId: str, body: Optional[Dict] = None, media_body=None,
+               fields: Optional[str] = None, **kwargs) -> _UploadRequest:
+        if fileId not in self.entries:
+            raise KeyError(f"File not found: {fileId}")
+        body = dict(body or {})
+
+        def finish(data: Optional[bytes]) -> Dict:
+            self._count("update")
+            entry = self.entries[fileId]
+            entry.update((k, v) for k, v in body.items() if k in ("name", "mimeType", "trashed"))
+            if data is not None:
+                self.set_content(fileId, data)
+            else:
+                entry["modifiedTime"] = _now()
+            return {k: v for k, v in entry.items() if k != "trashed"}
+        return _UploadRequest(self, finish, media_body)
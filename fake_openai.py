@@ -0,0 +1,225 @@
+"""
+Local stand-in for the OpenAI HTTP API, for offline tests and benchmarks.
+
+Embeddings are deterministic feature-hashed bag-of-words vectors, so texts that
+share words land close together and search results are meaningful. Chat
+completions return a canned answer that quotes the question, either whole or
+streamed as server-sent events with configurable per-token delay.
+
+    python fake_openai.py --port 8089 --latency 0.05 --token-latency 0.02
+    OPENAI_API_BASE=http://127.0.0.1:8089/v1 python embed_and_store.py
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+EMBED_DIM = 1536
+_TOKEN_RE = re.compile(r"\w+")
+
+
+# ─────────────────────────────────────────────────────────────
+# Deterministic embedder
+# ─────────────────────────────────────────────────────────────
+@lru_cache(maxsize=1 << 16)
+def _token_slots(token: str, dim: int) -> Tuple[np.ndarray, np.ndarray]:
+    h = hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+    slots = np.frombuffer(h, dtype=np.uint32) % dim
+    signs = np.where(np.frombuffer(h[:4], dtype=np.uint8) & 1, 1.0, -1.0)
+    return slots, signs
+
+
+def fake_embedding(text: str, dim: int = EMBED_DIM) -> np.ndarray:
+    vec = np.zeros(dim, dtype=np.float32)
+    pairs = [_token_slots(tok, dim) for tok in _TOKEN_RE.findall(text.lower())]
+    if pairs:
+        np.add.at(vec, np.concatenate([p[0] for p in pairs]), np.concatenate([p[1] for p in pairs]))
+    norm = np.linalg.norm(vec)
+    if norm == 0:
+        vec[0] = 1.0
+        return vec
+    return vec / norm
+
+
+def fake_embeddings(texts: List[str], dim: int = EMBED_DIM) -> np.ndarray:
+    return np.vstack([fake_embedding(t, dim) for t in texts]) if texts else np.zeros((0, dim), np.float32)
+
+
+# ─────────────────────────────────────────────────────────────
+# HTTP server
+# ─────────────────────────────────────────────────────────────
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, latency: float = 0.0, per_item_latency: float = 0.0,
+                 rate_limit_every: int = 0, dim: int = EMBED_DIM,
+                 first_token_latency: float = 0.0, token_latency: float = 0.0,
+                 answer_tokens: int = 60):
+        super().__init__(addr, _Handler)
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+        self.rate_limit_every = rate_limit_every
+        self.dim = dim
+        self.requests = 0
+        self.rate_limited = 0
+        self._count_lock = threading.Lock()
+
+    def next_request(self) -> int:
+        with self._count_lock:
+            self.requests += 1
+            return self.requests
+
+
+def fake_answer_tokens(messages: List[dict], n_tokens: int) -> List[str]:
+    question = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    question = question.split("Sources:", 1)[0].replace("Query:", "").strip()
+    words = f"Stub answer to: {question[:120]}".split()
+    filler = "Based on the provided sources the plan covers revenue hiring and product milestones".split()
+    while len(words) < n_tokens:
+        words.extend(filler)
+    return [w + " " for w in words[:n_tokens]]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeOpenAIServer
+    protocol_version = "HTTP/1.1"  # keep-alive, so pooled clients reuse connections
+
+    def log_message(self, *args):  # keep benchmark output clean
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: Optional[dict] = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        n = self.server.next_request()
+
+        every = self.server.rate_limit_every
+        if every and n % every == 0:
+            self.server.rate_limited += 1
+            self._send_json(429, {"error": {"message": "Rate limit reached (fake)", "type": "requests"}},
+                            headers={"Retry-After": "0.2"})
+            return
+
+        if self.path.rstrip("/").endswith("/embeddings"):
+            self._embeddings(payload)
+        elif self.path.rstrip("/").endswith("/chat/completions"):
+            self._chat(payload)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _embeddings(self, payload: dict):
+        inputs = payload.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        time.sleep(self.server.latency + self.server.per_item_latency * len(inputs))
+        vecs = fake_embeddings(inputs, self.server.dim)
+        data = [{"object": "embedding", "index": i, "embedding": v}
+                for i, v in enumerate(np.round(vecs, 6).tolist())]
+        tokens = sum(len(t) // 4 + 1 for t in inputs)
+        self._send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": payload.get("model", "fake"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _chat(self, payload: dict):
+        srv = self.server
+        tokens = fake_answer_tokens(payload.get("messages", []), srv.answer_tokens)
+        model = payload.get("model", "fake")
+        created = int(time.time())
+        usage = {"prompt_tokens": sum(len(m.get("content", "")) // 4 + 1 for m in payload.get("messages", [])),
+                 "completion_tokens": len(tokens)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        time.sleep(srv.latency + srv.first_token_latency)
+
+        if not payload.get("stream"):
+            time.sleep(srv.token_latency * len(tokens))
+            self._send_json(200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(tokens)}}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(delta: dict, finish: Optional[str] = None):
+            chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created,
+                     "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        event({"role": "assistant", "content": ""})
+        for i, tok in enumerate(tokens):
+            if i:
+                time.sleep(srv.token_latency)
+            event({"content": tok})
+        event({}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, **opts) -> Tuple[FakeOpenAIServer, str]:
+    """Start the fake API on a daemon thread; returns (server, base_url ending in /v1)."""
+    server = FakeOpenAIServer((host, port), **opts)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def point_openai_at(base_url: str):
+    """Route both the legacy module-level client and new-style clients to base_url."""
+    import os
+    import openai
+    os.environ["OPENAI_API_BASE"] = base_url
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+    if hasattr(openai, "api_base"):
+        openai.api_base = base_url
+    openai.api_key = openai.api_key or "sk-fake"
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Fake OpenAI API for offline runs")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency", type=float, default=0.0, help="seconds added per request")
+    ap.add_argument("--per-item-latency", type=float, default=0.0, help="seconds added per input")
+    ap.add_argument("--rate-limit-every", type=int, default=0, help="return 429 on every Nth request")
+    ap.add_argument("--first-token-latency", type=float, default=0.0, help="seconds before the first token")
+    ap.add_argument("--token-latency", type=float, default=0.0, help="seconds between streamed tokens")
+    ap.add_argument("--answer-tokens", type=int, default=60)
+    args = ap.parse_args()
+    srv = FakeOpenAIServer((args.host, args.port), latency=args.latency,
+                           per_item_latency=args.per_item_latency,
+                           rate_limit_every=args.rate_limit_every,
+                           first_token_latency=args.first_token_latency,
+                           token_latency=args.token_latency,
+                           answer_tokens=args.answer_tokens)
+    print(f"Fake OpenAI API on http://{args.host}:{args.port}/v1")
+    srv.serve_forever()
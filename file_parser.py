@@ -1,46 +1,141 @@
 import os
 import io
-import streamlit as st
-import docx
-import pandas as pd
-from PyPDF2 import PdfReader
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
-from google.oauth2 import service_account
+import json
+import hashlib
+import datetime
+import tempfile
+import threading
+import importlib.util
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from table_store import get_table_store
 
 # ─────────────────────────────────────────────────────────────
 # ✅ Authentication from Streamlit secrets (gdrive2)
 # ─────────────────────────────────────────────────────────────
 SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
-gdrive_secrets = st.secrets["gdrive"]
-creds = service_account.Credentials.from_service_account_info(dict(gdrive_secrets), scopes=SCOPES)
-service = build("drive", "v3", credentials=creds)
+
+# Parser and Google client libraries are imported on first use: together they
+# take about a second to load, and only a refresh needs them.
+#
+# googleapiclient services sit on httplib2, which is not thread-safe, so each
+# download thread gets its own service. Tests and benchmarks can install a
+# factory (e.g. fake_drive) instead of the real Drive API.
+_local = threading.local()
+_service_factory = None
+
+def _build_service():
+    import streamlit as st
+    from googleapiclient.discovery import build
+    from google.oauth2 import service_account
+    gdrive_secrets = st.secrets["gdrive"]
+    creds = service_account.Credentials.from_service_account_info(dict(gdrive_secrets), scopes=SCOPES)
+    return build("drive", "v3", credentials=creds, cache_discovery=False)
+
+def set_service_factory(factory):
+    global _service_factory
+    _service_factory = factory
+    _local.__dict__.clear()
+
+def get_service():
+    svc = getattr(_local, 'service', None)
+    if svc is None:
+        svc = (_service_factory or _build_service)()
+        _local.service = svc
+    return svc
 
 # ─────────────────────────────────────────────────────────────
 # 🔧 Constants
 # ─────────────────────────────────────────────────────────────
 FOLDER_NAME = 'AI_CEO_KnowledgeBase'
 OUTPUT_DIR = 'parsed_data'
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# Drive file id -> {name, folder, modifiedTime, md5Checksum, output}; lets a
+# refresh skip files whose Drive content has not changed.
+DRIVE_MANIFEST_PATH = os.path.join(OUTPUT_DIR, '_drive_manifest.json')
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+PDF_MIME = 'application/pdf'
+DOCX_MIME = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+PAGE_SIZE = 1000
+# Downloads are network-bound (threads); extraction is CPU-bound (processes).
+DOWNLOAD_WORKERS = 8
+EXTRACT_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+# PDFs with at least this many pages are split into page ranges extracted in parallel
+HAVE_PYMUPDF = any(importlib.util.find_spec(name) for name in ('pymupdf', 'fitz'))
+PDF_BACKEND = os.getenv('PDF_BACKEND', 'pymupdf' if HAVE_PYMUPDF else 'pypdf2')
+PDF_PARALLEL_MIN_PAGES = 40
+PDF_PAGES_PER_TASK = 20
+# Spreadsheets: rows are embedded in groups, each repeating the header line
+SHEET_MAX_COLS = 30          # wider sheets are cut (noted in the header)
+SHEET_MAX_EMBED_ROWS = 2000  # rows per sheet rendered for embedding
+SHEET_MAX_TABLE_ROWS = 200_000  # rows per numeric sheet kept in the table store
+SHEET_GROUP_ROWS = 40
+SHEET_GROUP_CHARS = 1500
+SHEET_MAX_CELL_CHARS = 120
+SHEET_NUMERIC_SHARE = 0.5    # share of numeric cells that makes a sheet a table
 
 # ─────────────────────────────────────────────────────────────
 # 🔍 Helpers
 # ─────────────────────────────────────────────────────────────
 def get_folder_id(folder_name):
-    query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder'"
-    results = service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
+    query = f"name='{folder_name}' and mimeType='{FOLDER_MIME}'"
+    results = get_service().files().list(q=query, spaces='drive', fields='files(id, name)').execute()
     folders = results.get('files', [])
     if not folders:
         raise Exception(f"Folder '{folder_name}' not found in Drive.")
     return folders[0]['id']
 
 def list_folder_contents(parent_id):
+    # Follow nextPageToken; a single page silently truncates large folders
     query = f"'{parent_id}' in parents"
-    results = service.files().list(q=query, fields='files(id, name, mimeType)').execute()
-    return results.get('files', [])
+    files, page_token = [], None
+    while True:
+        results = get_service().files().list(
+            q=query,
+            pageSize=PAGE_SIZE,
+            pageToken=page_token,
+            fields='nextPageToken, files(id, name, mimeType, modifiedTime, md5Checksum)',
+        ).execute()
+        files.extend(results.get('files', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return files
+
+def load_drive_manifest():
+    if os.path.exists(DRIVE_MANIFEST_PATH):
+        with open(DRIVE_MANIFEST_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+def save_drive_manifest(manifest):
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    tmp = DRIVE_MANIFEST_PATH + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, DRIVE_MANIFEST_PATH)
+
+def is_unchanged(file, folder_label, prev):
+    # md5Checksum covers binary uploads; Google-native files only have modifiedTime
+    if not prev or prev.get('folder') != folder_label or prev.get('name') != file['name']:
+        return False
+    if not os.path.exists(prev.get('output', '')):
+        return False
+    if file.get('md5Checksum'):
+        return prev.get('md5Checksum') == file['md5Checksum']
+    return prev.get('modifiedTime') == file.get('modifiedTime')
+
+def remove_output(path, manifest):
+    # Another Drive file may map to the same output name; keep it if so
+    if path and os.path.exists(path) and not any(e.get('output') == path for e in manifest.values()):
+        os.remove(path)
+        print(f"🗑️ Removed stale: {path}")
 
 def download_file(file_id):
-    request = service.files().get_media(fileId=file_id)
+    from googleapiclient.http import MediaIoBaseDownload
+    request = get_service().files().get_media(fileId=file_id)
     fh = io.BytesIO()
     downloader = MediaIoBaseDownload(fh, request)
     done = False
@@ -49,64 +144,399 @@ def download_file(file_id):
     fh.seek(0)
     return fh
 
-def extract_text_from_pdf(fh):
-    reader = PdfReader(fh)
-    return "\n".join([page.extract_text() or "" for page in reader.pages])
+def download_bytes(file_id):
+    return download_file(file_id).getvalue()
+
+@lru_cache(maxsize=None)
+def _pymupdf():
+    try:
+        import pymupdf
+    except ImportError:  # PyMuPDF < 1.24 only ships the fitz name
+        import fitz as pymupdf
+    return pymupdf
+
+def _open_pdf(source):
+    pymupdf = _pymupdf()
+    return pymupdf.open(source) if isinstance(source, str) else pymupdf.open(stream=source, filetype='pdf')
+
+# ── PDF backends: name -> fn(source, start, stop) for pages [start, stop);
+#    source is the PDF bytes or a file path.
+def _pdf_pages_pymupdf(source, start, stop):
+    with _open_pdf(source) as doc:
+        stop = min(stop, doc.page_count)
+        return "\n".join(doc[i].get_text() for i in range(start, stop))
+
+def _pdf_pages_pypdf2(source, start, stop):
+    from PyPDF2 import PdfReader
+    reader = PdfReader(source if isinstance(source, str) else io.BytesIO(source))
+    pages = reader.pages[start:stop]
+    return "\n".join([page.extract_text() or "" for page in pages])
+
+PDF_BACKENDS = {'pypdf2': _pdf_pages_pypdf2}
+if HAVE_PYMUPDF:
+    PDF_BACKENDS['pymupdf'] = _pdf_pages_pymupdf
+
+def pdf_page_count(source):
+    if HAVE_PYMUPDF:
+        try:
+            with _open_pdf(source) as doc:
+                return doc.page_count
+        except Exception:
+            pass
+    from PyPDF2 import PdfReader
+    return len(PdfReader(source if isinstance(source, str) else io.BytesIO(source)).pages)
+
+def extract_pdf_range(source, start, stop, backend=None):
+    # PyPDF2 is the fallback when the preferred backend chokes on a file
+    backend = backend or PDF_BACKEND
+    try:
+        return PDF_BACKENDS[backend](source, start, stop)
+    except Exception as e:
+        if backend == 'pypdf2':
+            raise
+        print(f"⚠️ {backend} failed on pages {start}-{stop} ({e}); falling back to PyPDF2")
+        return _pdf_pages_pypdf2(source, start, stop)
+
+def pdf_page_ranges(n_pages, per_task=PDF_PAGES_PER_TASK):
+    return [(i, min(i + per_task, n_pages)) for i in range(0, n_pages, per_task)]
+
+def submit_pdf_ranges(pool, path, n_pages, backend=None):
+    """Fan a PDF on disk out to `pool` as page-range tasks; returns futures in page order."""
+    return [pool.submit(extract_pdf_range, path, a, b, backend) for a, b in pdf_page_ranges(n_pages)]
+
+def extract_pdf_parallel(data, pool, backend=None):
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
+        tmp.write(data)
+    try:
+        futures = submit_pdf_ranges(pool, tmp.name, pdf_page_count(tmp.name), backend)
+        return "\n".join(f.result() for f in futures)
+    finally:
+        os.remove(tmp.name)
+
+def extract_text_from_pdf(fh, backend=None):
+    data = fh.read() if hasattr(fh, 'read') else fh
+    return extract_pdf_range(data, 0, pdf_page_count(data), backend)
 
 def extract_text_from_docx(fh):
+    import docx
     doc = docx.Document(fh)
     return "\n".join([p.text for p in doc.paragraphs])
 
+# ── Spreadsheets
+def _cell_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:.10g}"
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat().replace("T00:00:00", "")
+    text = " ".join(str(value).split())
+    return text if len(text) <= SHEET_MAX_CELL_CHARS else text[:SHEET_MAX_CELL_CHARS - 1] + "…"
+
+def _trim(row):
+    end = len(row)
+    while end and (row[end - 1] is None or row[end - 1] == ""):
+        end -= 1
+    return row[:end]
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _sheet_blocks(title, rows, workbook, store):
+    """
+    Render one sheet (an iterator of row tuples) as blocks of at most
+    SHEET_GROUP_ROWS rows / SHEET_GROUP_CHARS chars, each starting with the
+    sheet name and header, so every chunk is self-describing. Numeric sheets
+    also stream all their rows into the table store. Memory stays bounded by
+    one block plus one insert batch.
+    """
+    header, width = None, 0
+    sample, numeric, cells = [], 0, 0
+    is_table = None
+    batch, n_rows, extra_cols = [], 0, 0
+
+    def head_line():
+        cols = " | ".join(header)
+        return f"{cols} | (+{extra_cols} more columns)" if extra_cols else cols
+
+    def flush_batch():
+        # Commit per batch: worker processes share the store, so no one
+        # holds the write lock for a whole workbook
+        if batch:
+            store.add_rows(workbook, title, batch)
+            store.commit()
+            batch.clear()
+
+    block, block_chars, first_row = [], 0, 1
+    for raw in rows:
+        row = _trim(raw)
+        if not row:
+            continue
+        if header is None:
+            # First non-empty row: a header if it is all text
+            width = len(row)
+            extra_cols = max(0, width - SHEET_MAX_COLS)
+            if all(v is None or isinstance(v, str) for v in row):
+                header = [_cell_text(v) or f"col{i + 1}" for i, v in enumerate(row[:SHEET_MAX_COLS])]
+                continue
+            header = [f"col{i + 1}" for i in range(min(width, SHEET_MAX_COLS))]
+        n_rows += 1
+        values = row[:SHEET_MAX_COLS]
+
+        if is_table is None:
+            sample.append(values)
+            numeric += sum(1 for v in values if _is_number(v))
+            cells += sum(1 for v in values if v is not None and v != "")
+            if len(sample) >= 50:
+                is_table = bool(cells) and numeric / cells >= SHEET_NUMERIC_SHARE
+                if is_table:
+                    store.add_sheet(workbook, title, header)
+                    batch.extend(enumerate(sample, 1))
+        elif is_table and n_rows <= SHEET_MAX_TABLE_ROWS:
+            batch.append((n_rows, values))
+            if len(batch) >= 1000:
+                flush_batch()
+
+        if n_rows <= SHEET_MAX_EMBED_ROWS:
+            line = " | ".join(_cell_text(v) for v in values)
+            if block and (len(block) >= SHEET_GROUP_ROWS or block_chars + len(line) > SHEET_GROUP_CHARS):
+                yield f"[SHEET]: {title} | rows {first_row}-{n_rows - 1}\n{head_line()}\n" + "\n".join(block)
+                block, block_chars, first_row = [], 0, n_rows
+            block.append(line)
+            block_chars += len(line) + 1
+
+    if is_table is None and sample:
+        is_table = bool(cells) and numeric / cells >= SHEET_NUMERIC_SHARE
+        if is_table:
+            store.add_sheet(workbook, title, header)
+            batch.extend(enumerate(sample, 1))
+    if block:
+        yield f"[SHEET]: {title} | rows {first_row}-{min(n_rows, SHEET_MAX_EMBED_ROWS)}\n{head_line()}\n" + "\n".join(block)
+    if n_rows > SHEET_MAX_EMBED_ROWS:
+        note = " (all rows kept in the table store)" if is_table else ""
+        yield f"[SHEET]: {title} | {n_rows - SHEET_MAX_EMBED_ROWS} more rows not embedded{note}"
+    if is_table:
+        flush_batch()
+        store.finish_sheet(workbook, title, min(n_rows, SHEET_MAX_TABLE_ROWS))
+
 def extract_text_from_excel(fh):
-    df = pd.read_excel(fh)
-    return df.to_string(index=False)
+    """
+    Every sheet, read with openpyxl's streaming read-only reader, as compact
+    pipe-separated row groups (see _sheet_blocks). Workbooks are keyed in
+    the table store by the MD5 of their bytes, i.e. Drive's md5Checksum.
+    """
+    data = fh.getvalue() if isinstance(fh, io.BytesIO) else fh.read()
+    workbook = hashlib.md5(data).hexdigest()
+    store = get_table_store()
+    store.begin_workbook(workbook)
+    store.commit()
+    from openpyxl import load_workbook
+    wb = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        blocks = []
+        for ws in wb.worksheets:
+            blocks.extend(_sheet_blocks(ws.title, ws.iter_rows(values_only=True), workbook, store))
+    finally:
+        wb.close()
+    store.commit()
+    return "\n\n".join(blocks)
+
+# ── Extractor registry: mime type -> fn(file-like) -> text
+EXTRACTORS = {
+    PDF_MIME: extract_text_from_pdf,
+    DOCX_MIME: extract_text_from_docx,
+    XLSX_MIME: extract_text_from_excel,
+}
+
+def register_extractor(mime, fn):
+    EXTRACTORS[mime] = fn
+
+def is_supported(mime):
+    return mime in EXTRACTORS
+
+def extract_text(mime, data):
+    # Top-level and bytes-in/str-out so it can run in a worker process
+    if mime not in EXTRACTORS:
+        raise ValueError(f"Unsupported file type: {mime}")
+    return EXTRACTORS[mime](io.BytesIO(data))
+
+def save_parsed(name, folder_label, text):
+    base_name = os.path.splitext(name)[0].replace(' ', '_')
+    output_path = os.path.join(OUTPUT_DIR, f"{base_name}.txt")
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write(f"[FOLDER]: {folder_label}\n[FILE]: {name}\n\n{text}")
+    print(f"✅ Saved to {output_path}")
+    return output_path
 
 def process_and_save(file, folder_label):
-    file_id = file['id']
     name = file['name']
     mime = file['mimeType']
 
     print(f"📄 Processing: {name}")
+    if not is_supported(mime):
+        print(f"❌ Skipping unsupported file type: {name}")
+        return
     try:
-        if mime == 'application/pdf':
-            fh = download_file(file_id)
-            text = extract_text_from_pdf(fh)
-        elif mime == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
-            fh = download_file(file_id)
-            text = extract_text_from_docx(fh)
-        elif mime == 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet':
-            fh = download_file(file_id)
-            text = extract_text_from_excel(fh)
-        else:
-            print(f"❌ Skipping unsupported file type: {name}")
-            return
-
-        base_name = os.path.splitext(name)[0].replace(' ', '_')
-        output_path = os.path.join(OUTPUT_DIR, f"{base_name}.txt")
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(f"[FOLDER]: {folder_label}\n[FILE]: {name}\n\n{text}")
-        print(f"✅ Saved to {output_path}")
-
+        text = extract_text(mime, download_bytes(file['id']))
+        return save_parsed(name, folder_label, text)
     except Exception as e:
         print(f"❌ Error processing {name}: {e}")
 
+# ─────────────────────────────────────────────────────────────
+# 🚚 Pipeline
+# ─────────────────────────────────────────────────────────────
+def _spill_if_large_pdf(data):
+    # Large PDFs go to a temp file so page-range tasks can open it without
+    # each pickling the whole document; returns (path, pages) or None.
+    pages = pdf_page_count(data)
+    if pages < PDF_PARALLEL_MIN_PAGES:
+        return None
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
+        tmp.write(data)
+    return tmp.name, pages
+
+def iter_parsed(jobs, download_workers=DOWNLOAD_WORKERS, extract_workers=EXTRACT_WORKERS,
+                use_processes=True):
+    """
+    Download and extract (file, folder_label) jobs concurrently, yielding
+    (file, folder_label, text, error) as each file finishes, in completion
+    order. At most 2 * download_workers files are in flight, which bounds
+    the bytes held in memory; jobs are pulled lazily so listing overlaps
+    with downloading. Large PDFs are extracted as parallel page ranges.
+    """
+    jobs = iter(jobs)
+    window = 2 * download_workers
+    pool_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with ThreadPoolExecutor(download_workers) as dl_pool, pool_cls(extract_workers) as ex_pool:
+        inflight = {}  # future -> (stage, file, folder_label)
+        split = {}     # file id -> {'path', 'futures', 'left'} for PDFs extracted by page range
+        active = 0     # files downloading or extracting
+
+        def fill():
+            nonlocal active
+            while active < window:
+                job = next(jobs, None)
+                if job is None:
+                    return
+                file, label = job
+                inflight[dl_pool.submit(download_bytes, file['id'])] = ('download', file, label)
+                active += 1
+
+        def finish_split(file_id):
+            os.remove(split.pop(file_id)['path'])
+
+        fill()
+        while inflight:
+            done, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+            for fut in done:
+                stage, file, label = inflight.pop(fut)
+                if stage == 'part' and file['id'] not in split:
+                    continue  # an earlier range of this file already failed
+                try:
+                    result = fut.result()
+                    if stage == 'download' and file['mimeType'] == PDF_MIME:
+                        spilled = _spill_if_large_pdf(result)
+                        if spilled:
+                            path, pages = spilled
+                            futures = submit_pdf_ranges(ex_pool, path, pages)
+                            split[file['id']] = {'path': path, 'futures': futures, 'left': len(futures)}
+                            for f in futures:
+                                inflight[f] = ('part', file, label)
+                            continue
+                except Exception as e:
+                    if file['id'] in split:
+                        finish_split(file['id'])
+                    active -= 1
+                    yield file, label, None, e
+                    continue
+                if stage == 'download':
+                    inflight[ex_pool.submit(extract_text, file['mimeType'], result)] = ('extract', file, label)
+                elif stage == 'part':
+                    group = split[file['id']]
+                    group['left'] -= 1
+                    if group['left'] == 0:
+                        text = "\n".join(f.result() for f in group['futures'])
+                        finish_split(file['id'])
+                        active -= 1
+                        yield file, label, text, None
+                else:
+                    active -= 1
+                    yield file, label, result, None
+            fill()
+
 # ─────────────────────────────────────────────────────────────
 # ▶️ Main
 # ─────────────────────────────────────────────────────────────
-def main():
+def main(full_rebuild=False, download_workers=DOWNLOAD_WORKERS, extract_workers=EXTRACT_WORKERS,
+         use_processes=True, progress=None):
+    """
+    Parse new and changed Drive files into parsed_data. progress, if given,
+    is called as progress('parse', files done, files queued so far); an
+    exception it raises stops the run, keeping the files finished so far.
+    """
     parent_id = get_folder_id(FOLDER_NAME)
-    folders = list_folder_contents(parent_id)
-
-    for folder in folders:
-        if folder['mimeType'] != 'application/vnd.google-apps.folder':
-            continue  # Skip files at root
-        print(f"\n📁 Scanning folder: {folder['name']}")
-        subfolder_id = folder['id']
-        files = list_folder_contents(subfolder_id)
-        if not files:
-            print("   (empty)")
-        for file in files:
-            process_and_save(file, folder['name'])
+    manifest = {} if full_rebuild else load_drive_manifest()
+    seen = set()
+    queued = 0
+
+    def jobs():
+        nonlocal queued
+        for folder in list_folder_contents(parent_id):
+            if folder['mimeType'] != FOLDER_MIME:
+                continue  # Skip files at root
+            print(f"\n📁 Scanning folder: {folder['name']}")
+            files = list_folder_contents(folder['id'])
+            if not files:
+                print("   (empty)")
+            for file in files:
+                seen.add(file['id'])
+                if is_unchanged(file, folder['name'], manifest.get(file['id'])):
+                    continue
+                if not is_supported(file['mimeType']):
+                    print(f"❌ Skipping unsupported file type: {file['name']}")
+                    continue
+                print(f"📄 Processing: {file['name']}")
+                queued += 1
+                yield file, folder['name']
+
+    done = 0
+    try:
+        for file, label, text, err in iter_parsed(jobs(), download_workers, extract_workers, use_processes):
+            done += 1
+            if err is not None:
+                print(f"❌ Error processing {file['name']}: {err}")
+                continue  # keep the last good version (if any); retried next refresh
+            output_path = save_parsed(file['name'], label, text)
+            if file['mimeType'] == XLSX_MIME and file.get('md5Checksum'):
+                get_table_store().link(file['md5Checksum'], file['name'], label)
+            prev = manifest.get(file['id'])
+            manifest[file['id']] = {
+                'name': file['name'],
+                'folder': label,
+                'modifiedTime': file.get('modifiedTime'),
+                'md5Checksum': file.get('md5Checksum'),
+                'output': output_path,
+            }
+            if prev and prev.get('output') != output_path:
+                remove_output(prev.get('output'), manifest)
+            if progress is not None:
+                progress('parse', done, queued)
+    except BaseException:
+        # Stopped early: record the finished files so they are not fetched again
+        save_drive_manifest(manifest)
+        raise
+
+    # Files deleted from Drive: drop their parsed text so the embedder removes them
+    for file_id in [fid for fid in manifest if fid not in seen]:
+        entry = manifest.pop(file_id)
+        remove_output(entry.get('output'), manifest)
+
+    save_drive_manifest(manifest)
+    # Numeric tables of workbooks that changed or left Drive
+    get_table_store().prune(e.get('md5Checksum') for e in manifest.values())
+    if progress is not None:
+        progress('parse', done, queued)
 
 if __name__ == '__main__':
     main()
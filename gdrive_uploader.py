@@ -1,30 +1,105 @@
+"""
+Upload local files to Google Drive.
+
+sync_folder mirrors a local directory tree into a Drive folder in bulk. It
+resolves the folder tree once, listing each Drive folder a single time with
+pagination and caching the folder ids. It skips files whose local MD5
+matches Drive's md5Checksum and uploads the rest concurrently as resumable,
+chunked uploads. find_or_create_folder and upload_or_update_file remain for
+one-off files.
+
+    python gdrive_uploader.py reports/ AI_CEO_KnowledgeBase/Finance --workers 8
+"""
+import hashlib
 import os
-import streamlit as st
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-from google.oauth2 import service_account
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
 
 # ==============================
 # Google Drive Auth
 # ==============================
 SCOPES = ["https://www.googleapis.com/auth/drive"]
-gdrive_secrets = st.secrets["gdrive"]
 
-credentials = service_account.Credentials.from_service_account_info(
-    dict(gdrive_secrets), scopes=SCOPES
-)
-service = build("drive", "v3", credentials=credentials)
+# If you are using a Shared Drive (read from the secrets with the credentials)
+SHARED_DRIVE_ID = None
+
+# As in file_parser: the Google libraries load on first use, and each upload
+# thread gets its own service (httplib2 is not thread-safe). Tests and
+# benchmarks can install a factory such as fake_drive.FakeDrive.service.
+_local = threading.local()
+_service_factory = None
+
+
+def _build_service():
+    global SHARED_DRIVE_ID
+    import streamlit as st
+    from googleapiclient.discovery import build
+    from google.oauth2 import service_account
+    gdrive_secrets = st.secrets["gdrive"]
+    SHARED_DRIVE_ID = gdrive_secrets.get("shared_drive_id", None)
+    credentials = service_account.Credentials.from_service_account_info(
+        dict(gdrive_secrets), scopes=SCOPES
+    )
+    return build("drive", "v3", credentials=credentials, cache_discovery=False)
+
+
+def set_service_factory(factory):
+    global _service_factory
+    _service_factory = factory
+    _local.__dict__.clear()
+    with _folder_lock:
+        _folder_ids.clear()
+
+
+def get_service():
+    svc = getattr(_local, "service", None)
+    if svc is None:
+        svc = (_service_factory or _build_service)()
+        _local.service = svc
+    return svc
+
+
+def __getattr__(name):
+    # `service` used to be built at import time; it is still there, built lazily
+    if name == "service":
+        return get_service()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# ==============================
+# Constants
+# ==============================
+FOLDER_MIME = "application/vnd.google-apps.folder"
+PAGE_SIZE = 1000
+UPLOAD_WORKERS = 8
+# Resumable uploads send files in chunks of this size (a multiple of 256 KiB)
+CHUNK_SIZE = 8 * 1024 * 1024
+# Retries per chunk on 5xx / 429, with exponential backoff (googleapiclient)
+UPLOAD_RETRIES = 5
+
+# (parent id, name) -> folder id, for the life of the process
+_folder_ids: Dict[Tuple[Optional[str], str], str] = {}
+_folder_lock = threading.Lock()
 
-# If you are using a Shared Drive
-SHARED_DRIVE_ID = gdrive_secrets.get("shared_drive_id", None)
+
+def _quote(name):
+    # Drive query strings are single-quoted; escape quotes in file names
+    return name.replace("\\", "\\\\").replace("'", "\\'")
 
 
 # ==============================
 # Folder Logic
 # ==============================
 def find_or_create_folder(service, name, parent_id=None):
+    key = (parent_id, name)
+    with _folder_lock:
+        if key in _folder_ids:
+            return _folder_ids[key]
+
     query = (
-        f"name = '{name}' and mimeType = 'application/vnd.google-apps.folder' "
+        f"name = '{_quote(name)}' and mimeType = '{FOLDER_MIME}' "
         f"and trashed = false"
     )
     if parent_id:
@@ -42,11 +117,19 @@ def find_or_create_folder(service, name, parent_id=None):
 
     folders = results.get("files", [])
     if folders:
-        return folders[0]["id"]
+        folder_id = folders[0]["id"]
+    else:
+        folder_id = _create_folder(service, name, parent_id)
+
+    with _folder_lock:
+        _folder_ids[key] = folder_id
+    return folder_id
 
+
+def _create_folder(service, name, parent_id=None):
     metadata = {
         "name": name,
-        "mimeType": "application/vnd.google-apps.folder",
+        "mimeType": FOLDER_MIME,
     }
     if parent_id:
         metadata["parents"] = [parent_id]
@@ -56,16 +139,75 @@ def find_or_create_folder(service, name, parent_id=None):
         fields="id",
         supportsAllDrives=True
     ).execute()
-
+    print(f"📁 Created folder: {name}")
     return folder["id"]
 
 
+def resolve_path(service, path):
+    """Folder id for "A/B/C", creating missing folders; cached per segment."""
+    folder_id = None
+    for name in filter(None, path.replace("\\", "/").split("/")):
+        folder_id = find_or_create_folder(service, name, folder_id)
+    return folder_id
+
+
+def list_folder(service, folder_id):
+    # Follow nextPageToken; a single page silently truncates large folders
+    items, page_token = [], None
+    while True:
+        results = service.files().list(
+            q=f"'{folder_id}' in parents and trashed = false",
+            pageSize=PAGE_SIZE,
+            pageToken=page_token,
+            fields="nextPageToken, files(id, name, mimeType, md5Checksum, size)",
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True
+        ).execute()
+        items.extend(results.get("files", []))
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            return items
+
+
 # ==============================
 # Upload or Update File
 # ==============================
+def file_md5(path, block_size=1 << 20):
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _upload(service, file_path, folder_id, file_id=None, chunk_size=CHUNK_SIZE):
+    """Resumable upload in chunks (a new file, or new content for file_id)."""
+    from googleapiclient.http import MediaFileUpload
+    media = MediaFileUpload(file_path, resumable=True, chunksize=chunk_size)
+    if file_id:
+        request = service.files().update(
+            fileId=file_id,
+            media_body=media,
+            fields="id, md5Checksum",
+            supportsAllDrives=True
+        )
+    else:
+        metadata = {"name": os.path.basename(file_path), "parents": [folder_id]}
+        request = service.files().create(
+            body=metadata,
+            media_body=media,
+            fields="id, md5Checksum",
+            supportsAllDrives=True
+        )
+    response = None
+    while response is None:
+        _, response = request.next_chunk(num_retries=UPLOAD_RETRIES)
+    return response
+
+
 def upload_or_update_file(service, file_path, folder_id):
     file_name = os.path.basename(file_path)
-    query = f"'{folder_id}' in parents and name='{file_name}' and trashed = false"
+    query = f"'{folder_id}' in parents and name = '{_quote(file_name)}' and trashed = false"
 
     results = service.files().list(
         q=query,
@@ -76,24 +218,107 @@ def upload_or_update_file(service, file_path, folder_id):
     ).execute()
 
     files = results.get("files", [])
-    media = MediaFileUpload(file_path, resumable=True)
-
     if files:
         # Update existing file
-        file_id = files[0]["id"]
-        service.files().update(
-            fileId=file_id,
-            media_body=media,
-            supportsAllDrives=True
-        ).execute()
+        _upload(service, file_path, folder_id, files[0]["id"])
         print(f"🔁 Updated: {file_name}")
     else:
         # Upload new file
-        metadata = {"name": file_name, "parents": [folder_id]}
-        service.files().create(
-            body=metadata,
-            media_body=media,
-            fields="id",
-            supportsAllDrives=True
-        ).execute()
+        _upload(service, file_path, folder_id)
         print(f"✅ Uploaded: {file_name}")
+
+
+# ==============================
+# Bulk Sync
+# ==============================
+def _sync_file(path, folder_id, existing, chunk_size):
+    md5 = file_md5(path)
+    if existing and existing.get("md5Checksum") == md5:
+        return "skipped", 0
+    response = _upload(get_service(), path, folder_id, existing["id"] if existing else None, chunk_size)
+    if response.get("md5Checksum") not in (None, md5):
+        raise IOError(f"checksum mismatch after upload ({response['md5Checksum']} != {md5})")
+    return ("updated" if existing else "uploaded"), os.path.getsize(path)
+
+
+def sync_folder(local_dir, drive_path, workers=UPLOAD_WORKERS, chunk_size=CHUNK_SIZE):
+    """
+    Mirror local_dir (recursively) into the Drive folder at drive_path
+    ("A/B/C", created as needed). Unchanged files are skipped and nothing
+    on Drive is deleted. Returns counts, bytes sent and the failed files.
+    """
+    t0 = time.perf_counter()
+    service = get_service()
+    root_id = resolve_path(service, drive_path)
+    # Drive folder id -> (subfolders by name, files by name), one listing each
+    listings: Dict[str, Tuple[Dict[str, str], Dict[str, Dict]]] = {}
+
+    def listing(folder_id):
+        if folder_id not in listings:
+            folders, files = {}, {}
+            for item in list_folder(service, folder_id):
+                if item["mimeType"] == FOLDER_MIME:
+                    folders.setdefault(item["name"], item["id"])
+                else:
+                    files.setdefault(item["name"], item)
+            with _folder_lock:
+                _folder_ids.update(((folder_id, name), fid) for name, fid in folders.items())
+            listings[folder_id] = folders, files
+        return listings[folder_id]
+
+    # Folders are resolved here, top-down; only file uploads run in the pool
+    tasks: List[Tuple[str, str, str, Optional[Dict]]] = []
+    folder_of = {local_dir: root_id}
+    for dirpath, dirnames, filenames in os.walk(local_dir):
+        dirnames.sort()
+        folder_id = folder_of[dirpath]
+        folders, files = listing(folder_id)
+        for name in dirnames:
+            if name not in folders:
+                folders[name] = _create_folder(service, name, folder_id)
+                listings[folders[name]] = {}, {}  # new, so nothing to list
+                with _folder_lock:
+                    _folder_ids[(folder_id, name)] = folders[name]
+            folder_of[os.path.join(dirpath, name)] = folders[name]
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            tasks.append((path, os.path.relpath(path, local_dir), folder_id, files.get(name)))
+
+    stats = {"uploaded": 0, "updated": 0, "skipped": 0, "failed": [], "bytes": 0}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(_sync_file, path, folder_id, existing, chunk_size): rel
+                   for path, rel, folder_id, existing in tasks}
+        for future in as_completed(futures):
+            rel = futures[future]
+            try:
+                outcome, sent = future.result()
+            except Exception as e:
+                print(f"❌ Failed: {rel} ({e})")
+                stats["failed"].append((rel, str(e)))
+                continue
+            stats[outcome] += 1
+            stats["bytes"] += sent
+            if outcome == "updated":
+                print(f"🔁 Updated: {rel}")
+            elif outcome == "uploaded":
+                print(f"✅ Uploaded: {rel}")
+
+    stats["elapsed_s"] = round(time.perf_counter() - t0, 3)
+    print(f"{'⚠️' if stats['failed'] else '✅'} Synced {local_dir} -> {drive_path}: "
+          f"{stats['uploaded']} uploaded, {stats['updated']} updated, {stats['skipped']} unchanged, "
+          f"{len(stats['failed'])} failed ({stats['bytes'] / 1e6:.1f} MB in {stats['elapsed_s']:.1f}s)")
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    ap = argparse.ArgumentParser(description="Mirror a local folder into Google Drive")
+    ap.add_argument("local_dir")
+    ap.add_argument("drive_path", nargs="?", default="AI_CEO_KnowledgeBase",
+                    help="Drive folder path, e.g. AI_CEO_KnowledgeBase/HR")
+    ap.add_argument("--workers", type=int, default=UPLOAD_WORKERS)
+    ap.add_argument("--chunk-mb", type=int, default=CHUNK_SIZE >> 20)
+    args = ap.parse_args()
+    result = sync_folder(args.local_dir, args.drive_path, workers=args.workers, chunk_size=args.chunk_mb << 20)
+    sys.exit(1 if result["failed"] else 0)
@@ -0,0 +1,133 @@
+"""
+FAISS index construction for the knowledge base.
+
+Modes:
+  flat   exact L2 search (IndexFlatL2 in IndexIDMap2); best for small corpora
+  ivf    IVF-Flat: inverted lists over k-means cells, exact vectors; tune nprobe
+  hnsw   HNSW graph over exact vectors; tune efSearch; no in-place deletes
+  ivfpq  IVF with product-quantised codes (pq_m bytes/vector); tune nprobe
+
+The chosen mode and its parameters are saved next to the index
+(index_params.json) so semantic_search applies matching search parameters.
+"""
+import math
+import os
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import faiss
+
+INDEX_MODES = ("flat", "ivf", "hnsw", "ivfpq")
+DEFAULT_MODE = os.getenv("INDEX_MODE", "flat")
+
+# Approximate modes need enough vectors to train; below these sizes the
+# builder falls back to flat and upgrades once the corpus has grown.
+MIN_VECTORS = {"flat": 0, "ivf": 2_000, "hnsw": 0, "ivfpq": 10_000}
+# Retrain once the corpus has grown this much since the quantizer was trained
+RETRAIN_GROWTH = 4.0
+# Training uses at most this many points per IVF cell (FAISS recommends 39-256)
+TRAIN_POINTS_PER_CELL = 64
+
+
+def default_params(mode: str, n: int, dim: int) -> Dict:
+    params = {"mode": mode, "dim": dim}
+    if mode in ("ivf", "ivfpq"):
+        nlist = int(4 * math.sqrt(max(n, 1)))
+        params["nlist"] = max(1, min(nlist, 65_536, n // 39 or 1))
+        params["nprobe"] = max(1, min(params["nlist"], 16))
+    if mode == "ivfpq":
+        # largest sub-quantizer count <= 64 that divides dim
+        params["pq_m"] = next(m for m in (64, 48, 32, 24, 16, 8, 4, 2, 1) if dim % m == 0)
+    if mode == "hnsw":
+        params["M"] = 32
+        params["ef_construction"] = 80
+        params["ef_search"] = 64
+    return params
+
+
+def empty_index(dim: int) -> faiss.Index:
+    return faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+
+
+def _create(params: Dict) -> faiss.Index:
+    mode, dim = params["mode"], params["dim"]
+    if mode == "flat":
+        return empty_index(dim)
+    if mode == "hnsw":
+        inner = faiss.IndexHNSWFlat(dim, params["M"])
+        inner.hnsw.efConstruction = params["ef_construction"]
+        return faiss.IndexIDMap2(inner)
+    quantizer = faiss.IndexFlatL2(dim)
+    if mode == "ivf":
+        index = faiss.IndexIVFFlat(quantizer, dim, params["nlist"])
+    elif mode == "ivfpq":
+        index = faiss.IndexIVFPQ(quantizer, dim, params["nlist"], params["pq_m"], 8)
+    else:
+        raise ValueError(f"Unknown index mode '{mode}'. Choose one of {INDEX_MODES}.")
+    # IVF indexes carry the vector IDs themselves; the hashtable direct map
+    # makes remove_ids and reconstruct work by ID.
+    index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return index
+
+
+def build_index(vecs: np.ndarray, ids: Sequence[int], mode: str = DEFAULT_MODE,
+                dim: Optional[int] = None, seed: int = 0, **overrides):
+    """
+    Build and fill an index of the requested mode. Trainable modes are trained
+    on a random sample. Returns (index, params); params["requested_mode"] keeps
+    the mode asked for when the corpus was too small and flat was used.
+    """
+    if mode not in INDEX_MODES:
+        raise ValueError(f"Unknown index mode '{mode}'. Choose one of {INDEX_MODES}.")
+    vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+    dim = dim or vecs.shape[1]
+    n = len(vecs)
+    effective = mode if n >= MIN_VECTORS[mode] else "flat"
+    params = default_params(effective, n, dim)
+    params.update({k: v for k, v in overrides.items() if k in params})
+    params["requested_mode"] = mode
+
+    index = _create(params)
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, params["nlist"] * TRAIN_POINTS_PER_CELL)
+        if params["mode"] == "ivfpq":
+            sample_size = max(sample_size, min(n, 256 * 39))
+        sample = vecs[rng.choice(n, size=sample_size, replace=False)] if sample_size < n else vecs
+        index.train(sample)
+    params["trained_on"] = n if params["mode"] in ("ivf", "ivfpq") else 0
+    if n:
+        index.add_with_ids(vecs, np.asarray(ids, dtype=np.int64))
+    return index, params
+
+
+def supports_remove(params: Dict) -> bool:
+    return params.get("mode", "flat") != "hnsw"
+
+
+def needs_rebuild(params: Dict, mode: str, n_total: int) -> bool:
+    """True when the saved index no longer matches the configured mode or corpus size."""
+    if params.get("requested_mode", params.get("mode", "flat")) != mode:
+        return True
+    if params.get("mode", "flat") != mode and n_total >= MIN_VECTORS[mode]:
+        return True  # grew out of the small-corpus flat fallback
+    trained_on = params.get("trained_on", 0)
+    return bool(trained_on) and n_total > RETRAIN_GROWTH * trained_on
+
+
+def reconstruct(index: faiss.Index, ids: Sequence[int]) -> np.ndarray:
+    """Stored vectors by ID (exact except for ivfpq, which decodes its codes)."""
+    if not len(ids):
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_batch(np.asarray(ids, dtype=np.int64))
+
+
+def search_parameters(params: Dict, nprobe: Optional[int] = None,
+                      ef_search: Optional[int] = None):
+    """Per-call FAISS search parameters (thread-safe, unlike mutating the index)."""
+    mode = params.get("mode", "flat")
+    if mode in ("ivf", "ivfpq"):
+        return faiss.SearchParametersIVF(nprobe=int(nprobe or params.get("nprobe", 1)))
+    if mode == "hnsw":
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search or params.get("ef_search", 16)))
+    return None
@@ -0,0 +1,444 @@
+"""
+In-process metrics for the RAG path: per-stage latency spans, counters and
+percentile histograms, exported as Prometheus text or JSON.
+
+    with metrics.span("search"):
+        hits = search_hybrid(...)
+    metrics.inc("llm_tokens_total", usage["prompt_tokens"], model=..., kind="prompt")
+
+Spans feed the rag_stage_seconds histogram (label stage) and count failures
+in rag_stage_errors_total. Each histogram keeps cumulative Prometheus
+buckets plus a window of recent samples for p50/p95/p99. Recording is a dict
+update under a lock, cheap enough for every request.
+
+Every process (the Streamlit app, CLI refreshes, benchmarks) snapshots its
+registry to METRICS_DIR/<pid>-<start ms>.json every few seconds and at exit,
+so the report can merge them. Loading folds the snapshots of processes that
+have exited into METRICS_DIR/archive.json and drops files not updated for
+RETENTION_DAYS, so the directory stays small however many refresh workers
+come and go:
+
+    python metrics.py                   # stage percentiles and counters
+    python metrics.py --format prom     # Prometheus text exposition
+    python metrics.py --format json
+    python metrics.py --reset           # drop saved snapshots
+"""
+import argparse
+import atexit
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Empty disables snapshots (metrics are still kept in memory)
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
+FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "10"))
+# Snapshots (and the archive) not updated for this long are deleted
+RETENTION_DAYS = float(os.getenv("METRICS_RETENTION_DAYS", "7"))
+ARCHIVE_FILE = "archive.json"
+# Recent samples kept per histogram series for percentiles
+SAMPLE_WINDOW = 2048
+# Seconds; from a cached lookup to a slow completion
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PERCENTILES = (50, 95, 99)
+
+STAGE_HISTOGRAM = "rag_stage_seconds"
+STAGE_ERRORS = "rag_stage_errors_total"
+
+# Prometheus HELP lines for the metrics the app records
+DESCRIPTIONS = {
+    STAGE_HISTOGRAM: "Latency of one stage of the RAG path",
+    STAGE_ERRORS: "Stages that raised",
+    "llm_tokens_total": "Tokens billed by the API (stream completions are counted per delta)",
+    "api_requests_total": "Requests sent to the OpenAI API",
+    "api_retries_total": "API requests retried after a rate limit or server error",
+    "api_failures_total": "API calls that failed after all retries",
+    "cache_lookups_total": "Embedding and answer cache lookups by result",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _Histogram:
+    __slots__ = ("buckets", "count", "sum", "samples")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=SAMPLE_WINDOW)
+
+    def observe(self, value: float):
+        i = 0
+        while i < len(LATENCY_BUCKETS) and value > LATENCY_BUCKETS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._hists: Dict[Tuple[str, Labels], _Histogram] = {}
+        self.started = time.time()
+        self.dirty = False
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            self.dirty = True
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            hist = self._hists.get(key)
+            if hist is None:
+                hist = self._hists[key] = _Histogram()
+            hist.observe(value)
+            self.dirty = True
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._hists.clear()
+            self.started = time.time()
+            self.dirty = True
+
+    def snapshot(self) -> Dict:
+        """JSON-serialisable copy; the input of every exporter."""
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "process": Path(sys.argv[0]).name if sys.argv and sys.argv[0] else "python",
+                "started": self.started,
+                "time": time.time(),
+                "counters": [{"name": n, "labels": dict(l), "value": v}
+                             for (n, l), v in sorted(self._counters.items())],
+                "histograms": [{"name": n, "labels": dict(l), "buckets": list(h.buckets),
+                                "count": h.count, "sum": h.sum, "samples": list(h.samples)}
+                               for (n, l), h in sorted(self._hists.items())],
+            }
+
+
+_registry = Registry()
+_process_started = time.time()  # with the pid, names this process's snapshot
+_flusher: Optional[threading.Thread] = None
+_flusher_lock = threading.Lock()
+
+
+def get_registry() -> Registry:
+    return _registry
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is not None or not METRICS_DIR:
+        return
+    with _flusher_lock:
+        if _flusher is None:
+            def loop():
+                while True:
+                    time.sleep(FLUSH_INTERVAL)
+                    if _registry.dirty:
+                        flush()
+            _flusher = threading.Thread(target=loop, name="metrics-flush", daemon=True)
+            _flusher.start()
+            atexit.register(flush)
+
+
+# ─────────────────────────────────────────────────────────────
+# Recording
+# ─────────────────────────────────────────────────────────────
+def inc(name: str, value: float = 1, **labels):
+    _registry.inc(name, value, **labels)
+    _start_flusher()
+
+
+def observe(name: str, value: float, **labels):
+    _registry.observe(name, value, **labels)
+    _start_flusher()
+
+
+def observe_stage(stage: str, seconds: float):
+    observe(STAGE_HISTOGRAM, seconds, stage=stage)
+
+
+@contextmanager
+def span(stage: str):
+    """Time the block as one stage; exceptions are counted and re-raised."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    except GeneratorExit:
+        raise  # a stream the caller stopped reading is not a failure
+    except BaseException:
+        inc(STAGE_ERRORS, stage=stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - t0)
+
+
+def timed(stage: str):
+    """Decorator form of span()."""
+    def wrap(fn):
+        @wraps(fn)
+        def inner(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def record_usage(model: str, usage: Optional[Dict]):
+    """Token counters from an API response's usage block (if it has one)."""
+    if not usage:
+        return
+    for kind in ("prompt", "completion"):
+        n = usage.get(f"{kind}_tokens")
+        if n:
+            inc("llm_tokens_total", n, model=model, kind=kind)
+
+
+# ─────────────────────────────────────────────────────────────
+# Snapshots and export
+# ─────────────────────────────────────────────────────────────
+def _snapshot_name() -> str:
+    # A recycled pid gets a new file rather than overwriting a dead process's totals
+    return f"{os.getpid()}-{int(_process_started * 1000)}.json"
+
+
+def _write_json(path: Path, data: Dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(data), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def flush():
+    """Write this process's snapshot to METRICS_DIR/<pid>-<start ms>.json (atomically)."""
+    if not METRICS_DIR:
+        return
+    _registry.dirty = False
+    try:
+        _write_json(Path(METRICS_DIR) / _snapshot_name(), _registry.snapshot())
+    except OSError as e:
+        print(f"⚠️ Could not save metrics snapshot: {e}")
+
+
+def _process_gone(pid: int) -> bool:
+    if not pid or os.name == "nt":  # os.kill(pid, 0) would end the process on Windows
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def _fold(snapshots: List[Dict]) -> Dict:
+    """One snapshot holding the totals of snapshots (recent samples only)."""
+    merged = merge(snapshots)
+    for h in merged["histograms"]:
+        h["samples"] = h["samples"][-SAMPLE_WINDOW:]
+    return {"pid": 0, "process": "exited processes",
+            "started": min(s.get("started", s["time"]) for s in snapshots),
+            "time": max(s["time"] for s in snapshots),
+            "counters": merged["counters"], "histograms": merged["histograms"]}
+
+
+def load_snapshots(directory: str = METRICS_DIR) -> List[Dict]:
+    """
+    Snapshots of live processes, plus the archive of exited ones. Snapshots
+    of exited processes are folded into the archive and deleted; files not
+    updated for RETENTION_DAYS are deleted.
+    """
+    if not directory:
+        return []
+    root = Path(directory)
+    cutoff = time.time() - RETENTION_DAYS * 86400
+    snaps, exited = [], []
+    for p in sorted(root.glob("*.json")):
+        try:
+            snap = json.loads(p.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue  # being replaced
+        if snap.get("time", 0) < cutoff:
+            p.unlink(missing_ok=True)
+        elif p.name == ARCHIVE_FILE:
+            continue  # read below, after claiming what to fold into it
+        elif p.name != _snapshot_name() and (snap["pid"] == os.getpid() or _process_gone(snap["pid"])):
+            exited.append(p)
+        else:
+            snaps.append(snap)
+
+    # Claim exited snapshots by renaming them, so concurrent loaders fold each once
+    claimed = []
+    for p in exited:
+        mine = p.with_name(f"{p.name}.{os.getpid()}.fold")
+        try:
+            os.replace(p, mine)
+            claimed.append((mine, json.loads(mine.read_text(encoding="utf-8"))))
+        except (OSError, ValueError):
+            continue
+    archive_path = root / ARCHIVE_FILE
+    try:
+        archive = json.loads(archive_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        archive = None
+    if claimed:
+        archive = _fold(([archive] if archive else []) + [snap for _, snap in claimed])
+        try:
+            _write_json(archive_path, archive)
+            for mine, _ in claimed:
+                mine.unlink(missing_ok=True)
+        except OSError as e:
+            print(f"⚠️ Could not save metrics archive: {e}")
+    return snaps + ([archive] if archive else [])
+
+
+def merge(snapshots: Iterable[Dict]) -> Dict:
+    """Sum counters and histogram buckets across snapshots; samples are pooled."""
+    counters: Dict[Tuple[str, Labels], float] = {}
+    hists: Dict[Tuple[str, Labels], Dict] = {}
+    processes = []
+    for snap in snapshots:
+        processes.append({"pid": snap["pid"], "process": snap["process"], "time": snap["time"]})
+        for c in snap["counters"]:
+            key = (c["name"], _labels(c["labels"]))
+            counters[key] = counters.get(key, 0) + c["value"]
+        for h in snap["histograms"]:
+            key = (h["name"], _labels(h["labels"]))
+            cur = hists.setdefault(key, {"buckets": [0] * len(h["buckets"]), "count": 0,
+                                         "sum": 0.0, "samples": []})
+            cur["buckets"] = [a + b for a, b in zip(cur["buckets"], h["buckets"])]
+            cur["count"] += h["count"]
+            cur["sum"] += h["sum"]
+            cur["samples"] += h["samples"]
+    return {
+        "processes": processes,
+        "time": time.time(),
+        "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(counters.items())],
+        "histograms": [{"name": n, "labels": dict(l), **h} for (n, l), h in sorted(hists.items())],
+    }
+
+
+def _percentile(sorted_vals: List[float], q: float) -> float:
+    # Nearest rank
+    return sorted_vals[max(0, math.ceil(q / 100 * len(sorted_vals)) - 1)]
+
+
+def summary(snapshot: Dict) -> Dict:
+    """Percentiles (ms) per histogram series and counter totals."""
+    series = []
+    for h in snapshot["histograms"]:
+        vals = sorted(h["samples"])
+        row = {"name": h["name"], **h["labels"], "count": h["count"],
+               "mean_ms": h["sum"] / h["count"] * 1000 if h["count"] else 0.0}
+        for q in PERCENTILES:
+            row[f"p{q}_ms"] = _percentile(vals, q) * 1000 if vals else 0.0
+        series.append(row)
+    series.sort(key=lambda r: -r["p95_ms"])
+    counters = [{"name": c["name"], **c["labels"], "value": c["value"]} for c in snapshot["counters"]]
+    return {"histograms": series, "counters": counters}
+
+
+def _prom_labels(labels: Dict, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = sorted(labels.items()) + ([extra] if extra else [])
+    if not items:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+def prometheus_text(snapshot: Optional[Dict] = None) -> str:
+    """Prometheus text exposition format (version 0.0.4)."""
+    snapshot = snapshot or _registry.snapshot()
+    lines = []
+    seen = set()
+
+    def header(name: str, kind: str):
+        if name not in seen:
+            seen.add(name)
+            if name in DESCRIPTIONS:
+                lines.append(f"# HELP {name} {DESCRIPTIONS[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for c in snapshot["counters"]:
+        header(c["name"], "counter")
+        lines.append(f"{c['name']}{_prom_labels(c['labels'])} {c['value']:g}")
+    for h in snapshot["histograms"]:
+        name = h["name"]
+        header(name, "histogram")
+        cumulative = 0
+        for bound, n in zip(list(LATENCY_BUCKETS) + ["+Inf"], h["buckets"]):
+            cumulative += n
+            le = bound if isinstance(bound, str) else f"{bound:g}"
+            lines.append(f"{name}_bucket{_prom_labels(h['labels'], ('le', le))} {cumulative}")
+        lines.append(f"{name}_sum{_prom_labels(h['labels'])} {h['sum']:.6f}")
+        lines.append(f"{name}_count{_prom_labels(h['labels'])} {h['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def to_json(snapshot: Optional[Dict] = None) -> str:
+    """Counters and per-series percentiles, without the raw samples."""
+    snapshot = snapshot or _registry.snapshot()
+    return json.dumps({"time": snapshot["time"], "processes": snapshot.get("processes"),
+                       **summary(snapshot)}, indent=1)
+
+
+def format_table(snapshot: Dict) -> str:
+    s = summary(snapshot)
+    out = [f"{'stage':18s} {'count':>7s} {'mean':>9s} {'p50':>9s} {'p95':>9s} {'p99':>9s}"]
+    for r in s["histograms"]:
+        label = r.get("stage") or r["name"]
+        out.append(f"{label:18s} {r['count']:7d} {r['mean_ms']:7.1f}ms {r['p50_ms']:7.1f}ms "
+                   f"{r['p95_ms']:7.1f}ms {r['p99_ms']:7.1f}ms")
+    if s["counters"]:
+        out.append("")
+        for c in s["counters"]:
+            labels = ", ".join(f"{k}={v}" for k, v in c.items() if k not in ("name", "value"))
+            out.append(f"{c['name']}{' {' + labels + '}' if labels else ''}: {c['value']:g}")
+    return "\n".join(out)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Report RAG latency and counters from saved snapshots")
+    ap.add_argument("--format", choices=["table", "prom", "json"], default="table")
+    ap.add_argument("--dir", default=METRICS_DIR)
+    ap.add_argument("--reset", action="store_true", help="delete saved snapshots")
+    args = ap.parse_args()
+    if args.reset:
+        for p in Path(args.dir).glob("*.json"):
+            p.unlink()
+        print(f"✅ Cleared metrics snapshots in {args.dir}")
+        sys.exit(0)
+    snaps = load_snapshots(args.dir)
+    if not snaps:
+        print(f"No metrics snapshots in {args.dir}/ yet.")
+        sys.exit(1)
+    merged = merge(snaps)
+    if args.format == "prom":
+        print(prometheus_text(merged), end="")
+    elif args.format == "json":
+        print(to_json(merged))
+    else:
+        print(f"{len(snaps)} process snapshot(s)\n")
+        print(format_table(merged))
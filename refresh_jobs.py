@@ -0,0 +1,274 @@
+"""
+Knowledge-base refreshes as background jobs.
+
+A refresh (file_parser, then embed_and_store) runs in its own worker process,
+so the app keeps answering from the live index at full speed, and a rerun
+or a closed tab no longer aborts it halfway. The worker reports per-stage
+progress and throughput to jobs/<id>.json, which any session can poll, and
+stops at its next checkpoint once jobs/<id>.cancel exists. The embedder
+builds a new release and publishes it atomically when complete (see
+embed_and_store), so a failed or cancelled job leaves the live index as it
+was.
+
+    python refresh_jobs.py start [--full] [--folder HR] [--no-parse]
+    python refresh_jobs.py status [job id]
+    python refresh_jobs.py cancel [job id]
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+JOBS_DIR = Path("jobs")
+REFRESH_PATH = Path("last_refresh.txt")
+# Status writes while a stage runs are at most this often (seconds)
+STATUS_INTERVAL = 0.5
+# What each stage counts
+STAGE_UNITS = {"parse": "files", "scan": "files", "embed": "chunks", "index": "shards", "save": "steps"}
+FINAL_STATES = ("succeeded", "failed", "cancelled")
+
+_start_lock = threading.Lock()
+_procs: Dict[str, subprocess.Popen] = {}  # workers started by this process
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _paths(job_id: str):
+    return JOBS_DIR / f"{job_id}.json", JOBS_DIR / f"{job_id}.cancel", JOBS_DIR / f"{job_id}.log"
+
+
+def _write_status(status: Dict):
+    path = _paths(status["id"])[0]
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(status, indent=1), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def save_refresh_time():
+    REFRESH_PATH.write_text(datetime.now().strftime('%b-%d-%Y %I:%M %p'))
+
+
+def load_refresh_time() -> str:
+    if REFRESH_PATH.exists():
+        return REFRESH_PATH.read_text()
+    return "Never"
+
+
+# ─────────────────────────────────────────────────────────────
+# App side: start, watch, cancel
+# ─────────────────────────────────────────────────────────────
+def _worker_gone(status: Dict) -> bool:
+    proc = _procs.get(status["id"])
+    if proc is not None:
+        return proc.poll() is not None  # also reaps the exited worker
+    pid = status.get("pid")
+    if not pid or os.name == "nt":  # os.kill(pid, 0) would end the process on Windows
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def read_status(job_id: str) -> Optional[Dict]:
+    """The job's status; a worker that died without finishing is reported as failed."""
+    path = _paths(job_id)[0]
+    if not path.exists():
+        return None
+    status = json.loads(path.read_text(encoding="utf-8"))
+    if status["state"] not in FINAL_STATES and _worker_gone(status):
+        # It may have finished between the read and the check
+        status = json.loads(path.read_text(encoding="utf-8"))
+        if status["state"] not in FINAL_STATES:
+            status.update(state="failed", error="worker exited unexpectedly (see the job log)",
+                          finished=time.time())
+            _write_status(status)
+    return status
+
+
+def list_jobs(limit: int = 20) -> List[Dict]:
+    """Most recent jobs first (job ids sort by start time)."""
+    if not JOBS_DIR.exists():
+        return []
+    ids = sorted((p.stem for p in JOBS_DIR.glob("*.json")), reverse=True)[:limit]
+    return [s for s in map(read_status, ids) if s is not None]
+
+
+def latest_job() -> Optional[Dict]:
+    jobs = list_jobs(limit=1)
+    return jobs[0] if jobs else None
+
+
+def active_job() -> Optional[Dict]:
+    job = latest_job()
+    return job if job is not None and job["state"] not in FINAL_STATES else None
+
+
+def start_refresh(full_rebuild: bool = False, folders: Optional[List[str]] = None,
+                  parse: bool = True) -> Dict:
+    """
+    Start a refresh in a worker process and return its status. Only one
+    refresh runs at a time; raises RuntimeError while another is active.
+    """
+    with _start_lock:
+        running = active_job()
+        if running is not None:
+            raise RuntimeError(f"Refresh {running['id']} is still running.")
+        JOBS_DIR.mkdir(exist_ok=True)
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        status = {"id": job_id, "state": "starting", "stage": None, "stages": {}, "pid": None,
+                  "created": time.time(), "finished": None, "error": None,
+                  "options": {"full_rebuild": full_rebuild, "folders": folders, "parse": parse}}
+        _write_status(status)
+        log = open(_paths(job_id)[2], "w", encoding="utf-8")
+        try:
+            # Its own session: the worker outlives a restart of the app server
+            proc = subprocess.Popen([sys.executable, str(Path(__file__).resolve()), "run", job_id],
+                                    stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+                                    env=dict(os.environ, PYTHONUNBUFFERED="1"))
+        finally:
+            log.close()
+        _procs[job_id] = proc
+        status["pid"] = proc.pid  # the worker records it in the file itself
+        return status
+
+
+def cancel_job(job_id: str):
+    """Ask the worker to stop at its next checkpoint; the live index is unaffected."""
+    cancel_path = _paths(job_id)[1]
+    if cancel_path.parent.exists():
+        cancel_path.touch()
+
+
+def read_log(job_id: str, max_chars: int = 20_000) -> str:
+    path = _paths(job_id)[2]
+    return path.read_text(encoding="utf-8", errors="replace")[-max_chars:] if path.exists() else ""
+
+
+# ─────────────────────────────────────────────────────────────
+# Worker side
+# ─────────────────────────────────────────────────────────────
+class _Reporter:
+    """
+    progress(stage, done, total) callback for file_parser and embed_and_store:
+    records per-stage counts and rates, and raises JobCancelled once the
+    cancel file exists. Called from the embedder's worker threads too.
+    """
+
+    def __init__(self, status: Dict):
+        self.status = status
+        self.cancel_path = _paths(status["id"])[1]
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+
+    def set_state(self, state: str, **fields):
+        with self._lock:
+            self.status.update(state=state, **fields)
+            _write_status(self.status)
+
+    def __call__(self, stage: str, done: int, total: Optional[int]):
+        with self._lock:
+            now = time.time()
+            stages = self.status["stages"]
+            if stage not in stages:
+                if self.status["stage"] in stages:
+                    stages[self.status["stage"]]["finished"] = now
+                stages[stage] = {"unit": STAGE_UNITS.get(stage, "items"), "started": now, "finished": None}
+                self.status["stage"] = stage
+                self._last_write = 0.0  # show a new stage right away
+            entry = stages[stage]
+            elapsed = now - entry["started"]
+            entry.update(done=done, total=total, elapsed_s=round(elapsed, 2),
+                         rate=round(done / elapsed, 2) if elapsed > 0 else None)
+            if now - self._last_write < STATUS_INTERVAL:
+                return
+            self._last_write = now
+            _write_status(self.status)
+            cancelled = self.cancel_path.exists()
+        if cancelled:
+            raise JobCancelled()
+
+
+def run_job(job_id: str):
+    """Worker entry point: run the refresh described in the job's status file."""
+    status = read_status(job_id)
+    opts = status["options"]
+    reporter = _Reporter(status)
+    reporter.set_state("running", pid=os.getpid(), started=time.time())
+    try:
+        if reporter.cancel_path.exists():
+            raise JobCancelled()
+        if opts["parse"]:
+            import file_parser
+            file_parser.main(full_rebuild=opts["full_rebuild"], progress=reporter)
+        import embed_and_store
+        embed_and_store.main(full_rebuild=opts["full_rebuild"], folders=opts["folders"], progress=reporter)
+    except JobCancelled:
+        print("⚠️ Refresh cancelled; the live index is unchanged.")
+        reporter.set_state("cancelled", finished=time.time())
+    except BaseException as e:
+        traceback.print_exc()
+        reporter.set_state("failed", error=f"{type(e).__name__}: {e}", finished=time.time())
+        sys.exit(1)
+    else:
+        save_refresh_time()
+        now = time.time()
+        for entry in status["stages"].values():
+            entry["finished"] = entry["finished"] or now
+            if entry.get("total") is not None:
+                entry["done"] = entry["total"]
+        reporter.set_state("succeeded", finished=now)
+        print("✅ Refresh complete.")
+    finally:
+        reporter.cancel_path.unlink(missing_ok=True)
+
+
+def format_status(status: Dict) -> str:
+    lines = [f"{status['id']}  {status['state']}" + (f"  ({status['error']})" if status.get("error") else "")]
+    for name, s in status["stages"].items():
+        total = f"/{s['total']}" if s.get("total") is not None else ""
+        rate = f"  {s['rate']:.1f} {s['unit']}/s" if s.get("rate") else ""
+        lines.append(f"  {name:6s} {s.get('done', 0)}{total} {s['unit']}  {s.get('elapsed_s', 0):.1f}s{rate}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Run and watch knowledge-base refreshes")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_start = sub.add_parser("start", help="start a refresh in the background")
+    p_start.add_argument("--full", action="store_true", help="re-download and re-embed everything")
+    p_start.add_argument("--folder", action="append", dest="folders",
+                         help="only re-embed this Drive folder's shard (repeatable)")
+    p_start.add_argument("--no-parse", action="store_true", help="skip the Drive download (embed parsed_data)")
+    for name in ("status", "cancel"):
+        sub.add_parser(name).add_argument("job_id", nargs="?")
+    sub.add_parser("run", help=argparse.SUPPRESS).add_argument("job_id")
+    args = ap.parse_args()
+
+    if args.cmd == "run":
+        run_job(args.job_id)
+    elif args.cmd == "start":
+        job = start_refresh(full_rebuild=args.full, folders=args.folders, parse=not args.no_parse)
+        print(f"✅ Started refresh {job['id']} (pid {job['pid']}); log: {_paths(job['id'])[2]}")
+    else:
+        job = read_status(args.job_id) if args.job_id else latest_job()
+        if job is None:
+            print("No refresh jobs.")
+        elif args.cmd == "cancel":
+            cancel_job(job["id"])
+            print(f"ℹ️ Cancel requested for {job['id']}")
+        else:
+            print(format_status(job))
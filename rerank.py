@@ -0,0 +1,153 @@
+"""
+Second retrieval stage: re-rank over-fetched candidates by cosine similarity
+and pick a diverse top k with maximal marginal relevance (MMR).
+
+The first stage (FAISS L2 and/or BM25, fused) returns k * RERANK_FACTOR
+candidates. Their vectors are read back from the index, normalised, and
+scored against the query in one matrix product; MMR then trades relevance
+against similarity to chunks already picked, so overlapping neighbours of
+one passage don't fill the prompt. All of it is vectorised NumPy over a few
+dozen rows, well under a millisecond.
+
+An optional cross-encoder (any callable (query, texts) -> scores, or a
+sentence-transformers model named in RERANK_CROSS_ENCODER) can replace the
+cosine relevance. It runs only on as many top candidates as fit in the
+latency budget, judged from its measured cost per pair; the rest keep
+their cosine score.
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import metrics
+
+# Candidates fetched per result before re-ranking
+RERANK_FACTOR = int(os.getenv("RERANK_FACTOR", "4"))
+# 1.0 = relevance only; lower values favour diversity
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Hard cap on the time the second stage may add
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "50"))
+# sentence-transformers CrossEncoder model; empty disables it
+CROSS_ENCODER_MODEL = os.getenv("RERANK_CROSS_ENCODER", "")
+
+CrossEncoder = Callable[[str, List[str]], Sequence[float]]
+
+_cross_encoder: Optional[CrossEncoder] = None
+_cross_encoder_loaded = False
+_cross_encoder_lock = threading.Lock()
+# Smoothed cost of one (query, passage) pair, seconds
+_pair_cost: Optional[float] = None
+
+
+def set_cross_encoder(scorer: Optional[CrossEncoder]):
+    """Plug in a scorer (query, texts) -> relevance scores; None disables it."""
+    global _cross_encoder, _cross_encoder_loaded, _pair_cost
+    with _cross_encoder_lock:
+        _cross_encoder, _cross_encoder_loaded, _pair_cost = scorer, True, None
+
+
+def get_cross_encoder() -> Optional[CrossEncoder]:
+    global _cross_encoder, _cross_encoder_loaded
+    if _cross_encoder_loaded:
+        return _cross_encoder
+    with _cross_encoder_lock:
+        if not _cross_encoder_loaded:
+            if CROSS_ENCODER_MODEL:
+                try:
+                    from sentence_transformers import CrossEncoder as _Model
+                    model = _Model(CROSS_ENCODER_MODEL)
+                    _cross_encoder = lambda q, texts: model.predict([(q, t) for t in texts])
+                    print(f"✅ Re-ranking with cross-encoder {CROSS_ENCODER_MODEL}")
+                except Exception as e:  # not installed, or the model can't load
+                    print(f"⚠️ Cross-encoder disabled ({e}); using cosine re-ranking.")
+            _cross_encoder_loaded = True
+    return _cross_encoder
+
+
+def normalise(mat: np.ndarray) -> np.ndarray:
+    mat = np.asarray(mat, dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=-1, keepdims=True)
+    return mat / np.maximum(norms, 1e-12)
+
+
+def mmr(relevance: np.ndarray, vecs: np.ndarray, k: int, lambda_: float = MMR_LAMBDA,
+        deadline: Optional[float] = None) -> List[int]:
+    """
+    Greedy MMR over rows of vecs (normalised). Returns picked row positions.
+    Past the deadline the remaining picks are taken in relevance order.
+    """
+    n = len(relevance)
+    k = min(k, n)
+    picked: List[int] = []
+    # Highest similarity of each candidate to anything picked so far
+    redundancy = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    while len(picked) < k:
+        if deadline is not None and time.perf_counter() > deadline:
+            rest = [i for i in np.argsort(-relevance) if available[i]]
+            picked += rest[:k - len(picked)]
+            break
+        score = lambda_ * relevance - (1 - lambda_) * redundancy if picked else relevance
+        score = np.where(available, score, -np.inf)
+        best = int(np.argmax(score))
+        picked.append(best)
+        available[best] = False
+        np.maximum(redundancy, vecs @ vecs[best], out=redundancy)
+    return picked
+
+
+def _cross_scores(scorer: CrossEncoder, query: str, texts: List[str], budget_s: float) -> Optional[np.ndarray]:
+    """Scores for as many leading texts as the budget allows (the rest NaN)."""
+    global _pair_cost
+    # The first call probes a few pairs to learn the model's cost
+    n = min(len(texts), 8 if _pair_cost is None else int(budget_s / _pair_cost))
+    if n <= 0:
+        return None
+    t0 = time.perf_counter()
+    scores = np.asarray(scorer(query, texts[:n]), dtype=np.float32)
+    cost = (time.perf_counter() - t0) / n
+    _pair_cost = cost if _pair_cost is None else 0.8 * _pair_cost + 0.2 * cost
+    out = np.full(len(texts), np.nan, dtype=np.float32)
+    out[:n] = scores
+    return out
+
+
+def rerank(query: str, qvec: np.ndarray, hits: List[Tuple[int, float, Dict]], vecs: np.ndarray, k: int,
+           lambda_: float = MMR_LAMBDA, budget_ms: float = RERANK_BUDGET_MS,
+           cross_encoder: Optional[CrossEncoder] = None) -> List[Tuple[int, float, Dict]]:
+    """
+    Re-rank first-stage hits (in their first-stage order) whose vectors are
+    the rows of vecs. Returns the top k as (id, relevance, meta), relevance
+    being cosine similarity, or the squashed cross-encoder score where it ran.
+    """
+    if not hits:
+        return []
+    t0 = time.perf_counter()
+    deadline = t0 + budget_ms / 1000
+    with metrics.span("rerank"):
+        cand = normalise(vecs)
+        relevance = cosine = cand @ normalise(qvec.reshape(-1))
+        scorer = (cross_encoder or get_cross_encoder()) if query else None
+        if scorer is not None:
+            texts = [m.get("text") or m.get("text_preview", "") for _, _, m in hits]
+            # Cross-encode the best candidates by cosine first
+            order = np.argsort(-relevance)
+            remaining = deadline - time.perf_counter()
+            ce = _cross_scores(scorer, query, [texts[i] for i in order], remaining * 0.8)
+            if ce is not None:
+                done = ~np.isnan(ce)
+                scored = np.full(len(hits), np.nan, dtype=np.float32)
+                scored[order[done]] = ce[done]
+                # Squash to (0, 1) so the MMR trade-off stays comparable with cosine;
+                # candidates the budget didn't cover rank below every scored one
+                squashed = 1 / (1 + np.exp(-scored))
+                relevance = np.where(np.isnan(scored), cosine - 2.0, squashed).astype(np.float32)
+                metrics.inc("rerank_cross_encoded_total", int(done.sum()))
+        picked = mmr(relevance, cand, k, lambda_, deadline)
+    if time.perf_counter() > deadline:
+        metrics.inc("rerank_over_budget_total")
+    reported = np.where(relevance < -1.0, cosine, relevance)
+    return [(hits[i][0], float(reported[i]), hits[i][2]) for i in picked]
@@ -1,72 +1,454 @@
-import pickle
+import heapq
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Optional
 import numpy as np
 import faiss
 from dotenv import load_dotenv
 import os
 
+import metrics
+import rerank
+import table_store
+from chunk_store import ChunkStore, LegacyMetadata
+from embedding_cache import get_cache
+from index_factory import reconstruct, search_parameters
+
 # Load environment
 load_dotenv()
 
-# OpenAI client (new SDK style)
-try:
-    from openai import OpenAI
-    client = OpenAI()
-    use_client = True
-except Exception:
-    import openai
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-    use_client = False
+# OpenAI client, created on first use (the async pipeline never needs it,
+# and importing the SDK is a noticeable share of app startup)
+_openai = None
+_openai_lock = threading.Lock()
+
+def get_openai() -> Tuple[object, bool]:
+    """(client, use_client): a new-style OpenAI() client, or the legacy openai module."""
+    global _openai
+    if _openai is None:
+        with _openai_lock:
+            if _openai is None:
+                try:
+                    from openai import OpenAI
+                    _openai = (OpenAI(), True)
+                except Exception:
+                    import openai
+                    openai.api_key = openai.api_key or os.getenv("OPENAI_API_KEY")
+                    _openai = (openai, False)
+    return _openai
 
 EMBED_MODEL = "text-embedding-3-small"
 EMBED_DIM = 1536
 
-INDEX_PATH = Path("embeddings/faiss.index")
-META_PATH = Path("embeddings/metadata.pkl")
+# Artifacts are served from the release named in CURRENT (see embed_and_store),
+# or from embeddings/ itself when they predate releases. Inside that directory:
+# one FAISS index per Drive folder, listed in shards.json, and the chunk store.
+EMBED_DIR = Path("embeddings")
+CURRENT_PATH = EMBED_DIR / "CURRENT"
+RELEASES_DIR = EMBED_DIR / "releases"
+SHARDS_DIR = "shards"
+SHARDS_FILE = "shards.json"
+CHUNKS_FILE = "chunks.sqlite"
+VERSION_FILE = "VERSION"
+# Single-index layout from before shards, still served until the next refresh
+INDEX_PATH = EMBED_DIR / "faiss.index"
+INDEX_PARAMS_PATH = EMBED_DIR / "index_params.json"
+META_PATH = EMBED_DIR / "metadata.pkl"  # legacy, before the chunk store
+
+# Retrieval: "hybrid" fuses BM25 and vector rankings, the others use one
+SEARCH_MODES = ("hybrid", "vector", "lexical")
+DEFAULT_SEARCH_MODE = os.getenv("SEARCH_MODE", "hybrid")
+# Reciprocal rank fusion constant (60 is the usual choice)
+RRF_K = 60
+# Each ranker contributes k * CANDIDATE_FACTOR candidates to the fusion
+CANDIDATE_FACTOR = 4
+# Second stage: cosine + MMR over k * rerank.RERANK_FACTOR candidates
+RERANK = os.getenv("RERANK", "1") != "0"
+# Shards are searched concurrently (FAISS releases the GIL while searching)
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "8"))
+# Deal codes, figures, acronyms: tokens with a digit, or all caps
+_CODE_RE = re.compile(r"^(?=.*\d)[\w\-./%$€£]+$|^[A-Z][A-Z0-9\-]+$")
+# Spreadsheet rows whose label a question names are added to its sources
+TABLE_ROWS = int(os.getenv("TABLE_ROWS", "5"))
+TABLE_LABEL_WORDS = 4  # longest row label matched, in words
+_WORD_RE = re.compile(r"\w[\w\-./%&']*")
+
+# Process-wide resident copy of (stamp, shards, chunk store), where shards maps
+# slug -> {"folder", "index", "params", "version"}. Every Streamlit session in
+# the process shares it; it is replaced as a whole tuple so readers never
+# observe a half-swapped state.
+_resources: Optional[Tuple[tuple, Dict[str, Dict], object]] = None
+_resources_lock = threading.Lock()
+_shard_pool: Optional[ThreadPoolExecutor] = None
 
+@metrics.timed("embed")
 def embed_query(text: str) -> np.ndarray:
+    cache = get_cache()
+    cached = cache.get(EMBED_MODEL, text)
+    if cached is not None and cached.shape == (EMBED_DIM,):
+        return cached
+    client, use_client = get_openai()
     if use_client:
         response = client.embeddings.create(
             model=EMBED_MODEL,
             input=text
         )
         vec = response.data[0].embedding
+        metrics.record_usage(EMBED_MODEL, {"prompt_tokens": getattr(response.usage, "prompt_tokens", 0)})
     else:
-        response = openai.Embedding.create(
+        response = client.Embedding.create(
             model=EMBED_MODEL,
             input=text
         )
         vec = response['data'][0]['embedding']
+        metrics.record_usage(EMBED_MODEL, response.get("usage"))
+    metrics.inc("api_requests_total", endpoint="embeddings")
 
     arr = np.array(vec, dtype=np.float32)
     if arr.shape != (EMBED_DIM,):
         raise ValueError(f"Unexpected embedding shape {arr.shape}")
+    cache.put(EMBED_MODEL, text, arr)
     return arr
 
-def load_resources():
-    if not INDEX_PATH.exists() or not META_PATH.exists():
+def _read_index(path: Path):
+    # Memory-map where FAISS supports it so the OS page cache holds the vectors
+    # (shared across processes); fall back to a normal read otherwise.
+    try:
+        return faiss.read_index(str(path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except Exception:
+        return faiss.read_index(str(path))
+
+def live_dir() -> Path:
+    """Directory of the published artifacts; CURRENT is swapped atomically."""
+    name = CURRENT_PATH.read_text(encoding="utf-8").strip() if CURRENT_PATH.exists() else ""
+    return RELEASES_DIR / name if name else EMBED_DIR
+
+def artifact_stamp(root: Optional[Path] = None) -> tuple:
+    """
+    Identify the on-disk artifacts cheaply (a few stat calls): the live
+    release, plus its VERSION (written last) and mtimes for artifacts
+    produced without releases.
+    """
+    root = root or live_dir()
+    version_path = root / VERSION_FILE
+    version = version_path.read_text(encoding="utf-8").strip() if version_path.exists() else ""
+    stats = []
+    for p in (root / SHARDS_FILE if (root / SHARDS_FILE).exists() else INDEX_PATH, _meta_path(root)):
+        info = p.stat()
+        stats.append((info.st_mtime_ns, info.st_size))
+    return (root.name, version, *stats)
+
+def _meta_path(root: Path) -> Path:
+    chunks = root / CHUNKS_FILE
+    return chunks if chunks.exists() or not META_PATH.exists() else META_PATH
+
+def _check_artifacts(root: Path):
+    if not ((root / SHARDS_FILE).exists() or INDEX_PATH.exists()) or not _meta_path(root).exists():
         raise FileNotFoundError("Missing FAISS index or metadata. Run embed_and_store.py first.")
-    index = faiss.read_index(str(INDEX_PATH))
-    with open(META_PATH, "rb") as f:
-        metadata = pickle.load(f)
-    return index, metadata
-
-def search(query: str, k: int = 5) -> List[Tuple[int, float, Dict]]:
-    index, metadata = load_resources()
-    qvec = embed_query(query).reshape(1, -1)
-    D, I = index.search(qvec, k)
-    results = []
-    for dist, idx in zip(D[0], I[0]):
-        if idx == -1:
+
+def load_shards(root: Path, previous: Optional[Dict[str, Dict]] = None) -> Dict[str, Dict]:
+    """
+    Open the shards listed in root's shards.json. Shards whose version matches
+    one in `previous` are reused as they are, so a refresh of one folder
+    reloads only that folder's index.
+    """
+    previous = previous or {}
+    if not (root / SHARDS_FILE).exists():
+        # Single index from before shards: serve it as one unlabelled shard
+        params = (json.loads(INDEX_PARAMS_PATH.read_text(encoding="utf-8"))
+                  if INDEX_PARAMS_PATH.exists() else {"mode": "flat"})
+        return {"_legacy": {"folder": None, "index": _read_index(INDEX_PATH), "params": params,
+                            "version": None}}
+    registry = json.loads((root / SHARDS_FILE).read_text(encoding="utf-8"))
+    shards = {}
+    for slug, info in registry.items():
+        old = previous.get(slug)
+        if old is not None and old["version"] == info["version"]:
+            shards[slug] = old
             continue
-        meta = metadata.get(int(idx), {})
-        results.append((int(idx), float(dist), meta))
-    return results
+        d = root / SHARDS_DIR / slug
+        shards[slug] = {"folder": info["folder"], "index": _read_index(d / "faiss.index"),
+                        "params": json.loads((d / "index_params.json").read_text(encoding="utf-8")),
+                        "version": info["version"]}
+    return shards
+
+def load_resources(root: Path, previous: Optional[Dict[str, Dict]] = None):
+    """Open the shards and their chunk store; the store is queried per hit, not loaded."""
+    _check_artifacts(root)
+    meta_path = _meta_path(root)
+    chunks = (ChunkStore(meta_path, readonly=True) if meta_path.name == CHUNKS_FILE
+              else LegacyMetadata(meta_path))
+    return load_shards(root, previous), chunks
+
+def get_resources():
+    """
+    Return the resident (shards, chunk store), loading them once per process
+    and hot-swapping when a refresh publishes new artifacts.
+    """
+    global _resources
+    root = live_dir()
+    _check_artifacts(root)
+    stamp = artifact_stamp(root)
+    cached = _resources
+    if cached is not None and cached[0] == stamp:
+        return cached[1:]
+    with _resources_lock:
+        cached = _resources
+        if cached is not None and cached[0] == stamp:
+            return cached[1:]
+        shards, chunks = load_resources(root, cached[1] if cached is not None else None)
+        _resources = (stamp, shards, chunks)
+        return _resources[1:]
+
+def index_version() -> str:
+    """Changes whenever a refresh rewrites the index; used to invalidate answer caches."""
+    return repr(artifact_stamp())
+
+def invalidate_resources():
+    global _resources
+    with _resources_lock:
+        _resources = None
+
+def list_folders() -> List[str]:
+    """Drive folder labels that have indexed chunks, for scoping searches."""
+    # The shard registry is enough; the indexes load on the first search
+    registry_path = live_dir() / SHARDS_FILE
+    if registry_path.exists():
+        registry = json.loads(registry_path.read_text(encoding="utf-8"))
+        labels = {info["folder"] for info in registry.values() if info.get("folder")}
+        if labels:
+            return sorted(labels)
+    shards, chunks = get_resources()
+    labels = {sh["folder"] for sh in shards.values() if sh["folder"]}
+    return sorted(labels) if labels else chunks.folders()
+
+def _select_shards(shards: Dict[str, Dict], folders: Optional[List[str]]) -> List[Dict]:
+    # The legacy single index is always searched; its hits are filtered by folder
+    if folders is None:
+        return list(shards.values())
+    wanted = set(folders)
+    return [sh for slug, sh in shards.items() if sh["folder"] in wanted or slug == "_legacy"]
+
+def search(query: str, k: int = 5, nprobe: Optional[int] = None,
+           ef_search: Optional[int] = None, mode: Optional[str] = None,
+           folders: Optional[List[str]] = None,
+           rerank_hits: Optional[bool] = None) -> List[Tuple[int, float, Dict]]:
+    """
+    Top-k chunks for query as (id, score, meta). With re-ranking (the
+    default, see RERANK) the score is cosine similarity after MMR; without
+    it, the L2 distance in "vector" mode (lower is better), otherwise BM25
+    or fused RRF score (higher is better). nprobe (IVF modes) and ef_search
+    (HNSW) trade recall for latency; by default the values saved with each
+    shard are used. folders limits the search to those Drive folders'
+    shards (None = all).
+    """
+    mode = mode or DEFAULT_SEARCH_MODE
+    if mode == "lexical":
+        return lexical_search(query, k, folders=folders)
+    if mode == "hybrid":
+        hits = exact_search(query, k, folders=folders)
+        if hits is not None:
+            return hits
+        return search_hybrid(query, embed_query(query), k, nprobe, ef_search, folders=folders,
+                             rerank_hits=rerank_hits)
+    return search_vector(embed_query(query), k, nprobe, ef_search, folders=folders,
+                         rerank_hits=rerank_hits, query=query)
+
+def _with_meta(chunks, hits: List[Tuple[int, float]],
+               folders: Optional[List[str]] = None) -> List[Tuple[int, float, Dict]]:
+    # One primary-key lookup for all k hits; IDs missing from the store belong
+    # to a refresh that is mid-commit and are skipped.
+    with metrics.span("fetch_chunks"):
+        metas = chunks.get_many([vid for vid, _ in hits])
+    return [(vid, score, metas[vid]) for vid, score in hits
+            if vid in metas and (folders is None or metas[vid].get("folder") in folders)]
+
+def _shard_hits(shard: Dict, qvec: np.ndarray, k: int, nprobe: Optional[int] = None,
+                ef_search: Optional[int] = None) -> List[Tuple[int, float]]:
+    index = shard["index"]
+    if index.ntotal == 0:
+        return []
+    params = search_parameters(shard["params"], nprobe, ef_search)
+    D, I = index.search(qvec.reshape(1, -1), min(k, index.ntotal), params=params)
+    return [(int(idx), float(dist)) for dist, idx in zip(D[0], I[0]) if idx != -1]
+
+def _vector_hits(shards: List[Dict], qvec: np.ndarray, k: int, nprobe: Optional[int] = None,
+                 ef_search: Optional[int] = None) -> List[Tuple[int, float]]:
+    """Top k over the given shards, searched in parallel; L2 distances are comparable."""
+    global _shard_pool
+    with metrics.span("vector_search"):
+        if len(shards) == 1:
+            return _shard_hits(shards[0], qvec, k, nprobe, ef_search)
+        if _shard_pool is None:
+            with _resources_lock:
+                if _shard_pool is None:
+                    _shard_pool = ThreadPoolExecutor(max_workers=SHARD_WORKERS, thread_name_prefix="shard")
+        parts = _shard_pool.map(lambda sh: _shard_hits(sh, qvec, k, nprobe, ef_search), shards)
+        return heapq.nsmallest(k, (hit for part in parts for hit in part), key=lambda h: h[1])
+
+def candidate_vectors(shards: Dict[str, Dict], hits: List[Tuple[int, float, Dict]]) -> Optional[np.ndarray]:
+    """Stored vectors of hits, read back from their shards; None if any is missing."""
+    only = next(iter(shards.values())) if len(shards) == 1 else None
+    by_folder = {sh["folder"]: sh for sh in shards.values()}
+    groups: Dict[int, Tuple[Dict, List[int], List[int]]] = {}
+    for row, (vid, _, meta) in enumerate(hits):
+        sh = only or by_folder.get(meta.get("folder"))
+        if sh is None:
+            return None
+        groups.setdefault(id(sh), (sh, [], []))
+        groups[id(sh)][1].append(row)
+        groups[id(sh)][2].append(vid)
+    out = np.empty((len(hits), next(iter(shards.values()))["index"].d), dtype=np.float32)
+    try:
+        for sh, rows, vids in groups.values():
+            out[rows] = reconstruct(sh["index"], vids)
+    except RuntimeError:
+        return None  # a refresh swapped the shard between the two stages
+    return out
+
+def _second_stage(shards, query: str, qvec: np.ndarray, hits: List[Tuple[int, float, Dict]],
+                  k: int) -> List[Tuple[int, float, Dict]]:
+    vecs = candidate_vectors(shards, hits)
+    if vecs is None:
+        return hits[:k]
+    return rerank.rerank(query, qvec, hits, vecs, k)
+
+def search_vector(qvec: np.ndarray, k: int = 5, nprobe: Optional[int] = None,
+                  ef_search: Optional[int] = None, folders: Optional[List[str]] = None,
+                  rerank_hits: Optional[bool] = None, query: str = "") -> List[Tuple[int, float, Dict]]:
+    """Vector search; re-ranked unless rerank_hits is False (query feeds the cross-encoder)."""
+    shards, chunks = get_resources()
+    second = RERANK if rerank_hits is None else rerank_hits
+    n = k * rerank.RERANK_FACTOR if second else k
+    hits = _with_meta(chunks, _vector_hits(_select_shards(shards, folders), qvec, n, nprobe, ef_search),
+                      folders)
+    return _second_stage(shards, query, qvec, hits, k) if second else hits
+
+def lexical_search(query: str, k: int = 5, match: str = "any",
+                   folders: Optional[List[str]] = None) -> List[Tuple[int, float, Dict]]:
+    """BM25 over the chunk store's full-text index; no embedding call."""
+    _, chunks = get_resources()
+    with metrics.span("lexical_search"):
+        hits = chunks.lexical_search(query, k, match, folders)
+    return _with_meta(chunks, hits)
+
+def is_exact_query(query: str) -> bool:
+    """Quoted phrases and short queries made of codes, figures or acronyms."""
+    q = query.strip()
+    if len(q) > 2 and q[0] == q[-1] == '"':
+        return True
+    tokens = [t.strip("?,.:;!()") for t in q.split()]
+    return 0 < len(tokens) <= 3 and all(t and _CODE_RE.match(t) for t in tokens)
+
+def exact_search(query: str, k: int = 5,
+                 folders: Optional[List[str]] = None) -> Optional[List[Tuple[int, float, Dict]]]:
+    """
+    Answer exact-term queries from the lexical index alone, skipping the
+    embedding round trip. None when the query is not one, or nothing matches.
+    """
+    if not is_exact_query(query):
+        return None
+    q = query.strip()
+    hits = lexical_search(q, k, match="phrase" if q.startswith('"') else "all", folders=folders)
+    return hits or None
+
+def _label_candidates(query: str) -> List[str]:
+    words = [w.rstrip(".'") for w in _WORD_RE.findall(query)]
+    grams = {" ".join(words[i:i + n]) for n in range(1, TABLE_LABEL_WORDS + 1)
+             for i in range(len(words) - n + 1)}
+    return [g for g in grams if len(g) > 1]
+
+def table_hits(query: str, folders: Optional[List[str]] = None,
+               limit: int = TABLE_ROWS) -> List[Tuple[int, float, Dict]]:
+    """
+    Full rows of numeric spreadsheet tables whose label (first cell) is a
+    phrase of the query, as hits citing "file / sheet" and the row number.
+    Their IDs are negative (table row IDs), so they never collide with chunks.
+    """
+    if limit <= 0 or not table_store.TABLES_PATH.exists():
+        return []
+    with metrics.span("table_lookup"):
+        rows = table_store.get_table_store().find_rows(_label_candidates(query), limit, folders)
+    hits = []
+    for r in rows:
+        cells = " | ".join(f"{h}: {f'{v:.10g}' if isinstance(v, float) else v}"
+                           for h, v in r["values"].items() if v is not None and v != "")
+        text = f"[SHEET]: {r['sheet']} | row {r['row']}\n{cells}"
+        hits.append((-r["id"], 0.0, {"filename": f"{r['file']} / {r['sheet']}", "chunk_id": r["row"],
+                                     "folder": r["folder"], "text": text}))
+    return hits
+
+def rrf_fuse(rankings: List[List[int]], k: int, rrf_k: int = RRF_K) -> List[Tuple[int, float]]:
+    """Reciprocal rank fusion: sum of 1 / (rrf_k + rank) over the rankings."""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, vid in enumerate(ranking, 1):
+            scores[vid] = scores.get(vid, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda kv: -kv[1])[:k]
+
+def search_hybrid(query: str, qvec: np.ndarray, k: int = 5, nprobe: Optional[int] = None,
+                  ef_search: Optional[int] = None, folders: Optional[List[str]] = None,
+                  rerank_hits: Optional[bool] = None) -> List[Tuple[int, float, Dict]]:
+    """
+    Fuse BM25 and vector rankings (vector order alone without lexical hits),
+    then re-rank the fused candidates unless rerank_hits is False.
+    """
+    shards, chunks = get_resources()
+    second = RERANK if rerank_hits is None else rerank_hits
+    keep = k * rerank.RERANK_FACTOR if second else k
+    n = max(k * CANDIDATE_FACTOR, keep)
+    vector = _vector_hits(_select_shards(shards, folders), qvec, n, nprobe, ef_search)
+    with metrics.span("lexical_search"):
+        lexical = chunks.lexical_search(query, n, folders=folders)
+    fused = _with_meta(chunks, rrf_fuse([[vid for vid, _ in vector], [vid for vid, _ in lexical]], keep),
+                       folders)
+    return _second_stage(shards, query, qvec, fused, k) if second else fused
+
+def _vector_hits_batch(shards: List[Dict], qmat: np.ndarray, k: int) -> List[List[Tuple[int, float]]]:
+    """_vector_hits for every row of qmat: one matrix search per shard."""
+    per_query: List[List[Tuple[int, float]]] = [[] for _ in range(len(qmat))]
+    with metrics.span("vector_search"):
+        for shard in shards:
+            index = shard["index"]
+            if index.ntotal == 0:
+                continue
+            D, I = index.search(qmat, min(k, index.ntotal), params=search_parameters(shard["params"]))
+            for hits, dists, ids in zip(per_query, D, I):
+                hits.extend((int(idx), float(dist)) for dist, idx in zip(dists, ids) if idx != -1)
+    return [heapq.nsmallest(k, hits, key=lambda h: h[1]) for hits in per_query]
+
+def search_hybrid_batch(queries: List[str], qmat: np.ndarray, k: int = 5,
+                        folders: Optional[List[str]] = None,
+                        rerank_hits: Optional[bool] = None) -> List[List[Tuple[int, float, Dict]]]:
+    """
+    search_hybrid for many queries at once (qmat holds their vectors as
+    rows): each shard is searched once with the whole matrix, and chunk
+    metadata for every query's candidates is fetched in one lookup.
+    """
+    shards, chunks = get_resources()
+    second = RERANK if rerank_hits is None else rerank_hits
+    keep = k * rerank.RERANK_FACTOR if second else k
+    n = max(k * CANDIDATE_FACTOR, keep)
+    qmat = np.ascontiguousarray(qmat, dtype=np.float32)
+    vector = _vector_hits_batch(_select_shards(shards, folders), qmat, n)
+    with metrics.span("lexical_search"):
+        lexical = [chunks.lexical_search(q, n, folders=folders) for q in queries]
+    fused = [rrf_fuse([[vid for vid, _ in v], [vid for vid, _ in lx]], keep) for v, lx in zip(vector, lexical)]
+    with metrics.span("fetch_chunks"):
+        metas = chunks.get_many({vid for hits in fused for vid, _ in hits})
+    out = []
+    for query, qvec, hits in zip(queries, qmat, fused):
+        hits = [(vid, score, metas[vid]) for vid, score in hits
+                if vid in metas and (folders is None or metas[vid].get("folder") in folders)]
+        out.append(_second_stage(shards, query, qvec, hits, k) if second else hits)
+    return out
 
 if __name__ == "__main__":
     query = "What decisions were made in the August meetings?"
     hits = search(query, k=5)
-    for i, (vid, dist, meta) in enumerate(hits, 1):
-        print(f"{i}. ID={vid}  Distance={dist:.4f}  File={meta.get('filename')}  Chunk={meta.get('chunk_id')}")
+    for i, (vid, score, meta) in enumerate(hits, 1):
+        print(f"{i}. ID={vid}  Score={score:.4f}  File={meta.get('filename')}  Chunk={meta.get('chunk_id')}")
         print(meta.get("text_preview", "")[:300], "\n---")
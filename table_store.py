@@ -0,0 +1,194 @@
+"""
+Side store for numeric spreadsheet tables, for exact lookups.
+
+Embeddings are a poor way to answer "what was EU revenue in March": the
+spreadsheet ingester embeds a capped, compact rendering of each sheet, and
+keeps the full rows of numeric sheets here, in SQLite. Workbooks are keyed
+by the MD5 of their bytes (the same value as Drive's md5Checksum), so
+extraction workers can write without knowing file names; file_parser links
+each key to its Drive file and prunes keys no longer referenced. Answers
+add the rows whose label a question names to the retrieved sources
+(semantic_search.table_hits).
+
+    python table_store.py "Revenue"          # rows whose label matches
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+TABLES_PATH = Path(os.getenv("TABLES_PATH", "parsed_data/_tables.sqlite"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheets (
+    workbook TEXT NOT NULL,
+    sheet    TEXT NOT NULL,
+    header   TEXT NOT NULL,
+    n_rows   INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (workbook, sheet)
+);
+CREATE TABLE IF NOT EXISTS table_rows (
+    workbook TEXT NOT NULL,
+    sheet    TEXT NOT NULL,
+    row_idx  INTEGER NOT NULL,
+    label    TEXT,
+    cells    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS table_rows_by_sheet ON table_rows(workbook, sheet, row_idx);
+CREATE INDEX IF NOT EXISTS table_rows_by_label ON table_rows(label COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS sources (
+    workbook TEXT NOT NULL,
+    name     TEXT NOT NULL,
+    folder   TEXT,
+    PRIMARY KEY (workbook, name)
+);
+"""
+
+
+class TableStore:
+    def __init__(self, path: Path = TABLES_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Per thread; extraction worker processes each open their own store
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---- writes (extraction workers) ----
+    def begin_workbook(self, workbook: str):
+        """Drop any earlier extraction of this workbook; rows are re-added."""
+        conn = self._conn()
+        conn.execute("DELETE FROM table_rows WHERE workbook = ?", (workbook,))
+        conn.execute("DELETE FROM sheets WHERE workbook = ?", (workbook,))
+
+    def add_sheet(self, workbook: str, sheet: str, header: Sequence[str]):
+        self._conn().execute("INSERT OR REPLACE INTO sheets (workbook, sheet, header) VALUES (?, ?, ?)",
+                             (workbook, sheet, json.dumps(list(header))))
+
+    def add_rows(self, workbook: str, sheet: str, rows: Iterable[tuple]):
+        """rows of (row_idx, cells); the first cell is the row label."""
+        self._conn().executemany(
+            "INSERT INTO table_rows (workbook, sheet, row_idx, label, cells) VALUES (?, ?, ?, ?, ?)",
+            [(workbook, sheet, idx, None if not cells or cells[0] is None else str(cells[0]),
+              json.dumps(list(cells), default=str)) for idx, cells in rows])
+
+    def finish_sheet(self, workbook: str, sheet: str, n_rows: int):
+        self._conn().execute("UPDATE sheets SET n_rows = ? WHERE workbook = ? AND sheet = ?",
+                             (n_rows, workbook, sheet))
+
+    def commit(self):
+        self._conn().commit()
+
+    # ---- links (file_parser main process) ----
+    def link(self, workbook: str, name: str, folder: Optional[str] = None):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO sources (workbook, name, folder) VALUES (?, ?, ?)",
+                     (workbook, name, folder))
+        conn.commit()
+
+    def prune(self, keep: Iterable[str]):
+        """Drop workbooks (and links) not in keep, e.g. files deleted from Drive."""
+        keep = set(keep)
+        conn = self._conn()
+        stored = {r[0] for r in conn.execute("SELECT DISTINCT workbook FROM sheets")}
+        stored |= {r[0] for r in conn.execute("SELECT DISTINCT workbook FROM sources")}
+        gone = [(wb,) for wb in stored - keep]
+        if gone:
+            conn.executemany("DELETE FROM table_rows WHERE workbook = ?", gone)
+            conn.executemany("DELETE FROM sheets WHERE workbook = ?", gone)
+            conn.executemany("DELETE FROM sources WHERE workbook = ?", gone)
+            conn.commit()
+        return len(gone)
+
+    # ---- reads ----
+    def lookup(self, label: str, limit: int = 20, exact: bool = False) -> List[Dict]:
+        """Rows whose label (first cell) equals or contains `label`, with their header."""
+        pattern = label if exact else f"%{label}%"
+        op = "=" if exact else "LIKE"
+        rows = self._conn().execute(
+            f"SELECT r.workbook, r.sheet, r.row_idx, r.cells, s.header, "
+            f"(SELECT name FROM sources WHERE workbook = r.workbook LIMIT 1) "
+            f"FROM table_rows r JOIN sheets s ON s.workbook = r.workbook AND s.sheet = r.sheet "
+            f"WHERE r.label {op} ? COLLATE NOCASE ORDER BY r.workbook, r.sheet, r.row_idx LIMIT ?",
+            (pattern, int(limit))).fetchall()
+        return [{"workbook": wb, "file": name, "sheet": sheet, "row": idx,
+                 "values": dict(zip(json.loads(header), json.loads(cells)))}
+                for wb, sheet, idx, cells, header, name in rows]
+
+    def find_rows(self, labels: Sequence[str], limit: int = 20,
+                  folders: Optional[Sequence[str]] = None) -> List[Dict]:
+        """
+        Rows whose label is one of labels (ignoring case), longest label
+        first, from workbooks linked to a Drive file (in folders, if given).
+        """
+        labels = list(dict.fromkeys(labels))
+        if not labels:
+            return []
+        folder_sql = "" if folders is None else f" AND folder IN ({', '.join('?' * len(folders))})"
+        rows = self._conn().execute(
+            f"SELECT r.rowid, r.workbook, r.sheet, r.row_idx, r.label, r.cells, s.header, src.name, src.folder "
+            f"FROM table_rows r JOIN sheets s ON s.workbook = r.workbook AND s.sheet = r.sheet "
+            f"JOIN sources src ON src.rowid = (SELECT rowid FROM sources WHERE workbook = r.workbook"
+            f"{folder_sql} LIMIT 1) "
+            f"WHERE r.label COLLATE NOCASE IN ({', '.join('?' * len(labels))}) "
+            f"ORDER BY length(r.label) DESC, r.workbook, r.sheet, r.row_idx LIMIT ?",
+            [*(folders or []), *labels, int(limit)]).fetchall()
+        return [{"id": rowid, "workbook": wb, "file": name, "folder": folder, "sheet": sheet,
+                 "row": idx, "label": label, "values": dict(zip(json.loads(header), json.loads(cells)))}
+                for rowid, wb, sheet, idx, label, cells, header, name, folder in rows]
+
+    def iter_rows(self, workbook: str, sheet: str, batch: int = 1000):
+        cur = self._conn().execute(
+            "SELECT row_idx, cells FROM table_rows WHERE workbook = ? AND sheet = ? ORDER BY row_idx",
+            (workbook, sheet))
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows:
+                return
+            for idx, cells in rows:
+                yield idx, json.loads(cells)
+
+    def sheets(self, workbook: Optional[str] = None) -> List[Dict]:
+        query = "SELECT workbook, sheet, header, n_rows FROM sheets"
+        params: tuple = ()
+        if workbook is not None:
+            query += " WHERE workbook = ?"
+            params = (workbook,)
+        return [{"workbook": wb, "sheet": sh, "header": json.loads(h), "n_rows": n}
+                for wb, sh, h, n in self._conn().execute(query, params)]
+
+
+_stores: Dict[int, TableStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_table_store() -> TableStore:
+    """One store per process (extraction runs in worker processes)."""
+    pid = os.getpid()
+    if pid not in _stores:
+        with _stores_lock:
+            if pid not in _stores:
+                _stores[pid] = TableStore()
+    return _stores[pid]
+
+
+if __name__ == "__main__":
+    term = " ".join(sys.argv[1:])
+    if not term:
+        print('Usage: python table_store.py "<row label>"')
+        sys.exit(1)
+    for hit in get_table_store().lookup(term):
+        print(f"{hit['file'] or hit['workbook'][:8]} / {hit['sheet']} row {hit['row']}: {hit['values']}")